@@ -0,0 +1,927 @@
+"""Assignment 2: Benchmarks for the treemap code
+
+=== Module Description ===
+This module contains small timing benchmarks for the slower parts of the
+treemap code. Each benchmark prints its timings, so the module can be run
+directly and its output compared before and after a change.
+
+The file system benchmarks build a synthetic directory tree in a temporary
+directory, so they do not depend on the contents of your computer.
+"""
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+from tm_trees import ChessTree, ScanCache, TMTree, \
+    dir_tree_from_nested_tuple, iter_games, moves_to_nested_dict, \
+    ordered_listdir, path_to_dir_tree, path_to_nested_tuple, position_fen, \
+    scan_path, slice_layout, squarified_layout, url_from_fen, url_from_moves
+import tm_trees
+import tm_compact
+from tm_compact import CompactTree
+
+
+def _peak_memory(function: Callable) -> int:
+    """
+    Return the peak number of bytes allocated while calling <function>.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _retained_memory(function: Callable) -> int:
+    """
+    Return the number of bytes still allocated by <function> once it has
+    returned, while its return value is alive.
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        size = tracemalloc.get_traced_memory()[0]
+        del result
+        return size
+    finally:
+        tracemalloc.stop()
+
+
+def _time(function: Callable, repeat: int = 3) -> float:
+    """
+    Return the best time, in seconds, of <repeat> calls to <function>.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_synthetic_directory(root: str, depth: int, fanout: int,
+                             files_per_dir: int) -> int:
+    """
+    Create a directory tree under <root> that is <depth> directories deep,
+    where every directory has <fanout> subdirectories and <files_per_dir>
+    small files. Return the number of files created.
+    """
+    count = 0
+    pending = [(root, 0)]
+    while pending:
+        path, level = pending.pop()
+        for i in range(files_per_dir):
+            with open(os.path.join(path, f"file{i}.txt"), 'w') as file:
+                file.write('x' * i)
+            count += 1
+        if level < depth:
+            for i in range(fanout):
+                sub_path = os.path.join(path, f"dir{i}")
+                os.mkdir(sub_path)
+                pending.append((sub_path, level + 1))
+    return count
+
+
+def listdir_nested_tuple(path: str) -> tuple[str, int | list]:
+    """
+    Return the nested tuple for <path> the way path_to_nested_tuple used to,
+    with ordered_listdir, os.path.isdir and os.path.getsize on one thread.
+    This is kept only as a baseline for bench_scan.
+    """
+    subitems = []
+    for filename in ordered_listdir(path):
+        subitem = os.path.join(path, filename)
+        if os.path.isdir(subitem):
+            subitems.append(listdir_nested_tuple(subitem))
+        else:
+            subitems.append((filename, 1 + os.path.getsize(subitem)))
+    return os.path.basename(path), subitems
+
+
+def bench_scan(depth: int = 4, fanout: int = 6,
+               files_per_dir: int = 10) -> None:
+    """
+    Compare listdir_nested_tuple against scan_path on a synthetic tree.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        num_files = make_synthetic_directory(root, depth, fanout,
+                                             files_per_dir)
+        expected = listdir_nested_tuple(root)
+        assert scan_path(root) == expected
+        print(f"scan of {num_files} files:")
+        print(f"  listdir (old):        "
+              f"{_time(lambda: listdir_nested_tuple(root)):.3f}s")
+        print(f"  scan_path, 1 thread:  "
+              f"{_time(lambda: scan_path(root, 1)):.3f}s")
+        print(f"  scan_path, pool:      "
+              f"{_time(lambda: scan_path(root)):.3f}s")
+
+
+def bench_build_dir_tree(depth: int = 4, fanout: int = 6,
+                         files_per_dir: int = 10) -> None:
+    """
+    Compare building a DirectoryTree through a nested tuple against building
+    it directly with path_to_dir_tree, for time and peak memory.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        num_files = make_synthetic_directory(root, depth, fanout,
+                                             files_per_dir)
+
+        def two_pass() -> None:
+            dir_tree_from_nested_tuple(path_to_nested_tuple(root))
+
+        def one_pass() -> None:
+            path_to_dir_tree(root)
+
+        print(f"DirectoryTree of {num_files} files:")
+        for label, function in [('nested tuple', two_pass),
+                                ('single pass ', one_pass)]:
+            print(f"  {label}: {_time(function):.3f}s, "
+                  f"peak {_peak_memory(function) / 2 ** 20:.1f} MiB")
+
+
+def build_synthetic_tmtree(num_leaves: int, fanout: int = 10) -> TMTree:
+    """
+    Return a TMTree with <num_leaves> leaves, in which every internal node
+    has <fanout> subtrees.
+    """
+    level = [TMTree(f"leaf{i}", [], i % 97 + 1) for i in range(num_leaves)]
+    while len(level) > 1:
+        level = [TMTree(f"node{i}", level[i:i + fanout], 1)
+                 for i in range(0, len(level), fanout)]
+    return level[0]
+
+
+def build_synthetic_compact_tree(num_leaves: int,
+                                 fanout: int = 10) -> CompactTree:
+    """
+    Return a CompactTree with the same shape as
+    build_synthetic_tmtree(<num_leaves>, <fanout>).
+    """
+    store = CompactTree()
+    level = [store.add_node(f"leaf{i}", [], i % 97 + 1)
+             for i in range(num_leaves)]
+    while len(level) > 1:
+        level = [store.add_node(f"node{i}", level[i:i + fanout], 1)
+                 for i in range(0, len(level), fanout)]
+    store.root = level[0]
+    return store
+
+
+def bench_tree_memory(num_leaves: int = 200_000) -> None:
+    """
+    Compare the memory used per node by a laid out TMTree and CompactTree of
+    the same shape. Names are counted in both.
+    """
+    def tmtree() -> TMTree:
+        tree = build_synthetic_tmtree(num_leaves)
+        tree.update_rectangles((0, 0, 1024, 768))
+        return tree
+
+    def compact() -> CompactTree:
+        store = build_synthetic_compact_tree(num_leaves)
+        store.update_rectangles(store.root, (0, 0, 1024, 768))
+        return store
+
+    num_nodes = len(compact())
+    print(f"memory for a tree of {num_nodes} nodes:")
+    for label, function in [('TMTree     ', tmtree),
+                            ('CompactTree', compact)]:
+        size = _retained_memory(function)
+        print(f"  {label}: {size / 2 ** 20:.1f} MiB, "
+              f"{size / num_nodes:.0f} bytes per node")
+
+
+def bench_get_rectangles(num_leaves: int = 200_000) -> None:
+    """
+    Time building the draw list of a synthetic tree, and reusing it.
+    """
+    tree = build_synthetic_tmtree(num_leaves)
+    tree.update_rectangles((0, 0, 1024, 768))
+    first = _time(lambda: (tree.update_rectangles(tree.rect),
+                           tree.get_rectangles()), repeat=1)
+    cached = _time(tree.get_rectangles)
+    print(f"get_rectangles on {num_leaves} leaves: layout + first call "
+          f"{first:.3f}s, cached call {cached * 1e6:.1f}us")
+
+
+def recursive_tree_at_position(tree: TMTree,
+                               pos: tuple[int, int]) -> TMTree | None:
+    """
+    Return the tree at <pos> the way TMTree.get_tree_at_position used to,
+    by recursing into every subtree that contains <pos>. This is kept only
+    as a baseline for bench_hit_testing.
+    """
+    x, y, width, height = tree.rect
+    if not (x <= pos[0] <= x + width and y <= pos[1] <= y + height):
+        return None
+    for subtree in tree._subtrees:
+        position = recursive_tree_at_position(subtree, pos)
+        if position is not None and position.is_displayed_tree_leaf():
+            return position
+    return tree
+
+
+def bench_hit_testing(num_leaves: int = 200_000,
+                      num_queries: int = 2_000) -> None:
+    """
+    Compare the old recursive hit test against get_tree_at_position with its
+    grid index, on a synthetic tree.
+    """
+    tree = build_synthetic_tmtree(num_leaves)
+    tree.update_rectangles((0, 0, 1024, 768))
+    positions = [(i * 7919 % 1024, i * 104729 % 768)
+                 for i in range(num_queries)]
+    old = _time(lambda: [recursive_tree_at_position(tree, pos)
+                         for pos in positions], repeat=1)
+    build = _time(lambda: (tree._invalidate_display(),
+                           tree.get_tree_at_position((0, 0))), repeat=1)
+    new = _time(lambda: [tree.get_tree_at_position(pos)
+                         for pos in positions])
+    print(f"{num_queries} hit tests on {num_leaves} leaves: "
+          f"recursive {old:.3f}s, indexed {new:.4f}s "
+          f"(+ {build:.3f}s to build the index once)")
+    leaves = tree._displayed_leaves()
+    leaf = leaves[len(leaves) // 2]
+    toggle = _time(lambda: (leaf.collapse().expand(),
+                            tree.get_tree_at_position((0, 0))))
+    print(f"  collapse, expand and hit test: {toggle * 1e6:.0f}us "
+          f"(the index is updated in place)")
+
+
+def bench_change_size(num_leaves: int = 200_000, presses: int = 20) -> None:
+    """
+    Time pressing UP on a leaf of a synthetic tree <presses> times, against
+    laying out the whole tree again after each press.
+    """
+    tree = build_synthetic_tmtree(num_leaves)
+    tree.update_rectangles((0, 0, 1024, 768))
+    leaf = tree
+    while leaf._subtrees:
+        leaf = leaf._subtrees[len(leaf._subtrees) // 2]
+
+    def incremental() -> None:
+        for _ in range(presses):
+            leaf.change_size(0.01)
+
+    def full() -> None:
+        for _ in range(presses):
+            leaf.change_size(0.01)
+            tree.update_rectangles(tree.rect)
+
+    print(f"{presses} size changes on {num_leaves} leaves: "
+          f"incremental {_time(incremental, repeat=1) * 1000:.1f}ms, "
+          f"full relayout {_time(full, repeat=1) * 1000:.1f}ms")
+
+
+def bench_lazy_layout(num_leaves: int = 200_000) -> None:
+    """
+    Time resizing a synthetic tree when only its top two levels are
+    expanded, against resizing the same tree when it is fully expanded.
+    """
+    tree = build_synthetic_tmtree(num_leaves)
+    tree.update_rectangles((0, 0, 1024, 768))
+    expanded = _time(lambda: tree.update_rectangles((0, 0, 1000, 750)))
+    stack = [subtree for child in tree._subtrees
+             for subtree in child._subtrees]
+    while stack:
+        subtree = stack.pop()
+        subtree._expanded = False
+        stack.extend(subtree._subtrees)
+    tree._invalidate_display()
+    collapsed = _time(lambda: tree.update_rectangles((0, 0, 1024, 768)))
+    print(f"resize of {num_leaves} leaves: fully expanded "
+          f"{expanded * 1000:.1f}ms, top two levels expanded "
+          f"{collapsed * 1000:.3f}ms")
+
+
+def _aspect_ratio_summary(tree: TMTree) -> str:
+    """
+    Return the mean and worst aspect ratio of the displayed leaves of <tree>
+    that have some area, and how many displayed leaves have none.
+    """
+    ratios = []
+    empty = 0
+    for (_, _, width, height), _ in tree.get_rectangles():
+        if width > 0 and height > 0:
+            ratios.append(max(width / height, height / width))
+        else:
+            empty += 1
+    return (f"mean aspect {sum(ratios) / len(ratios):.1f}, "
+            f"worst {max(ratios):.0f}, {empty} empty")
+
+
+def bench_layout_strategies(num_leaves: int = 1_000_000) -> None:
+    """
+    Compare slice_layout and squarified_layout on the wgm_999.json chess
+    games and on a synthetic tree, for layout time and the aspect ratios of
+    the displayed leaves.
+    """
+    with open('wgm_999.json') as file:
+        chess_tree = ChessTree(moves_to_nested_dict(json.load(file)))
+    trees = [('wgm_999.json', chess_tree),
+             (f"{num_leaves} leaves", build_synthetic_tmtree(num_leaves))]
+    for label, tree in trees:
+        print(f"layout of {label}:")
+        for strategy in [slice_layout, squarified_layout]:
+            tree.set_layout_strategy(strategy)
+            seconds = _time(lambda: tree.update_rectangles((0, 0, 1024, 768)),
+                            repeat=1)
+            print(f"  {strategy.__name__:17}: {seconds:.3f}s, "
+                  f"{_aspect_ratio_summary(tree)}")
+
+
+def bench_compact_layout(num_leaves: int = 1_000_000,
+                         fanouts: tuple[int, ...] = (10, 100, 1000)) -> None:
+    """
+    Time CompactTree.update_rectangles on synthetic trees with different
+    fanouts, with and without NumPy.
+    """
+    print(f"CompactTree layout of {num_leaves} leaves:")
+    for fanout in fanouts:
+        store = build_synthetic_compact_tree(num_leaves, fanout)
+        timings = []
+        saved = tm_compact.np
+        try:
+            for numpy in [None, saved]:
+                tm_compact.np = numpy
+                timings.append(_time(lambda: store.update_rectangles(
+                    store.root, (0, 0, 1920, 1080)), repeat=1))
+        finally:
+            tm_compact.np = saved
+        print(f"  fanout {fanout:4}: python {timings[0]:.3f}s, "
+              f"numpy {timings[1]:.3f}s")
+
+
+def bench_hover_rendering(num_leaves: int = 200_000,
+                          moves: int = 50) -> None:
+    """
+    Time moving the hover highlight between two leaves of a synthetic tree
+    <moves> times, redrawing the whole screen with render_display against
+    redrawing only what changed with a TreemapRenderer. The display is not
+    shown, so this can run without a window.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import treemap_visualiser
+
+    pygame.init()
+    try:
+        screen = pygame.display.set_mode((1024, 768))
+        tree = build_synthetic_tmtree(num_leaves)
+        renderer = treemap_visualiser.TreemapRenderer(screen, tree)
+        renderer.render()
+        leaves = [tree.get_tree_at_position((100, 100)),
+                  tree.get_tree_at_position((900, 600))]
+
+        def full() -> None:
+            for i in range(moves):
+                treemap_visualiser.render_display(screen, tree, None,
+                                                  leaves[i % 2])
+
+        def retained() -> None:
+            for i in range(moves):
+                renderer.render(None, leaves[i % 2])
+
+        print(f"{moves} hover changes on {num_leaves} leaves: "
+              f"render_display {_time(full, repeat=1):.3f}s, "
+              f"TreemapRenderer {_time(retained, repeat=1) * 1000:.1f}ms")
+    finally:
+        pygame.quit()
+
+
+def partition_moves_to_nested_dict(moves: list[list[str]]) -> dict:
+    """
+    Return the nested dictionary for <moves> the way moves_to_nested_dict
+    used to, by partitioning slices of the games at every ply. This is kept
+    only as a baseline for bench_moves_to_nested_dict.
+    """
+    grouped = {}
+    for game in moves:
+        if game:
+            grouped.setdefault(game[0], []).append(game[1:])
+    return {(move, sum(1 for rest in games if not rest)):
+            partition_moves_to_nested_dict(games)
+            for move, games in grouped.items()}
+
+
+def make_synthetic_games(num_games: int, length: int = 60) -> list[list[str]]:
+    """
+    Return <num_games> games of up to <length> made-up moves. Early moves are
+    picked from fewer choices than later ones, so that games share openings
+    the way real games do.
+    """
+    games = []
+    for i in range(num_games):
+        game = []
+        for ply in range(length - i % 7):
+            choices = min(2 + ply, 20)
+            game.append(f"m{(i * 7919 + ply * 104729) % choices}")
+        games.append(game)
+    return games
+
+
+def bench_moves_to_nested_dict(num_games: int = 20_000) -> None:
+    """
+    Compare partition_moves_to_nested_dict against moves_to_nested_dict on
+    wgm_999.json and on synthetic games.
+    """
+    with open('wgm_999.json') as file:
+        chess_games = json.load(file)
+    for label, games in [('wgm_999.json', chess_games),
+                         (f"{num_games} synthetic games",
+                          make_synthetic_games(num_games))]:
+        assert partition_moves_to_nested_dict(games) == \
+            moves_to_nested_dict(games)
+        old = _time(lambda: partition_moves_to_nested_dict(games), repeat=1)
+        new = _time(lambda: moves_to_nested_dict(games), repeat=1)
+        print(f"moves_to_nested_dict on {label}: partition {old:.3f}s, "
+              f"trie {new:.3f}s")
+
+
+def bench_chess_tree_loading(num_games: int = 20_000) -> None:
+    """
+    Compare loading a ChessTree through json.load, moves_to_nested_dict and
+    ChessTree against ChessTree.from_json_file, for time and peak memory, on
+    wgm_999.json and on a file of synthetic games.
+    """
+    def nested_dict(path: str) -> ChessTree:
+        with open(path) as file:
+            return ChessTree(moves_to_nested_dict(json.load(file)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic_path = os.path.join(directory, 'games.json')
+        with open(synthetic_path, 'w') as file:
+            json.dump(make_synthetic_games(num_games), file)
+        for label, path in [('wgm_999.json', 'wgm_999.json'),
+                            (f"{num_games} synthetic games", synthetic_path)]:
+            print(f"ChessTree of {label}:")
+            for name, function in [('nested dict   ', nested_dict),
+                                   ('from_json_file', ChessTree.from_json_file)]:
+                seconds = _time(lambda: function(path), repeat=1)
+                peak = _peak_memory(lambda: function(path))
+                print(f"  {name}: {seconds:.3f}s, "
+                      f"peak {peak / 2 ** 20:.1f} MiB")
+
+
+def bench_game_ingestion(num_games: int = 20_000) -> None:
+    """
+    Compare reading every game of a file at once (json.load for a JSON
+    array, a json.loads per line of a JSON lines file) against iterating
+    over iter_games, for time and peak memory, on synthetic games.
+    """
+    def load_array(path: str) -> int:
+        with open(path) as file:
+            return len(json.load(file))
+
+    def load_lines(path: str) -> int:
+        with open(path) as file:
+            return len([json.loads(line) for line in file.readlines()])
+
+    def stream_all(path: str) -> int:
+        return sum(1 for _ in iter_games(path))
+
+    games = make_synthetic_games(num_games)
+    with tempfile.TemporaryDirectory() as directory:
+        array_path = os.path.join(directory, 'games.json')
+        with open(array_path, 'w') as file:
+            json.dump(games, file)
+        lines_path = os.path.join(directory, 'games.jsonl')
+        with open(lines_path, 'w') as file:
+            file.writelines(json.dumps(game) + '\n' for game in games)
+        del games
+        for label, path, load_all in [('JSON array', array_path, load_array),
+                                      ('JSON lines', lines_path, load_lines)]:
+            print(f"Reading {num_games} games as {label}:")
+            for name, function in [('load all  ', load_all),
+                                   ('iter_games', stream_all)]:
+                seconds = _time(lambda: function(path), repeat=1)
+                peak = _peak_memory(lambda: function(path))
+                print(f"  {name}: {seconds:.3f}s, "
+                      f"peak {peak / 2 ** 20:.1f} MiB")
+
+
+def bench_parallel_chess_tree(num_games: int = 100_000) -> None:
+    """
+    Time ChessTree.from_games_parallel with different numbers of worker
+    processes against ChessTree.from_games, on synthetic games.
+    """
+    games = make_synthetic_games(num_games)
+    print(f"ChessTree of {num_games} synthetic games "
+          f"({os.cpu_count()} CPUs):")
+    print(f"  from_games            : "
+          f"{_time(lambda: ChessTree.from_games(games), repeat=1):.3f}s")
+    for workers in [2, 4, 8]:
+        seconds = _time(lambda: ChessTree.from_games_parallel(
+            games, max_workers=workers), repeat=1)
+        print(f"  from_games_parallel({workers}): {seconds:.3f}s")
+
+
+def bench_move_interning(num_games: int = 100_000) -> None:
+    """
+    Count the move strings kept by ChessTrees built from wgm_999.json and
+    from synthetic games, against one string per node.
+    """
+    for label, tree in [
+            ('wgm_999.json', ChessTree.from_json_file('wgm_999.json')),
+            (f"{num_games} synthetic games",
+             ChessTree.from_games(make_synthetic_games(num_games)))]:
+        names = {}
+        num_nodes = 0
+        per_node = 0
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            names[id(node._name)] = node._name
+            num_nodes += 1
+            per_node += sys.getsizeof(node._name)
+            stack.extend(node._subtrees)
+        shared = sum(sys.getsizeof(name) for name in names.values())
+        print(f"move names in the ChessTree of {label}: {num_nodes} nodes, "
+              f"{len(names)} strings, {shared / 2 ** 20:.2f} MiB instead of "
+              f"{per_node / 2 ** 20:.2f} MiB")
+
+
+def bench_position_fen(path: str = 'wgm_200.json') -> None:
+    """
+    Time finding the lichess url of every node of the ChessTree of the games
+    in <path>, in preorder, with url_from_moves against position_fen, and
+    exporting them all with ChessTree.export_positions.
+    """
+    tree = ChessTree.from_json_file(path)
+    nodes = []
+    stack = [(tree, [])]
+    while stack:
+        node, moves = stack.pop()
+        nodes.append((node, moves))
+        stack.extend((subtree, moves + [subtree._name])
+                     for subtree in reversed(node._subtrees))
+
+    def replayed() -> None:
+        for _, moves in nodes:
+            url_from_moves(moves)
+
+    def cached() -> None:
+        tree._tree_state = None
+        for node, _ in nodes:
+            url_from_fen(position_fen(node))
+
+    print(f"urls for the {len(nodes)} nodes of the ChessTree of {path}:")
+    exported = _time(lambda: tree.export_positions(io.StringIO()), repeat=1)
+    print(f"  url_from_moves  : {_time(replayed, repeat=1):.3f}s")
+    print(f"  position_fen    : {_time(cached, repeat=1):.3f}s")
+    print(f"  export_positions: {exported:.3f}s")
+
+
+def bench_transpositions(path: str = 'wgm_999.json') -> None:
+    """
+    Compare the build time and memory of the plain ChessTree of the games in
+    <path> against the transposition-aware one, before any of its views
+    below the root are made and once all of them are.
+    """
+    with open(path) as file:
+        games = json.load(file)
+
+    def count_nodes(tree: TMTree) -> int:
+        count = 0
+        stack = [tree]
+        while stack:
+            tree = stack.pop()
+            count += 1
+            stack.extend(tree._subtrees)
+        return count
+
+    def expanded() -> ChessTree:
+        tree = ChessTree.from_games(games, transpositions=True)
+        count_nodes(tree)
+        return tree
+
+    positions = set()
+    stack = [ChessTree.from_games(games, transpositions=True)._position]
+    while stack:
+        position = stack.pop()
+        if id(position) not in positions:
+            positions.add(id(position))
+            stack.extend(position.moves.values())
+    print(f"ChessTree of {path}: {count_nodes(ChessTree.from_games(games))} "
+          f"nodes, {len(positions)} positions, "
+          f"{count_nodes(expanded())} nodes in all views")
+    for label, function in [
+            ('plain      ', lambda: ChessTree.from_games(games)),
+            ('positions  ',
+             lambda: ChessTree.from_games(games, transpositions=True)),
+            ('all views  ', expanded)]:
+        seconds = _time(function, repeat=1)
+        size = _retained_memory(function)
+        print(f"  {label}: {seconds:.3f}s, {size / 2 ** 20:.1f} MiB")
+
+
+def bench_pruned_chess_tree(path: str = 'wgm_999.json') -> None:
+    """
+    Compare the number of nodes, build time, layout time and memory of the
+    ChessTree of the games in <path> with and without pruning.
+    """
+    with open(path) as file:
+        games = json.load(file)
+
+    def lay_out(tree: ChessTree) -> None:
+        tree.update_rectangles((0, 0, 1024, 768))
+        tree.get_rectangles()
+
+    print(f"pruned ChessTrees of {path}:")
+    for max_depth, min_games in [(None, 1), (20, 1), (None, 3), (12, 2)]:
+        def build() -> ChessTree:
+            return ChessTree.from_games(games, max_depth=max_depth,
+                                        min_games=min_games)
+        tree = build()
+        num_nodes = 0
+        stack = [tree]
+        while stack:
+            num_nodes += 1
+            stack.extend(stack.pop()._subtrees)
+        print(f"  max_depth={max_depth}, min_games={min_games}: "
+              f"{num_nodes} nodes, build {_time(build, repeat=1):.3f}s, "
+              f"layout {_time(lambda: lay_out(tree), repeat=1):.3f}s, "
+              f"{_retained_memory(build) / 2 ** 20:.1f} MiB")
+
+
+def bench_event_loop_cpu(seconds: float = 3.0,
+                         motion_per_second: int = 500) -> None:
+    """
+    Measure the CPU time used by treemap_visualiser.event_loop, as a share of
+    the wall time it runs for, while no events arrive and while mouse motion
+    events arrive <motion_per_second> times a second. Events are posted from
+    another thread, and the display is not shown.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import contextlib
+    import threading
+    import pygame
+    import treemap_visualiser
+
+    def post_events(rate: int) -> None:
+        end = time.perf_counter() + seconds
+        count = 0
+        while time.perf_counter() < end:
+            if rate:
+                pos = ((count * 37) % 500, (count * 53) % 280)
+                pygame.event.post(pygame.event.Event(
+                    pygame.MOUSEMOTION, pos=pos, rel=(1, 1), buttons=(0, 0, 0)))
+                count += 1
+                time.sleep(1 / rate)
+            else:
+                time.sleep(0.05)
+        pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+    pygame.init()
+    try:
+        screen = pygame.display.set_mode((treemap_visualiser.WIDTH,
+                                          treemap_visualiser.HEIGHT))
+        tree = ChessTree.from_json_file('wgm_200.json')
+        tree.update_rectangles(treemap_visualiser.get_screen_rect(
+            screen, treemap_visualiser.FONT_ROWS))
+        print(f"CPU used by event_loop over {seconds:.0f}s:")
+        for label, rate in [('idle        ', 0),
+                            ('mouse motion', motion_per_second)]:
+            pygame.event.clear()
+            thread = threading.Thread(target=post_events, args=(rate,))
+            start, start_cpu = time.perf_counter(), time.process_time()
+            thread.start()
+            with contextlib.redirect_stdout(io.StringIO()):
+                treemap_visualiser.event_loop(screen, tree,
+                                              treemap_visualiser.FONT_ROWS)
+            thread.join()
+            cpu = time.process_time() - start_cpu
+            print(f"  {label}: {cpu / (time.perf_counter() - start):.0%}")
+    finally:
+        pygame.quit()
+
+
+def bench_text_rendering(frames: int = 200) -> None:
+    """
+    Time drawing the text bar for <frames> frames that cycle through a few
+    texts, loading the font and rendering the text on every frame as
+    _render_text used to, against _render_text with its FontManager.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import treemap_visualiser
+    from treemap_visualiser import FONT_FAMILY, FONT_HEIGHT, FONT_OFFSET
+
+    def uncached(screen: pygame.Surface, text: str) -> None:
+        font = pygame.font.SysFont(FONT_FAMILY, FONT_HEIGHT - 2 * FONT_OFFSET)
+        text_width, _ = font.size(text)
+        height = int(1 + text_width / screen.get_width())
+        n_char = int(1 + len(text) / height)
+        for h in range(height):
+            screen.blit(font.render(text[h * n_char:(h + 1) * n_char],
+                                    treemap_visualiser.ANTI_ALIAS,
+                                    treemap_visualiser.WHITE), (0, h * 30))
+
+    pygame.init()
+    try:
+        screen = pygame.display.set_mode((treemap_visualiser.WIDTH,
+                                          treemap_visualiser.HEIGHT))
+        texts = [f"- | e2e4 | e7e5 | g1f3 | b8c6 ({i})  (0, 0, 550, 300)"
+                 for i in range(8)]
+        for label, function in [('SysFont per frame', uncached),
+                                ('FontManager      ',
+                                 treemap_visualiser._render_text)]:
+            seconds = _time(lambda: [function(screen, texts[i % len(texts)])
+                                     for i in range(frames)])
+            print(f"text bar, {label}: "
+                  f"{seconds / frames * 1e6:.0f}us per frame")
+    finally:
+        pygame.quit()
+
+
+def prepend_path_string(tree: TMTree) -> str:
+    """
+    Return tree.get_path_string() for a TMTree the way it used to be built,
+    by putting each ancestor's name in front of the string so far. This is
+    kept only as a baseline for bench_path_strings.
+    """
+    string = f"{tree._name}({tree.data_size}) {tree.rect}"
+    while tree._parent_tree is not None:
+        tree = tree._parent_tree
+        string = f"{tree._name}{tree.get_separator()}" + string
+    return string
+
+
+def build_comb_tree(depth: int) -> TMTree:
+    """
+    Return a tree that is a path of <depth> trees, each with a leaf beside
+    the next one, laid out.
+    """
+    tree = TMTree('leaf', [], 1)
+    for i in range(depth):
+        tree = TMTree(f"node{i}", [TMTree(f"leaf{i}", [], 1), tree])
+    tree.update_rectangles((0, 0, 1024, 768))
+    return tree
+
+
+def bench_path_strings(depth: int = 800, repeat: int = 3) -> None:
+    """
+    Time finding the path string of every node of a tree that is a path of
+    <depth> trees, each with a leaf beside the next one, <repeat> times
+    over, by prepending names against with cached path prefixes.
+    """
+    tree = build_comb_tree(depth)
+    nodes = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node._subtrees)
+    assert all(prepend_path_string(node) == node.get_path_string()
+               for node in nodes[::50])
+
+    def prepended() -> None:
+        for _ in range(repeat):
+            for node in nodes:
+                prepend_path_string(node)
+
+    def cached() -> None:
+        for node in nodes:
+            node._path_prefix = None
+        for _ in range(repeat):
+            for node in nodes:
+                node.get_path_string()
+
+    print(f"path strings of {len(nodes)} nodes, {repeat} times, "
+          f"depth {depth}: prepended {_time(prepended, repeat=1):.3f}s, "
+          f"cached prefixes {_time(cached, repeat=1):.3f}s")
+
+
+def concatenated_str(tree: TMTree, indent: int = 0) -> str:
+    """
+    Return str(tree) for a TMTree the way it used to be built, by adding the
+    strings of the subtrees onto the string so far. This is kept only as a
+    baseline for bench_write_tree.
+    """
+    result = f"{indent * '    '}{tree._name}"
+    if tree._subtrees:
+        result += tree.get_separator()
+    result += f"({tree.data_size}) {tree.rect}\n"
+    for subtree in tree._subtrees:
+        result += concatenated_str(subtree, indent + 1)
+    return result
+
+
+def bench_write_tree(num_leaves: int = 200_000, depth: int = 900) -> None:
+    """
+    Time str of a laid out synthetic tree of <num_leaves> leaves and of a
+    comb tree of <depth>, built by concatenation against the iterative
+    writer, and time writing them to a file with write_tree.
+    """
+    synthetic = build_synthetic_tmtree(num_leaves)
+    synthetic.update_rectangles((0, 0, 1024, 768))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tree.txt')
+        for label, tree in [(f"{num_leaves} leaves", synthetic),
+                            (f"a comb of depth {depth}",
+                             build_comb_tree(depth))]:
+            assert concatenated_str(tree).rstrip() == str(tree)
+
+            def write() -> None:
+                with open(path, 'w') as file:
+                    tree.write_tree(file)
+
+            print(f"str of {label}: "
+                  f"concatenated {_time(lambda: concatenated_str(tree)):.3f}s,"
+                  f" joined {_time(lambda: str(tree)):.3f}s, "
+                  f"write_tree to a file {_time(write):.3f}s")
+
+
+def bench_snapshots(num_leaves: int = 1_000_000) -> None:
+    """
+    Time building a synthetic CompactTree of <num_leaves> leaves and the
+    largest chess data set against saving them to a snapshot and loading it.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tree.tmsnap')
+        for label, build in [
+                (f"{num_leaves} leaves",
+                 lambda: build_synthetic_compact_tree(num_leaves)),
+                ("wgm_999.json", lambda: CompactTree.from_tmtree(
+                    ChessTree.from_json_file('wgm_999.json')))]:
+            start = time.perf_counter()
+            store = build()
+            built = time.perf_counter() - start
+            saved = _time(lambda: store.save_snapshot(path), repeat=1)
+            loaded = _time(lambda: CompactTree.load_snapshot(path))
+            assert CompactTree.load_snapshot(path).names == store.names
+            print(f"snapshot of {label} ({len(store)} nodes, "
+                  f"{os.path.getsize(path) / 2 ** 20:.1f} MiB): "
+                  f"build {built:.3f}s, save {saved:.3f}s, "
+                  f"load {loaded:.3f}s")
+
+
+def bench_rescan(depth: int = 4, fanout: int = 6,
+                 files_per_dir: int = 10) -> None:
+    """
+    Compare a full scan of a synthetic tree against rescanning it through a
+    ScanCache loaded from disk, with nothing changed and with one directory
+    changed.
+    """
+    with tempfile.TemporaryDirectory() as root, \
+            tempfile.TemporaryDirectory() as directory:
+        num_files = make_synthetic_directory(root, depth, fanout,
+                                             files_per_dir)
+        # the cache skips directories modified in the last few seconds
+        old = time.time_ns() - 10 * tm_trees.RACY_MTIME_NS
+        for path, _, _ in os.walk(root):
+            os.utime(path, ns=(old, old))
+        cache_path = os.path.join(directory, 'scan.json')
+        cache = ScanCache(cache_path)
+        expected = scan_path(root, 1, cache)
+        cache.save()
+        assert scan_path(root, 1, ScanCache(cache_path)) == expected
+        print(f"rescan of {num_files} files:")
+        print(f"  full scan:                "
+              f"{_time(lambda: scan_path(root, 1)):.3f}s")
+        cached = _time(lambda: scan_path(root, 1, ScanCache(cache_path)))
+        print(f"  load cache and rescan:    {cached:.3f}s")
+        forced = _time(lambda: scan_path(
+            root, 1, ScanCache(cache_path, rescan=True)))
+        print(f"  load cache, force rescan: {forced:.3f}s")
+        cache = ScanCache(cache_path)
+        changed = os.path.join(root, 'dir0')
+        with open(os.path.join(changed, 'new.txt'), 'w') as file:
+            file.write('new')
+        assert scan_path(root, 1, cache) == scan_path(root, 1)
+        print(f"  rescan, one dir changed:  "
+              f"{_time(lambda: scan_path(root, 1, cache)):.3f}s")
+
+
+if __name__ == '__main__':
+    bench_scan()
+    bench_build_dir_tree()
+    bench_tree_memory()
+    bench_get_rectangles()
+    bench_hit_testing()
+    bench_change_size()
+    bench_lazy_layout()
+    bench_layout_strategies()
+    bench_compact_layout()
+    bench_hover_rendering()
+    bench_moves_to_nested_dict()
+    bench_chess_tree_loading()
+    bench_game_ingestion()
+    bench_parallel_chess_tree()
+    bench_move_interning()
+    bench_position_fen()
+    bench_transpositions()
+    bench_pruned_chess_tree()
+    bench_event_loop_cpu()
+    bench_text_rendering()
+    bench_path_strings()
+    bench_write_tree()
+    bench_snapshots()
+    bench_rescan()
@@ -1,14 +1,21 @@
 import unittest
 
+import csv
+import io
+import json
 import os
 import pytest
 from hypothesis import given
 from hypothesis.strategies import integers
 from typing import Tuple
+from tm_compact import NUMPY_MIN_CHILDREN, CompactTree
 from tm_trees import DIRECTORYTREE_EXAMPLE_RESULT, FileTree, TMTree, \
     DirectoryTree, dir_tree_from_nested_tuple, path_to_nested_tuple, \
     ChessTree, get_worksheet_tree, moves_to_nested_dict, \
-    OperationNotSupportedError
+    OperationNotSupportedError, scan_path, path_to_dir_tree, slice_layout, \
+    squarified_layout, iter_games, position_fen, url_from_fen, \
+    url_from_moves, ChessPositionView, PRUNED_MOVES, ScanCache
+import tm_trees
 
 # This should be the path to the "workshop" directory in the sample data
 # included in the zip file for this assignment.
@@ -20,6 +27,17 @@ EXAMPLE_PATH = os.path.join('example-directory', 'workshop')
 ##############################################################################
 
 
+def _preorder(tree: TMTree) -> list[TMTree]:
+    """Return <tree> and all of its descendants, in preorder."""
+    nodes = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(reversed(node._subtrees))
+    return nodes
+
+
 def is_valid_colour(colour: Tuple[int, int, int]) -> bool:
     """
     Return True iff <colour> is a valid colour. That is, if all of its
@@ -458,5 +476,1081 @@ class TestDisplayedTreeLeaf:
         assert t3.data_size == 12
 
 
+class TestScanPath:
+    def test_scan_path_example_directory(self) -> None:
+        rslt = scan_path(EXAMPLE_PATH)
+        assert rslt == scan_path(EXAMPLE_PATH, 1)
+        assert rslt[0] == 'workshop'
+        assert [item[0] for item in rslt[1]] == ['activities', 'draft.pptx',
+                                                 'prep']
+
+    def test_scan_path_hidden_and_order(self, tmp_path) -> None:
+        (tmp_path / 'b.txt').write_text('abc')
+        (tmp_path / '.hidden').write_text('abc')
+        (tmp_path / 'a').mkdir()
+        (tmp_path / 'a' / 'c.txt').write_text('')
+        (tmp_path / 'a' / '.git').mkdir()
+        assert scan_path(str(tmp_path)) == \
+            (tmp_path.name, [('a', [('c.txt', 1)]), ('b.txt', 4)])
+
+    def test_scan_path_file(self, tmp_path) -> None:
+        (tmp_path / 'f.txt').write_text('abcd')
+        assert scan_path(str(tmp_path / 'f.txt')) == ('f.txt', 5)
+
+
+class TestPathToDirTree:
+    def test_path_to_dir_tree_matches_two_pass(self) -> None:
+        tree = path_to_dir_tree(EXAMPLE_PATH)
+        expected = dir_tree_from_nested_tuple(path_to_nested_tuple(
+            EXAMPLE_PATH))
+        assert isinstance(tree, DirectoryTree)
+        assert tree.data_size == expected.data_size
+        assert str(tree) == str(expected)
+        for subtree in tree._subtrees:
+            assert subtree._parent_tree is tree
+
+    def test_dir_tree_from_deep_nested_tuple(self) -> None:
+        obj = ('leaf', 3)
+        for i in range(5000):
+            obj = (f"d{i}", [obj])
+        tree = dir_tree_from_nested_tuple(obj)
+        assert tree.data_size == 5003
+        assert tree._name == 'd4999'
+
+
+class TestCompactTree:
+    def test_slots(self) -> None:
+        assert not hasattr(TMTree('A', [], 1), '__dict__')
+        assert not hasattr(FileTree('a.txt', [], 1), '__dict__')
+        assert not hasattr(ChessTree({('e2e4', 1): {}}), '__dict__')
+
+    def test_from_tmtree_matches(self) -> None:
+        tree = get_worksheet_tree()
+        store = CompactTree.from_tmtree(tree)
+        root = store.node(store.root)
+        assert str(root) == str(tree)
+        assert root.get_rectangles() == tree.get_rectangles()
+        assert root.get_tree_at_position((25, 5)).get_path_string() == \
+            tree.get_tree_at_position((25, 5)).get_path_string()
+
+    def test_views_are_shared(self) -> None:
+        store = CompactTree.from_tmtree(get_worksheet_tree())
+        root = store.node(store.root)
+        assert root.get_tree_at_position((0, 0)) is \
+            root.get_tree_at_position((1, 1))
+        assert root._subtrees[0]._parent_tree is root
+
+    def test_from_path_matches_dir_tree(self) -> None:
+        store = CompactTree.from_path(EXAMPLE_PATH)
+        root = store.node(store.root)
+        tree = path_to_dir_tree(EXAMPLE_PATH)
+        assert str(root) == str(tree)
+        root.update_rectangles((0, 0, 200, 100))
+        tree.update_rectangles((0, 0, 200, 100))
+        assert [r for r, _ in root.get_rectangles()] == \
+            [r for r, _ in tree.get_rectangles()]
+
+    def test_wide_layout_matches(self) -> None:
+        groups = [TMTree(f"g{i}", [TMTree(f"l{i}.{j}", [], (i * j) % 13 + 1)
+                                   for j in range(NUMPY_MIN_CHILDREN * 3)])
+                  for i in range(NUMPY_MIN_CHILDREN)]
+        tree = TMTree('root', groups, 1)
+        store = CompactTree.from_tmtree(tree)
+        root = store.node(store.root)
+        for rect in [(0, 0, 1920, 1080), (3, 4, 500, 1000)]:
+            root.update_rectangles(rect)
+            tree.update_rectangles(rect)
+            assert [r for r, _ in root.get_rectangles()] == \
+                [r for r, _ in tree.get_rectangles()]
+        assert root._subtrees[0].get_path_string() == \
+            tree._subtrees[0].get_path_string()
+
+    def test_move_and_change_size(self) -> None:
+        tree = get_worksheet_tree()
+        store = CompactTree.from_tmtree(tree)
+        root = store.node(store.root)
+        j = tree._subtrees[0]._subtrees[0]._subtrees[0]
+        f = tree._subtrees[0]._subtrees[1]
+        j.move(f)
+        root._subtrees[0]._subtrees[0]._subtrees[0].move(
+            root._subtrees[0]._subtrees[1])
+        assert str(root) == str(tree)
+        tree._subtrees[2].change_size(0.5)
+        root._subtrees[2].change_size(0.5)
+        assert str(root) == str(tree)
+
+    def test_draw_list_reused(self) -> None:
+        store = CompactTree.from_tmtree(get_worksheet_tree())
+        root = store.node(store.root)
+        before = root.get_rectangles()
+        assert root.get_rectangles() is before
+        leaf = root.get_tree_at_position((0, 0))
+        parent = leaf.collapse()
+        assert root.get_rectangles() is not before
+        assert len(root.get_rectangles()) == 6
+        parent.expand()
+        assert root.get_rectangles() == before
+        after = root.get_rectangles()
+        root._subtrees[2].change_size(0.5)
+        assert root.get_rectangles() is not after
+
+    def test_directory_operations_not_supported(self) -> None:
+        store = CompactTree.from_path(EXAMPLE_PATH)
+        root = store.node(store.root)
+        with pytest.raises(OperationNotSupportedError):
+            root._subtrees[0].change_size(0.5)
+
+
+class TestSnapshot:
+    def _round_trip(self, tree: TMTree, tmp_path) -> CompactTree:
+        path = os.path.join(tmp_path, 'tree.tmsnap')
+        CompactTree.from_tmtree(tree).save_snapshot(path)
+        return CompactTree.load_snapshot(path)
+
+    def test_worksheet_round_trip(self, tmp_path) -> None:
+        tree = get_worksheet_tree()
+        store = self._round_trip(tree, tmp_path)
+        root = store.node(store.root)
+        assert str(root) == str(tree)
+        assert root.get_rectangles() == tree.get_rectangles()
+
+    def test_directory_round_trip(self, tmp_path) -> None:
+        tree = path_to_dir_tree(EXAMPLE_PATH)
+        store = self._round_trip(tree, tmp_path)
+        root = store.node(store.root)
+        assert str(root) == str(tree)
+        leaf = root._subtrees[0]._subtrees[0]
+        assert leaf.get_path_string() == \
+            tree._subtrees[0]._subtrees[0].get_path_string()
+        with pytest.raises(OperationNotSupportedError):
+            root._subtrees[0].change_size(0.5)
+
+    def test_chess_round_trip(self, tmp_path) -> None:
+        tree = ChessTree({('e2e4', 1): {('e7e5', 1): {}},
+                          ('d2d4', 1): {('e7e5', 1): {}}})
+        store = self._round_trip(tree, tmp_path)
+        root = store.node(store.root)
+        assert str(root) == str(tree)
+        assert root._subtrees[0].get_suffix() == ' (black to play)'
+        assert store.names[2] is store.names[4]
+
+    def test_loaded_store_is_editable(self, tmp_path) -> None:
+        tree = get_worksheet_tree()
+        store = self._round_trip(tree, tmp_path)
+        root = store.node(store.root)
+        num_nodes = len(store)
+        tree._subtrees[0]._subtrees[0]._subtrees[0].move(
+            tree._subtrees[0]._subtrees[1])
+        root._subtrees[0]._subtrees[0]._subtrees[0].move(
+            root._subtrees[0]._subtrees[1])
+        store.add_node('extra', [], 2)
+        assert str(root) == str(tree)
+        assert len(store) == num_nodes + 1
+
+    def test_unicode_and_empty(self, tmp_path) -> None:
+        path = os.path.join(tmp_path, 'empty.tmsnap')
+        CompactTree().save_snapshot(path)
+        assert len(CompactTree.load_snapshot(path)) == 0
+        tree = TMTree('caf\u00e9', [TMTree('\udcff', [], 3)], 1)
+        assert str(self._round_trip(tree, tmp_path).node(0)) == str(tree)
+
+    def test_invalid_files(self, tmp_path) -> None:
+        path = os.path.join(tmp_path, 'bad.tmsnap')
+        with open(path, 'wb') as file:
+            file.write(b'not a snapshot at all, clearly not one at all')
+        with pytest.raises(ValueError):
+            CompactTree.load_snapshot(path)
+        CompactTree.from_tmtree(get_worksheet_tree()).save_snapshot(path)
+        with open(path, 'r+b') as file:
+            file.truncate(os.path.getsize(path) - 3)
+        with pytest.raises(ValueError):
+            CompactTree.load_snapshot(path)
+        for size in [0, 60]:
+            with open(path, 'r+b') as file:
+                file.truncate(size)
+            with pytest.raises(ValueError):
+                CompactTree.load_snapshot(path)
+        with pytest.raises(ValueError):
+            CompactTree.from_tmtree(TMTree('a\0b', [], 1)).save_snapshot(path)
+
+
+class TestDrawListCache:
+    def test_get_rectangles_reused(self) -> None:
+        tree = get_worksheet_tree()
+        assert tree.get_rectangles() is tree.get_rectangles()
+
+    def test_expand_collapse_invalidate(self) -> None:
+        tree = get_worksheet_tree()
+        before = tree.get_rectangles()
+        leaf = tree.get_tree_at_position((0, 0))
+        parent = leaf.collapse()
+        after = tree.get_rectangles()
+        assert after is not before
+        assert len(after) == 6
+        parent.expand()
+        assert tree.get_rectangles() == before
+
+    def test_move_and_change_size_invalidate(self) -> None:
+        s1 = TMTree('C1', [], 5)
+        s2 = TMTree('C2', [], 15)
+        t3 = TMTree('C', [s1, s2], 1)
+        t3.update_rectangles((0, 0, 100, 200))
+        assert [r for r, _ in t3.get_rectangles()] == [(0, 0, 100, 50),
+                                                       (0, 50, 100, 150)]
+        s2.change_size(-2 / 3)
+        assert [r for r, _ in t3.get_rectangles()] == [(0, 0, 100, 100),
+                                                       (0, 100, 100, 100)]
+        s2.move(s1)
+        assert [r for r, _ in t3.get_rectangles()] == [(0, 0, 100, 200)]
+
+    def test_deep_tree(self) -> None:
+        tree = TMTree('leaf', [], 1)
+        for i in range(3000):
+            tree = TMTree(f"n{i}", [tree], 1)
+        tree.update_rectangles((0, 0, 10, 10))
+        assert tree.get_rectangles()[0][0] == (0, 0, 10, 10)
+
+    def test_state_kept_by_root(self) -> None:
+        tree = get_worksheet_tree()
+        tree.get_rectangles()
+        tree.get_tree_at_position((0, 0))
+        assert tree._tree_state.draw_list is not None
+        assert tree._tree_state.hit_index is not None
+        assert all(node._tree_state is None
+                   for node in _preorder(tree)[1:])
+        parent = TMTree('p', [tree], 1)
+        assert tree._tree_state is None
+        assert parent._tree_state is None
+
+
+class TestHitIndex:
+    def _brute_force(self, tree: TMTree, pos: Tuple[int, int]) -> TMTree:
+        for leaf in tree._displayed_leaves():
+            x, y, width, height = leaf.rect
+            if x <= pos[0] <= x + width and y <= pos[1] <= y + height:
+                return leaf
+        return tree
+
+    def test_every_position_worksheet(self) -> None:
+        tree = get_worksheet_tree()
+        for x in range(56):
+            for y in range(31):
+                assert tree.get_tree_at_position((x, y)) is \
+                    self._brute_force(tree, (x, y))
+        assert tree.get_tree_at_position((56, 0)) is None
+
+    def test_index_follows_collapse(self) -> None:
+        tree = get_worksheet_tree()
+        leaf = tree.get_tree_at_position((0, 0))
+        parent = leaf.collapse()
+        assert tree.get_tree_at_position((0, 0)) is parent
+        parent.expand()
+        assert tree.get_tree_at_position((0, 0)) is leaf
+
+    def test_index_follows_relayout(self) -> None:
+        s1 = TMTree('C1', [], 5)
+        s2 = TMTree('C2', [], 15)
+        t3 = TMTree('C', [s1, s2], 1)
+        t3.update_rectangles((0, 0, 100, 200))
+        assert t3.get_tree_at_position((0, 60)) is s2
+        t3.update_rectangles((0, 0, 200, 100))
+        assert t3.get_tree_at_position((0, 60)) is s1
+
+    def test_index_updated_in_place(self) -> None:
+        tree = ChessTree.from_json_file('wgm_10.json')
+        tree.update_rectangles((0, 0, 400, 300))
+        tree.get_tree_at_position((0, 0))
+        index = tree._tree_state.hit_index
+        positions = [(x, y) for x in range(0, 401, 50)
+                     for y in range(0, 301, 40)]
+        for pos in positions[::7]:
+            leaf = tree.get_tree_at_position(pos)
+            parent = leaf.collapse()
+            for other in positions:
+                assert tree.get_tree_at_position(other) is \
+                    self._brute_force(tree, other)
+            parent.expand_all()
+            parent._subtrees[-1].expand()
+            for other in positions:
+                assert tree.get_tree_at_position(other) is \
+                    self._brute_force(tree, other)
+        assert tree._tree_state.hit_index is index
+
+
+class TestIncrementalLayout:
+    def _all_rects(self, tree: TMTree) -> list:
+        rects = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            rects.append(node.rect)
+            stack.extend(node._subtrees)
+        return rects
+
+    def test_change_size_matches_full_layout(self) -> None:
+        tree = get_worksheet_tree()
+        j = tree._subtrees[0]._subtrees[0]._subtrees[0]
+        for factor in [0.5, 0.5, -0.3, 1.0]:
+            j.change_size(factor)
+            incremental = self._all_rects(tree)
+            tree.update_rectangles(tree.rect)
+            assert self._all_rects(tree) == incremental
+
+    def test_move_matches_full_layout(self) -> None:
+        tree = get_worksheet_tree()
+        g = tree._subtrees[1]._subtrees[0]
+        d = tree._subtrees[2]
+        g.move(d)
+        incremental = self._all_rects(tree)
+        tree.update_rectangles(tree.rect)
+        assert self._all_rects(tree) == incremental
+
+    def test_clean_after_layout(self) -> None:
+        tree = get_worksheet_tree()
+        assert not tree._dirty
+        leaf = tree._subtrees[2]
+        leaf.change_size(0.5)
+        assert not tree._dirty and not leaf._dirty
+
+
+class TestLazyLayout:
+    def _collapsed_tree(self) -> TMTree:
+        tree = get_worksheet_tree()
+        tree._subtrees[0]._subtrees[0].collapse()
+        tree.update_rectangles((0, 0, 300, 200))
+        return tree
+
+    def _expanded_tree(self) -> TMTree:
+        tree = get_worksheet_tree()
+        tree.update_rectangles((0, 0, 300, 200))
+        return tree
+
+    def test_collapsed_subtrees_not_laid_out(self) -> None:
+        old_rect = get_worksheet_tree()._subtrees[0]._subtrees[0].rect
+        tree = self._collapsed_tree()
+        assert tree._subtrees[0]._dirty
+        assert tree._subtrees[0]._subtrees[0]._rect == old_rect
+
+    def test_rect_materialised_on_access(self) -> None:
+        tree = self._collapsed_tree()
+        expected = self._expanded_tree()
+        for path in [(0, 0), (0, 0, 1), (0, 1)]:
+            node, other = tree, expected
+            for i in path:
+                node, other = node._subtrees[i], other._subtrees[i]
+            assert node.rect == other.rect
+
+    def test_expand_lays_out_revealed_subtrees(self) -> None:
+        tree = self._collapsed_tree()
+        tree._subtrees[0].expand()
+        assert not tree._subtrees[0]._dirty
+        expected = self._expanded_tree()
+        expected._subtrees[0]._subtrees[0]._subtrees[0].collapse()
+        assert [rect for rect, _ in tree.get_rectangles()] == \
+            [rect for rect, _ in expected.get_rectangles()]
+
+
+class TestSquarifiedLayout:
+    def test_covers_rect_without_overlap(self) -> None:
+        rect = (5, 10, 97, 61)
+        rects = squarified_layout(rect, [7, 1, 30, 2, 2, 9, 1])
+        pixels = set()
+        for x, y, width, height in rects:
+            for i in range(x, x + width):
+                for j in range(y, y + height):
+                    assert (i, j) not in pixels
+                    pixels.add((i, j))
+        assert len(pixels) == 97 * 61
+        assert min(pixels) == (5, 10) and max(pixels) == (101, 70)
+
+    def test_more_square_than_slice(self) -> None:
+        sizes = [i % 7 + 1 for i in range(50)]
+
+        def worst(rects: list) -> float:
+            return max(max(w / h, h / w) for _, _, w, h in rects)
+        rect = (0, 0, 800, 600)
+        assert worst(squarified_layout(rect, sizes)) < \
+            worst(slice_layout(rect, sizes))
+
+    def test_set_layout_strategy(self) -> None:
+        tree = get_worksheet_tree()
+        tree._subtrees[2].set_layout_strategy(squarified_layout)
+        assert tree._tree_state.layout_strategy is squarified_layout
+        leaves = [rect for rect, _ in tree.get_rectangles()]
+        assert sum(w * h for _, _, w, h in leaves) == 55 * 30
+        j = tree._subtrees[0]._subtrees[0]._subtrees[0]
+        j.change_size(0.5)
+        incremental = [rect for rect, _ in tree.get_rectangles()]
+        tree.update_rectangles(tree.rect)
+        assert [rect for rect, _ in tree.get_rectangles()] == incremental
+
+
+class TestTreemapRenderer:
+    def test_matches_render_display(self) -> None:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+        from treemap_visualiser import TreemapRenderer, render_display
+        pygame.init()
+        try:
+            screen = pygame.display.set_mode((200, 150))
+            expected = pygame.Surface(screen.get_size())
+            tree = get_worksheet_tree()
+            renderer = TreemapRenderer(screen, tree)
+            renderer.render()
+            leaves = [leaf for leaf in tree._subtrees if not leaf._expanded]
+            steps = [(None, leaves[0]), (leaves[0], None), (leaves[0], tree),
+                     (None, leaves[0])]
+            for selected, hover in steps:
+                draw_list = tree.get_rectangles()
+                renderer.render(selected, hover)
+                assert tree.get_rectangles() is draw_list
+                render_display(expected, tree, selected, hover)
+                assert pygame.image.tostring(screen, 'RGB') == \
+                    pygame.image.tostring(expected, 'RGB')
+        finally:
+            pygame.quit()
+
+    def test_compact_hover_not_redrawn(self, tmp_path, monkeypatch) -> None:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+        from treemap_visualiser import TreemapRenderer
+        path = os.path.join(tmp_path, 'tree.tmsnap')
+        CompactTree.from_tmtree(get_worksheet_tree()).save_snapshot(path)
+        store = CompactTree.load_snapshot(path)
+        tree = store.node(store.root)
+        redraws = []
+        render_all = TreemapRenderer._render_all
+
+        def counting(renderer, *args) -> None:
+            redraws.append(args)
+            render_all(renderer, *args)
+        monkeypatch.setattr(TreemapRenderer, '_render_all', counting)
+        pygame.init()
+        try:
+            screen = pygame.display.set_mode((200, 150))
+            renderer = TreemapRenderer(screen, tree)
+            renderer.render()
+            assert len(redraws) == 1
+            leaves = [leaf for leaf in tree._subtrees if not leaf._expanded]
+            for hover in [leaves[0], tree, None, leaves[0]]:
+                renderer.render(None, hover)
+            assert len(redraws) == 1
+            tree._subtrees[0].collapse()
+            renderer.render(None, leaves[0])
+            assert len(redraws) == 2
+        finally:
+            pygame.quit()
+
+    def test_launchers_save_snapshots(self, tmp_path, monkeypatch) -> None:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import treemap_visualiser
+        shown = []
+        monkeypatch.setattr(treemap_visualiser, 'run_visualisation',
+                            lambda tree, name: shown.append(str(tree)))
+        path = os.path.join(tmp_path, 'tree.tmsnap')
+        treemap_visualiser.run_treemap_file_system(EXAMPLE_PATH,
+                                                   snapshot_path=path)
+        treemap_visualiser.run_treemap_snapshot(path)
+        treemap_visualiser.run_treemap_chess(path)
+        treemap_visualiser.run_treemap_snapshot(path)
+        assert shown[0] == shown[1] and shown[2] == shown[3]
+
+
+class TestMovesToNestedDict:
+    def test_first_occurrence_order(self) -> None:
+        games = [['b', 'x'], ['a'], ['b', 'y'], ['b', 'x'], ['a', 'z']]
+        assert list(moves_to_nested_dict(games).items()) == [
+            (('b', 0), {('x', 2): {}, ('y', 1): {}}),
+            (('a', 1), {('z', 1): {}})]
+
+    def test_long_game(self) -> None:
+        game = [f"m{i}" for i in range(5000)]
+        nested = moves_to_nested_dict([game, game[:10]])
+        for i in range(5000):
+            ((move, count), nested), = nested.items()
+            assert move == game[i]
+            assert count == (1 if i in (9, 4999) else 0)
+        assert nested == {}
+
+
+class TestChessTreeFromGames:
+    def test_matches_nested_dict(self) -> None:
+        games = [['a', 'b', 'c'], ['a', 'b'], ['d', 'e', 'a'], ['d', 'e'],
+                 [], ['d']]
+        expected = ChessTree(moves_to_nested_dict(games))
+        tree = ChessTree.from_games(iter(games))
+        assert str(tree) == str(expected)
+        assert tree._subtrees[1]._white_to_play is False
+        assert tree._subtrees[1]._subtrees[0]._white_to_play is True
+
+    def test_from_json_file(self) -> None:
+        with open('wgm_10.json') as file:
+            expected = ChessTree(moves_to_nested_dict(json.load(file)))
+        assert str(ChessTree.from_json_file('wgm_10.json')) == str(expected)
+
+    def test_long_game(self) -> None:
+        game = [f"m{i}" for i in range(5000)]
+        tree = ChessTree.from_games([game])
+        depth = 0
+        while tree._subtrees:
+            tree = tree._subtrees[0]
+            depth += 1
+        assert depth == 5000 and type(tree) is TMTree
+        assert ChessTree(moves_to_nested_dict([game])).data_size == 1
+
+    def test_moves_are_shared(self) -> None:
+        games = json.loads('[["e2e4", "e7e5"], ["d2d4", "e7e5"]]')
+        assert games[0][1] is not games[1][1]
+        for tree in [ChessTree.from_games(games),
+                     ChessTree(moves_to_nested_dict(games))]:
+            first, second = tree._subtrees
+            assert first._subtrees[0]._name is second._subtrees[0]._name
+
+    def test_parallel_matches_wgm_999(self) -> None:
+        with open('wgm_999.json') as file:
+            games = json.load(file)
+        expected = ChessTree(moves_to_nested_dict(games))
+        tree = ChessTree.from_games_parallel(iter(games), max_workers=2,
+                                             shard_size=97)
+        assert str(tree) == str(expected)
+        assert tree.data_size == expected.data_size
+
+    def test_parallel_long_game(self) -> None:
+        games = [[f"m{i}" for i in range(5000)], ['m0', 'x'], []]
+        trees = [ChessTree.from_games_parallel(games, max_workers=2,
+                                               shard_size=1),
+                 ChessTree.from_games(games)]
+        nodes = [[], []]
+        for tree, found in zip(trees, nodes):
+            stack = [tree]
+            while stack:
+                tree = stack.pop()
+                found.append((type(tree), tree._name, tree.data_size))
+                stack.extend(tree._subtrees)
+        assert nodes[0] == nodes[1]
+
+
+class TestIterGames:
+    def test_array_and_json_lines(self, tmp_path) -> None:
+        with open('wgm_10.json') as file:
+            games = json.load(file)
+        assert list(iter_games('wgm_10.json')) == games
+        lines = tmp_path / 'games.jsonl'
+        lines.write_text('\n'.join(json.dumps(game) for game in games) + '\n')
+        assert list(iter_games(str(lines))) == games
+
+    def test_games_across_chunks(self, tmp_path, monkeypatch) -> None:
+        monkeypatch.setattr(tm_trees, 'GAMES_CHUNK_SIZE', 3)
+        path = tmp_path / 'games.json'
+        path.write_text(' \n[ ["e2e4", "e7e5"] ,\n["d2d4"], [] ]\n')
+        assert list(iter_games(str(path))) == [['e2e4', 'e7e5'], ['d2d4'], []]
+        path.write_text('[]\n\n["d2d4"]\n')
+        assert list(iter_games(str(path))) == [[], ['d2d4']]
+
+    def test_empty_array(self, tmp_path, monkeypatch) -> None:
+        monkeypatch.setattr(tm_trees, 'GAMES_CHUNK_SIZE', 3)
+        path = tmp_path / 'games.json'
+        for text in ['[]', '[\n]\n', ' [ \n\n ] \n\n  ']:
+            path.write_text(text)
+            assert list(iter_games(str(path))) == []
+
+    def test_bad_files(self, tmp_path) -> None:
+        path = tmp_path / 'games.json'
+        for text in ['', '{}', '[["e2e4"]', '[["e2e4"] ["d2d4"]]',
+                     '[["e2e4"],]', '[["e2e4"], ["d2d4"] , ]\n',
+                     '[["e2e4"]] x', '[["e2e4"]]\n\n]', '[\n] []']:
+            path.write_text(text)
+            with pytest.raises(ValueError):
+                list(iter_games(str(path)))
+
+
+class TestPositionFen:
+    def test_matches_url_from_moves(self, monkeypatch) -> None:
+        monkeypatch.setattr(tm_trees, 'FEN_CACHE_SIZE', 5)
+        tree = ChessTree.from_json_file('wgm_10.json')
+        stack = [(tree, [])]
+        checked = 0
+        while stack:
+            node, moves = stack.pop()
+            assert url_from_fen(position_fen(node)) == url_from_moves(moves)
+            assert len(tree._tree_state.fen_cache) <= 5
+            checked += 1
+            stack.extend((subtree, moves + [subtree._name])
+                         for subtree in node._subtrees)
+        assert checked > 300
+        # a deep node with nothing above it in the cache
+        tree._tree_state.fen_cache.clear()
+        node, moves = tree, []
+        while node._subtrees:
+            node = node._subtrees[-1]
+            moves.append(node._name)
+        assert url_from_fen(position_fen(node)) == url_from_moves(moves)
+
+    def test_cache_belongs_to_tree(self) -> None:
+        first = ChessTree({('e2e4', 1): {}})
+        second = ChessTree({('d2d4', 1): {}})
+        position_fen(first._subtrees[0])
+        assert list(first._tree_state.fen_cache) == [first._subtrees[0]]
+        assert second._tree_state is None
+
+    def test_move_updates_fen(self) -> None:
+        tree = ChessTree({('e2e4', 0): {('e7e5', 1): {('g1f3', 0): {
+            ('b8c6', 1): {}}}},
+            ('d2d4', 0): {('d7d5', 0): {('c1f4', 1): {}}}})
+        tree.update_rectangles((0, 0, 200, 100))
+        knight = tree._subtrees[0]._subtrees[0]._subtrees[0]
+        bishop = tree._subtrees[1]._subtrees[0]._subtrees[0]
+        reply = knight._subtrees[0]
+        before = position_fen(reply)
+        knight.collapse()
+        knight.move(bishop)
+        assert url_from_fen(knight.get_fen()) == url_from_moves(
+            ['d2d4', 'd7d5', 'c1f4', 'g1f3'])
+        assert url_from_fen(position_fen(reply)) == url_from_moves(
+            ['d2d4', 'd7d5', 'c1f4', 'g1f3', 'b8c6'])
+        assert position_fen(reply) != before
+        assert tree._subtrees[0]._subtrees[0].get_fen() == \
+            'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2'
+
+
+class TestExportPositions:
+    def test_csv_and_jsonl(self) -> None:
+        tree = ChessTree.from_json_file('wgm_10.json')
+        expected = []
+        stack = [(tree, [])]
+        while stack:
+            node, moves = stack.pop()
+            expected.append((moves, url_from_moves(moves), node.data_size))
+            stack.extend((subtree, moves + [subtree._name])
+                         for subtree in reversed(node._subtrees))
+
+        out = io.StringIO()
+        assert tree.export_positions(out) == len(expected)
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        assert rows[0] == ['moves', 'fen', 'url', 'data_size']
+        assert [(row[0].split(), row[2], int(row[3])) for row in rows[1:]] \
+            == expected
+        assert all(url_from_fen(row[1]) == row[2] for row in rows[1:])
+
+        out = io.StringIO()
+        subtree = tree._subtrees[0]._subtrees[-1]
+        count = subtree.export_positions(out, 'jsonl')
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert count == len(records)
+        start = expected.index(([tree._subtrees[0]._name, subtree._name],
+                                url_from_moves(records[0]['moves']),
+                                subtree.data_size))
+        assert [(r['moves'], r['url'], r['data_size']) for r in records] \
+            == expected[start:start + count]
+
+    def test_unknown_format(self) -> None:
+        tree = ChessTree({('e2e4', 1): {}})
+        with pytest.raises(ValueError):
+            tree.export_positions(io.StringIO(), 'xml')
+
+    def test_export_after_move(self) -> None:
+        tree = ChessTree({('e2e4', 0): {('e7e5', 1): {('g1f3', 0): {
+            ('b8c6', 1): {}}}},
+            ('d2d4', 0): {('d7d5', 0): {('c1f4', 1): {}}}})
+        tree.update_rectangles((0, 0, 200, 100))
+        knight = tree._subtrees[0]._subtrees[0]._subtrees[0]
+        bishop = tree._subtrees[1]._subtrees[0]._subtrees[0]
+        knight.export_positions(io.StringIO())
+        knight.collapse()
+        knight.move(bishop)
+        for node in [knight, tree]:
+            out = io.StringIO()
+            node.export_positions(out, 'jsonl')
+            for line in out.getvalue().splitlines():
+                record = json.loads(line)
+                assert record['url'] == url_from_moves(record['moves'])
+
+
+class TestTranspositions:
+    GAMES = [['g1f3', 'g8f6', 'b1c3', 'b8c6'], ['b1c3', 'g8f6', 'g1f3'],
+             ['b1c3', 'g8f6', 'g1f3', 'e7e5'], ['e2e4']]
+
+    def test_without_transpositions(self) -> None:
+        with open('wgm_10.json') as file:
+            games = json.load(file)
+        view = ChessTree.from_games(games, transpositions=True)
+        assert isinstance(view, ChessPositionView)
+        view.expand_all()
+        assert str(view) == str(ChessTree.from_games(games))
+
+    def test_shared_positions(self) -> None:
+        view = ChessTree.from_games(self.GAMES, transpositions=True)
+        first = view._subtrees[0]._subtrees[0]._subtrees[0]
+        second = view._subtrees[1]._subtrees[0]._subtrees[0]
+        assert first is not second and first._position is second._position
+        assert first._parent_tree is view._subtrees[0]._subtrees[0]
+        assert [t._name for t in first._subtrees] == ['b8c6', 'e7e5']
+        assert first.data_size == second.data_size == 3
+        assert first.get_fen() == second.get_fen()
+        assert first._white_to_play is second._white_to_play is False
+        assert view.data_size == 7
+        stack = [view]
+        while stack:
+            tree = stack.pop()
+            if tree._subtrees:
+                assert tree.data_size >= sum(t.data_size
+                                             for t in tree._subtrees)
+            stack.extend(tree._subtrees)
+
+    def test_display(self) -> None:
+        view = ChessTree.from_games(self.GAMES, transpositions=True)
+        assert TMTree._subtrees.__get__(view._subtrees[0]) is None
+        view.update_rectangles((0, 0, 200, 100))
+        assert [t._name for t in view._subtrees] == ['g1f3', 'b1c3', 'e2e4']
+        assert len(view.get_rectangles()) == 3
+        assert view.get_tree_at_position((1, 1)) is view._subtrees[0]
+        view._subtrees[1].expand()
+        assert len(view.get_rectangles()) == 3
+        view._subtrees[1]._subtrees[0].expand_all()
+        assert len(view.get_rectangles()) == 4
+        assert view.get_tree_at_position((180, 50)) is view._subtrees[2]
+
+
+class TestPrunedChessTree:
+    @staticmethod
+    def _nodes(tree: TMTree) -> list[TMTree]:
+        nodes = []
+        stack = [tree]
+        while stack:
+            tree = stack.pop()
+            nodes.append(tree)
+            stack.extend(tree._subtrees)
+        return nodes
+
+    def test_sizes_are_kept(self) -> None:
+        with open('wgm_999.json') as file:
+            games = json.load(file)
+        full = ChessTree.from_games(games)
+        for max_depth, min_games in [(6, 1), (None, 5), (10, 3)]:
+            tree = ChessTree.from_games(games, max_depth=max_depth,
+                                        min_games=min_games)
+            expected = ChessTree(moves_to_nested_dict(games, max_depth,
+                                                      min_games))
+            assert str(tree) == str(expected)
+            assert tree.data_size == full.data_size
+            nodes = self._nodes(tree)
+            assert len(nodes) < len(self._nodes(full)) // 4
+            for node in nodes:
+                assert node._name == PRUNED_MOVES or \
+                    node.data_size >= min_games
+                if node._subtrees:
+                    assert node.data_size >= sum(t.data_size
+                                                 for t in node._subtrees)
+
+    def test_depth(self) -> None:
+        tree = ChessTree.from_games([['a', 'b', 'c', 'd'], ['a', 'b', 'e'],
+                                     ['a', 'f']], max_depth=2)
+        assert str(tree) == str(ChessTree({('a', 0): {
+            ('b', 0): {('...', 2): {}}, ('f', 1): {}}}))
+
+    def test_parallel_and_errors(self) -> None:
+        games = [['e2e4', 'e7e5', 'g1f3'], ['e2e4', 'c7c5'], ['d2d4']] * 3
+        expected = ChessTree.from_games(games, min_games=4)
+        tree = ChessTree.from_games_parallel(games, max_workers=2,
+                                             shard_size=2, min_games=4)
+        assert str(tree) == str(expected)
+        out = io.StringIO()
+        assert expected.export_positions(out) == 2  # the root and e2e4
+        with pytest.raises(ValueError):
+            ChessTree.from_games(games, transpositions=True, max_depth=3)
+
+
+class TestEventLoop:
+    def test_motion_is_coalesced(self, monkeypatch) -> None:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+        from treemap_visualiser import event_loop
+        positions = []
+        get_tree_at_position = TMTree.get_tree_at_position
+
+        def hit_test(tree: TMTree, pos: Tuple[int, int]) -> TMTree:
+            positions.append(pos)
+            return get_tree_at_position(tree, pos)
+
+        monkeypatch.setattr(TMTree, 'get_tree_at_position', hit_test)
+        pygame.init()
+        try:
+            screen = pygame.display.set_mode((200, 150))
+            tree = get_worksheet_tree()
+            pygame.event.clear()
+            for x in range(100):
+                pygame.event.post(pygame.event.Event(
+                    pygame.MOUSEMOTION, pos=(x, 10), rel=(1, 0),
+                    buttons=(0, 0, 0)))
+            pygame.event.post(pygame.event.Event(pygame.KEYUP,
+                                                 key=pygame.K_x))
+            pygame.event.post(pygame.event.Event(pygame.QUIT))
+            event_loop(screen, tree, 1)
+            assert positions == [(99, 10)]
+        finally:
+            pygame.quit()
+
+
+class TestFontManager:
+    def test_cache(self) -> None:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+        from treemap_visualiser import FontManager
+        for _ in range(2):  # fonts are dropped when pygame quits
+            pygame.init()
+            try:
+                fonts = FontManager(2)
+                font = fonts.get_font('Consolas', 20)
+                assert fonts.get_font('Consolas', 20) is font
+                lines = fonts.render_lines('a' * 200, 'Consolas', 20, 300)
+                assert len(lines) > 1
+                assert all(line.get_width() <= 300 for line in lines)
+                assert fonts.render_lines('a' * 200, 'Consolas', 20,
+                                          300) is lines
+                assert fonts.render_lines('a' * 200, 'Consolas', 20,
+                                          600) is not lines
+                fonts.render_lines('b', 'Consolas', 20, 300)
+                assert fonts.render_lines('a' * 200, 'Consolas', 20,
+                                          300) is not lines
+            finally:
+                pygame.quit()
+            assert not fonts._fonts and not fonts._lines
+
+
+class TestPathString:
+    def test_cached_prefixes(self) -> None:
+        tree = get_worksheet_tree()
+        leaf = tree._subtrees[0]._subtrees[0]
+        expected = leaf.get_path_string()
+        assert leaf._path_prefix == 'a | b | '
+        assert tree._subtrees[0]._path_prefix == 'a | '
+        assert leaf.get_path_string() == expected
+
+        destination = tree._subtrees[1]._subtrees[-1]
+        assert destination.is_displayed_tree_leaf()
+        leaf.move(destination)
+        assert leaf._path_prefix is None
+        assert leaf.get_path_string().startswith(
+            destination.get_path_string().split('(')[0] + ' | ')
+
+    def test_new_parent(self) -> None:
+        leaf = TMTree('b', [], 3)
+        middle = TMTree('a', [leaf])
+        assert leaf.get_path_string() == 'a | b(3) None'
+        root = TMTree('root', [middle])
+        assert leaf.get_path_string() == 'root | a | b(3) None'
+
+    def test_deep_file_path(self, tmp_path) -> None:
+        path = tmp_path
+        for i in range(30):
+            path = path / f"d{i}"
+        path.mkdir(parents=True)
+        (path / 'f.txt').write_text('abc')
+        tree = path_to_dir_tree(str(tmp_path))
+        while tree._subtrees:
+            tree = tree._subtrees[0]
+        expected = os.path.join(tmp_path.name,
+                                *[f"d{i}" for i in range(30)], 'f.txt')
+        assert tree.get_path_string() == expected + ' (file)'
+        assert tree._parent_tree.get_path_string() == \
+            os.path.dirname(expected) + ' (directory)'
+
+    def test_rect_kept_up_to_date(self) -> None:
+        def full_layout_rects(tree: TMTree) -> list:
+            fresh = get_worksheet_tree()
+            fresh._subtrees[0]._subtrees[1].change_size(2)
+            fresh.update_rectangles(tree.rect)
+            return [node.rect for node in _preorder(fresh)]
+
+        tree = get_worksheet_tree()
+        deep = tree._subtrees[0]._subtrees[0]
+        assert deep.get_path_string() == 'a | b | e(20) (0, 0, 30, 24)'
+        assert deep._rect_epoch == TMTree._layout_epoch
+        assert tree._subtrees[0]._rect_epoch == TMTree._layout_epoch
+        tree._subtrees[0]._subtrees[1].change_size(2)
+        assert deep.get_path_string() == 'a | b | e(20) (0, 0, 18, 30)'
+        tree._subtrees[0].collapse()
+        tree.update_rectangles((0, 0, 110, 60))
+        assert deep.get_path_string() == 'a | b | e(20) (0, 0, 38, 60)'
+        assert [node.rect for node in _preorder(tree)] == \
+            full_layout_rects(tree)
+
+
+class TestWriteTree:
+    def test_matches_str(self, tmp_path) -> None:
+        tree = ChessTree.from_json_file('wgm_10.json')
+        tree.update_rectangles((0, 0, 800, 600))
+        path = tmp_path / 'tree.txt'
+        with open(path, 'w') as file:
+            tree.write_tree(file)
+        assert path.read_text() == str(tree) + '\n'
+
+        out = io.StringIO()
+        tree.write_tree(out, max_depth=1)
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 1 + len(tree._subtrees)
+        assert lines == str(tree).splitlines()[:1] + [
+            line for line in str(tree).splitlines() if
+            line.startswith('    ') and not line.startswith('        ')]
+
+    def test_directory_depth(self) -> None:
+        tree = path_to_dir_tree(EXAMPLE_PATH)
+        out = io.StringIO()
+        tree.write_tree(out, max_depth=0)
+        assert out.getvalue() == str(tree).splitlines()[0] + '\n'
+
+    def test_deep_tree(self) -> None:
+        tree = TMTree('leaf', [], 1)
+        for i in range(5000):
+            tree = TMTree(f"node{i}", [tree])
+        lines = str(tree).splitlines()
+        assert len(lines) == 5001
+        assert lines[-1] == 5000 * '    ' + 'leaf(1) None'
+
+    def test_compact_tree(self) -> None:
+        tree = ChessTree.from_json_file('wgm_10.json')
+        tree.update_rectangles((0, 0, 800, 600))
+        store = CompactTree.from_tmtree(tree)
+        root = store.node(store.root)
+        for max_depth in [None, 0, 2]:
+            expected = io.StringIO()
+            tree.write_tree(expected, max_depth)
+            out = io.StringIO()
+            root.write_tree(out, max_depth)
+            assert out.getvalue() == expected.getvalue()
+        out = io.StringIO()
+        root._subtrees[0].write_tree(out, max_depth=1)
+        assert out.getvalue().splitlines()[0] == \
+            str(root._subtrees[0]).splitlines()[0]
+
+
+class TestScanCache:
+    def _make_tree(self, root) -> None:
+        (root / 'a').mkdir()
+        (root / 'a' / 'x.txt').write_text('abc')
+        (root / 'b').mkdir()
+        (root / 'b' / 'c').mkdir()
+        (root / 'b' / 'c' / 'y.txt').write_text('hello')
+        (root / 'z.txt').write_text('')
+        self._age(root)
+
+    def _age(self, root, seconds: int = 1_600_000_000) -> None:
+        # directories modified just now are not cached, so make them older
+        old = seconds * 10 ** 9
+        for path, _, _ in os.walk(root):
+            os.utime(path, ns=(old, old))
+
+    def _count_listings(self, monkeypatch) -> list[str]:
+        listed = []
+        list_directory = tm_trees._list_directory
+
+        def counting(path: str) -> list:
+            listed.append(os.path.basename(path))
+            return list_directory(path)
+        monkeypatch.setattr(tm_trees, '_list_directory', counting)
+        return listed
+
+    def test_unchanged_rescan(self, tmp_path, monkeypatch) -> None:
+        root = tmp_path / 'root'
+        root.mkdir()
+        self._make_tree(root)
+        cache = ScanCache()
+        first = path_to_dir_tree(str(root), 1, cache)
+        listed = self._count_listings(monkeypatch)
+        assert str(path_to_dir_tree(str(root), None, cache)) == str(first)
+        assert listed == []
+        assert len(cache) == 4
+
+    def test_changed_directory_relisted(self, tmp_path, monkeypatch) -> None:
+        root = tmp_path / 'root'
+        root.mkdir()
+        self._make_tree(root)
+        cache = ScanCache()
+        scan_path(str(root), 1, cache)
+        (root / 'b' / 'c' / 'new.txt').write_text('12345678')
+        (root / 'a' / 'x.txt').unlink()
+        expected = path_to_nested_tuple(str(root))
+        listed = self._count_listings(monkeypatch)
+        assert scan_path(str(root), 1, cache) == expected
+        assert sorted(listed) == ['a', 'c']
+
+    def test_saved_and_loaded(self, tmp_path, monkeypatch) -> None:
+        root = tmp_path / 'root'
+        root.mkdir()
+        self._make_tree(root)
+        cache_path = str(tmp_path / 'scan.json')
+        cache = ScanCache(cache_path)
+        first = scan_path(str(root), 1, cache)
+        cache.save()
+        listed = self._count_listings(monkeypatch)
+        assert scan_path(str(root), 1, ScanCache(cache_path)) == first
+        assert listed == []
+
+    def test_recent_directories_not_cached(self, tmp_path) -> None:
+        (tmp_path / 'a.txt').write_text('abc')
+        cache = ScanCache()
+        scan_path(str(tmp_path), 1, cache)
+        assert len(cache) == 0
+
+    def test_unchanged_files_not_stated(self, tmp_path, monkeypatch) -> None:
+        root = tmp_path / 'root'
+        root.mkdir()
+        self._make_tree(root)
+        cache = ScanCache()
+        first = scan_path(str(root), 1, cache)
+        listed = self._count_listings(monkeypatch)
+        stated = []
+        os_stat = os.stat
+
+        def counting(path, *args, **kwargs):
+            stated.append(path)
+            return os_stat(path, *args, **kwargs)
+        monkeypatch.setattr(os, 'stat', counting)
+        assert scan_path(str(root), 1, cache) == first
+        assert listed == []
+        assert {os.path.relpath(path, root) for path in stated} == \
+            {'.', 'a', 'b', os.path.join('b', 'c')}
+
+    def test_in_place_edit_needs_rescan(self, tmp_path, monkeypatch) -> None:
+        root = tmp_path / 'root'
+        root.mkdir()
+        self._make_tree(root)
+        cache = ScanCache()
+        first = scan_path(str(root), 1, cache)
+        (root / 'b' / 'c' / 'y.txt').write_text('a longer greeting')
+        self._age(root)
+        expected = scan_path(str(root), 1)
+        assert scan_path(str(root), 1, cache) == first != expected
+        cache.rescan = True
+        listed = self._count_listings(monkeypatch)
+        assert scan_path(str(root), 1, cache) == expected
+        assert len(listed) == 4
+        cache.rescan = False
+        assert scan_path(str(root), 1, cache) == expected
+
+    def test_save_drops_unvisited(self, tmp_path) -> None:
+        root = tmp_path / 'root'
+        root.mkdir()
+        self._make_tree(root)
+        cache_path = str(tmp_path / 'scan.json')
+        cache = ScanCache(cache_path)
+        scan_path(str(root), 1, cache)
+        cache.save()
+        os.remove(root / 'b' / 'c' / 'y.txt')
+        os.rmdir(root / 'b' / 'c')
+        self._age(root, 1_600_000_001)
+        cache = ScanCache(cache_path)
+        assert len(cache) == 4
+        scan_path(str(root), 1, cache)
+        cache.save()
+        assert len(ScanCache(cache_path)) == 3
+
+    def test_unreadable_cache_file(self, tmp_path) -> None:
+        cache_path = tmp_path / 'scan.json'
+        cache_path.write_text('{not json')
+        assert len(ScanCache(str(cache_path))) == 0
+        cache_path.write_text('{"version": 0, "directories": {"a": 1}}')
+        assert len(ScanCache(str(cache_path))) == 0
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,906 @@
+"""Assignment 2: Compact storage for large treemap trees
+
+=== Module Description ===
+This module contains CompactTree, a struct-of-arrays store for a whole
+treemap tree, and CompactNode, a TMTree that is a view of one node in a
+CompactTree.
+
+A TMTree is a full Python object per node, with its own rect and colour tuples
+and subtree list. A CompactTree instead keeps one typed array per attribute
+(parent, first child, next sibling, data size, rectangle, colour, flags), so
+that each node costs tens of bytes rather than hundreds. CompactNode views
+are only created for the nodes that are actually used (for example, the ones
+the visualiser hovers over or selects), and support the same public methods
+as TMTree, so a CompactTree can be passed straight to the visualiser.
+
+A CompactTree can be saved to a binary snapshot file and loaded back with a
+copy of each array, so a large tree can be reopened without rescanning the
+disk or reparsing its games.
+"""
+from __future__ import annotations
+import math
+import os
+import random
+import struct
+import sys
+import webbrowser
+from array import array
+from typing import Iterator, Optional, TextIO
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, CompactTree works without it
+    np = None
+
+from tm_trees import TMTree, FileTree, DirectoryTree, ChessTree, \
+    LayoutStrategy, OperationNotSupportedError, ScanCache, build_from_path, \
+    slice_layout, url_from_moves
+
+# marks a missing parent, child or sibling
+NO_NODE = -1
+
+# the kinds of node a CompactTree can hold, indexed by their kind number
+KINDS = (TMTree, FileTree, DirectoryTree, ChessTree)
+KIND_TMTREE = 0
+KIND_FILE = 1
+KIND_DIRECTORY = 2
+KIND_CHESS = 3
+
+# update_rectangles uses NumPy, when it is installed, to slice the rectangle
+# of a node with at least this many children
+NUMPY_MIN_CHILDREN = 32
+
+# bits of the flags array
+EXPANDED = 1
+HAS_RECT = 2
+WHITE_TO_PLAY = 4
+
+# the header of a snapshot file written by CompactTree.save_snapshot: the
+# magic bytes, format version, byte order of the arrays (1 for big-endian),
+# item sizes of the 'i' and 'q' arrays, number of nodes, index of the root,
+# number of distinct names and length of the encoded name table
+SNAPSHOT_MAGIC = b'TMSNAP\r\n'
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<8sBBBBqqqq')
+
+# the arrays stored in a snapshot, in file order, with their entries per node
+_SNAPSHOT_ARRAYS = (('parent', 1), ('first_child', 1), ('last_child', 1),
+                    ('next_sibling', 1), ('data_size', 1), ('rects', 4),
+                    ('colours', 3), ('flags', 1), ('kinds', 1))
+
+
+def kind_of(tree: TMTree) -> int:
+    """
+    Return the kind number of <tree>: the most specific class in KINDS that
+    <tree> is an instance of.
+
+    >>> kind_of(TMTree('a', []))
+    0
+    >>> kind_of(FileTree('a.txt', [], 5))
+    1
+    """
+    for kind in range(len(KINDS) - 1, -1, -1):
+        if isinstance(tree, KINDS[kind]):
+            return kind
+    return KIND_TMTREE
+
+
+class CompactTree:
+    """A treemap tree stored as parallel arrays, one entry per node.
+
+    Nodes are identified by their index in the arrays. The children of a node
+    are a linked list through first_child and next_sibling, in the same order
+    as the _subtrees of the equivalent TMTree.
+
+    === Public Attributes ===
+    root:
+        The index of the root node, or NO_NODE if the store is empty.
+    names:
+        The name of each node.
+    parent:
+        The index of the parent of each node, or NO_NODE for a root.
+    first_child, last_child, next_sibling:
+        The first and last child of each node and the next child of the
+        same parent, or NO_NODE if there is none.
+    data_size:
+        The data size of each node, including its descendants.
+    rects:
+        Four entries (x, y, width, height) for each node. Only meaningful if
+        the node has the HAS_RECT flag.
+    colours:
+        Three entries (red, green, blue) for each node.
+    flags:
+        The EXPANDED, HAS_RECT and WHITE_TO_PLAY bits of each node.
+    kinds:
+        The kind number of each node (see KINDS).
+    layout_strategy:
+        The function used to lay out the children of every node, as for
+        TMTree.set_layout_strategy.
+
+    === Private Attributes ===
+    _views:
+        The CompactNode views created so far, by node index, so that asking
+        for the same node twice gives the same object.
+    _draw_lists:
+        The result of get_rectangles for each root it has been called on
+        since the store last changed, by root index.
+
+    >>> store = CompactTree()
+    >>> c1 = store.add_node('C1', [], 5)
+    >>> c2 = store.add_node('C2', [], 15)
+    >>> store.root = store.add_node('C', [c1, c2], 1)
+    >>> tree = store.node(store.root)
+    >>> tree.data_size
+    21
+    >>> tree.update_rectangles((0, 0, 100, 200))
+    >>> [rect for rect, _ in tree.get_rectangles()]
+    [(0, 0, 100, 50), (0, 50, 100, 150)]
+    >>> tree.get_tree_at_position((0, 0)) is store.node(c1)
+    True
+    """
+    root: int
+    names: list[str]
+    parent: array
+    first_child: array
+    last_child: array
+    next_sibling: array
+    data_size: array
+    rects: array
+    colours: array
+    flags: array
+    kinds: array
+    layout_strategy: LayoutStrategy
+    _views: dict[int, CompactNode]
+    _draw_lists: dict[int, list[tuple[tuple[int, int, int, int],
+                                      tuple[int, int, int]]]]
+
+    def __init__(self) -> None:
+        """Initialize an empty CompactTree.
+        """
+        self.root = NO_NODE
+        self.names = []
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.last_child = array('i')
+        self.next_sibling = array('i')
+        self.data_size = array('q')
+        self.rects = array('i')
+        self.colours = array('B')
+        self.flags = array('B')
+        self.kinds = array('B')
+        self.layout_strategy = slice_layout
+        self._views = {}
+        self._draw_lists = {}
+
+    def __len__(self) -> int:
+        """Return the number of nodes in this store.
+        """
+        return len(self.names)
+
+    @classmethod
+    def from_tmtree(cls, tree: TMTree) -> CompactTree:
+        """Return a CompactTree holding a copy of <tree> and all of its
+        descendants, with the same names, sizes, colours, rectangles and
+        expanded state.
+
+        >>> t = TMTree('A', [TMTree('B', [], 5), TMTree('C', [], 3)], 1)
+        >>> t.update_rectangles((0, 0, 90, 10))
+        >>> store = CompactTree.from_tmtree(t)
+        >>> print(store.node(store.root))
+        A | (9) (0, 0, 90, 10)
+            B(5) (0, 0, 56, 10)
+            C(3) (56, 0, 33, 10)
+        """
+        store = cls()
+        stack = [(tree, NO_NODE)]
+        while stack:
+            node, parent = stack.pop()
+            flags = WHITE_TO_PLAY if getattr(node, '_white_to_play',
+                                             True) else 0
+            if node._expanded:
+                flags |= EXPANDED
+            index = store._append(node._name, node.data_size, kind_of(node),
+                                  bytes(node._colour), flags, parent)
+            if node.rect is not None:
+                store.rects[4 * index:4 * index + 4] = array('i', node.rect)
+                store.flags[index] |= HAS_RECT
+            for subtree in reversed(node._subtrees):
+                stack.append((subtree, index))
+        store.root = 0
+        return store
+
+    @classmethod
+    def from_path(cls, path: str, max_workers: Optional[int] = None,
+                  cache: Optional[ScanCache] = None) -> CompactTree:
+        """Return a CompactTree for the directory at <path>, with the same
+        structure as path_to_dir_tree(path), built without creating any
+        DirectoryTree or FileTree objects.
+
+        Precondition:
+        <path> is a valid path to a DIRECTORY.
+
+        >>> path = os.path.join("example-directory", "workshop", "prep")
+        >>> store = CompactTree.from_path(path)
+        >>> print(store.node(store.root))
+        prep/(26) None
+            images/(18) None
+                Cats.pdf(17) None
+            reading.md(7) None
+        """
+        store = cls()
+        store.root = build_from_path(
+            path,
+            lambda name, size: store.add_node(name, [], size, KIND_FILE),
+            lambda name, children: store.add_node(name, children, 1,
+                                                  KIND_DIRECTORY),
+            max_workers, cache)
+        return store
+
+    def save_snapshot(self, path: str) -> None:
+        """Write this store to a binary snapshot file at <path>, which
+        load_snapshot can read back without rebuilding the tree.
+
+        The file holds a header, the raw bytes of each array and a table of
+        the distinct names, each stored once, so the many repeated moves of a
+        chess tree cost four bytes per node. The layout strategy is not saved.
+        The file is written under a temporary name and then renamed, so an
+        existing snapshot at <path> is never left half written.
+
+        Raise ValueError if a name contains a NUL character, which separates
+        the names in the table.
+        """
+        ids = {}
+        name_ids = array('i', [ids.setdefault(name, len(ids))
+                               for name in self.names])
+        table = '\0'.join(ids).encode('utf-8', 'surrogatepass')
+        if table.count(0) != max(len(ids) - 1, 0):
+            raise ValueError('names in a snapshot cannot contain NUL')
+        header = _SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, sys.byteorder == 'big',
+            self.parent.itemsize, self.data_size.itemsize, len(self),
+            self.root, len(ids), len(table))
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(header)
+            for attribute, _ in _SNAPSHOT_ARRAYS:
+                getattr(self, attribute).tofile(file)
+            name_ids.tofile(file)
+            file.write(table)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load_snapshot(cls, path: str) -> CompactTree:
+        """Return the CompactTree saved at <path> by save_snapshot.
+
+        The arrays are read straight into ordinary growable arrays, so that
+        the tree can still be edited, and the names are decoded from the
+        table. So loading takes time linear in the size of the file, but
+        builds no trees and parses no source data.
+
+        Raise ValueError if <path> is not a snapshot this version can read.
+
+        >>> import tempfile
+        >>> t = TMTree('A', [TMTree('B', [], 5), TMTree('C', [], 3)], 1)
+        >>> t.update_rectangles((0, 0, 90, 10))
+        >>> with tempfile.TemporaryDirectory() as directory:
+        ...     path = os.path.join(directory, 'a.tmsnap')
+        ...     CompactTree.from_tmtree(t).save_snapshot(path)
+        ...     store = CompactTree.load_snapshot(path)
+        >>> print(store.node(store.root))
+        A | (9) (0, 0, 90, 10)
+            B(5) (0, 0, 56, 10)
+            C(3) (56, 0, 33, 10)
+        """
+        store = cls()
+        with open(path, 'rb') as file:
+            header = file.read(_SNAPSHOT_HEADER.size)
+            if len(header) < _SNAPSHOT_HEADER.size:
+                raise ValueError(f"{path} is not a treemap snapshot")
+            magic, version, big_endian, int_size, long_size, num_nodes, \
+                root, num_names, table_size = _SNAPSHOT_HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError(f"{path} is not a version "
+                                 f"{SNAPSHOT_VERSION} treemap snapshot")
+            if int_size != store.parent.itemsize \
+                    or long_size != store.data_size.itemsize:
+                raise ValueError(f"{path} was saved on an incompatible "
+                                 f"platform")
+            swap = big_endian != (sys.byteorder == 'big')
+            arrays = [(getattr(store, attribute), width) for
+                      attribute, width in _SNAPSHOT_ARRAYS]
+            name_ids = array('i')
+            try:
+                for values, width in arrays + [(name_ids, 1)]:
+                    values.fromfile(file, num_nodes * width)
+                    if swap:
+                        values.byteswap()
+            except EOFError:
+                raise ValueError(f"{path} is truncated") from None
+            data = file.read(table_size + 1)
+            if len(data) != table_size:
+                raise ValueError(f"{path} is truncated")
+            table = str(data, 'utf-8', 'surrogatepass')
+        names = table.split('\0') if num_names else []
+        if len(names) != num_names:
+            raise ValueError(f"{path} has a corrupt name table")
+        store.names = list(map(names.__getitem__, name_ids))
+        store.root = root
+        return store
+
+    def add_node(self, name: str, children: list[int], data_size: int = 1,
+                 kind: int = KIND_TMTREE, white_to_play: bool = True) -> int:
+        """Add a new root node called <name> with a random colour, make the
+        nodes at the indices in <children> its children, and return its index.
+
+        As in TMTree.__init__, the new node's data size is <data_size> plus
+        the data sizes of its children, and it is expanded iff it has
+        children.
+
+        Preconditions:
+        every index in <children> is a root in this store
+        the same preconditions as TMTree.__init__
+        """
+        flags = WHITE_TO_PLAY if white_to_play else 0
+        if children:
+            flags |= EXPANDED
+        index = self._append(name, data_size, kind, random.randbytes(3),
+                             flags, NO_NODE)
+        previous = NO_NODE
+        for child in children:
+            self.parent[child] = index
+            self.data_size[index] += self.data_size[child]
+            if previous == NO_NODE:
+                self.first_child[index] = child
+            else:
+                self.next_sibling[previous] = child
+            previous = child
+        self.last_child[index] = previous
+        return index
+
+    def _append(self, name: str, data_size: int, kind: int, colour: bytes,
+                flags: int, parent: int) -> int:
+        """Append a node with no children to the arrays, as the last child of
+        <parent> (if it is not NO_NODE), and return its index.
+        """
+        self._draw_lists.clear()
+        index = len(self.names)
+        self.names.append(name)
+        self.parent.append(parent)
+        self.first_child.append(NO_NODE)
+        self.last_child.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self.data_size.append(data_size)
+        self.rects.extend((0, 0, 0, 0))
+        self.colours.frombytes(colour)
+        self.flags.append(flags)
+        self.kinds.append(kind)
+        if parent != NO_NODE:
+            self._link_last(parent, index)
+        return index
+
+    def _link_last(self, parent: int, index: int) -> None:
+        """Make the node at <index> the last child of the node at <parent>.
+        """
+        self._draw_lists.clear()
+        if self.last_child[parent] == NO_NODE:
+            self.first_child[parent] = index
+        else:
+            self.next_sibling[self.last_child[parent]] = index
+        self.last_child[parent] = index
+        self.parent[index] = parent
+        self.next_sibling[index] = NO_NODE
+
+    def _unlink(self, index: int) -> None:
+        """Remove the node at <index> from its parent's list of children.
+        """
+        self._draw_lists.clear()
+        parent = self.parent[index]
+        previous = NO_NODE
+        child = self.first_child[parent]
+        while child != index:
+            previous = child
+            child = self.next_sibling[child]
+        if previous == NO_NODE:
+            self.first_child[parent] = self.next_sibling[index]
+        else:
+            self.next_sibling[previous] = self.next_sibling[index]
+        if self.last_child[parent] == index:
+            self.last_child[parent] = previous
+        self.parent[index] = NO_NODE
+        self.next_sibling[index] = NO_NODE
+
+    def children(self, index: int) -> Iterator[int]:
+        """Yield the indices of the children of the node at <index>, in order.
+        """
+        child = self.first_child[index]
+        while child != NO_NODE:
+            yield child
+            child = self.next_sibling[child]
+
+    def node(self, index: int) -> CompactNode:
+        """Return the view of the node at <index>.
+
+        The same view object is returned every time for the same node.
+        """
+        view = self._views.get(index)
+        if view is None:
+            if self.kinds[index] == KIND_CHESS:
+                view = CompactChessNode(self, index)
+            else:
+                view = CompactNode(self, index)
+            self._views[index] = view
+        return view
+
+    def get_rect(self, index: int) -> Optional[tuple[int, int, int, int]]:
+        """Return the rectangle of the node at <index>, or None if it has
+        not been laid out.
+        """
+        if not self.flags[index] & HAS_RECT:
+            return None
+        return tuple(self.rects[4 * index:4 * index + 4])
+
+    def is_displayed_leaf(self, index: int) -> bool:
+        """Return whether the node at <index> is a leaf in the displayed-tree.
+        """
+        if self.flags[index] & EXPANDED:
+            return False
+        parent = self.parent[index]
+        return parent == NO_NODE or bool(self.flags[parent] & EXPANDED)
+
+    def update_rectangles(self, index: int,
+                          rect: tuple[int, int, int, int]) -> None:
+        """Lay out the node at <index> and its descendants in <rect>, exactly
+        as TMTree.update_rectangles does.
+
+        With slice_layout, the children of a node with many children are laid
+        out by _slice_layout_numpy when NumPy is installed.
+        """
+        self._draw_lists.clear()
+        rects = self.rects
+        flags = self.flags
+        layout = self.layout_strategy
+        use_numpy = np is not None and layout is slice_layout
+        stack = [(index, rect)]
+        while stack:
+            node, node_rect = stack.pop()
+            rects[4 * node:4 * node + 4] = array('i', node_rect)
+            flags[node] |= HAS_RECT
+            children = list(self.children(node))
+            if use_numpy and len(children) >= NUMPY_MIN_CHILDREN \
+                    and self._slice_layout_numpy(node_rect, children, stack):
+                continue
+            if children:
+                sizes = [self.data_size[child] for child in children]
+                stack.extend(zip(children, layout(node_rect, sizes)))
+
+    def _slice_layout_numpy(self, rect: tuple[int, int, int, int],
+                            children: list[int],
+                            stack: list[tuple[int, tuple[int, int, int,
+                                                         int]]]) -> bool:
+        """Lay out <children> in <rect> as slice_layout does, writing their
+        rects and HAS_RECT flags straight into the arrays with NumPy, and push
+        the children that have children of their own onto <stack>.
+
+        Return False, without changing anything, if the products of the
+        sizes and the longer side of <rect> may not be exact as floats, since
+        the rounding could then differ from slice_layout.
+        """
+        x, y, width, height = rect
+        length = width if width > height else height
+        indices = np.array(children, dtype=np.intp)
+        sizes = np.frombuffer(self.data_size, dtype=np.int64)[indices]
+        if float(sizes.sum(dtype=np.float64)) >= 2 ** 52 \
+                or int(sizes.max()) * abs(length) >= 2 ** 53:
+            return False
+        # both operands of the division are exact floats, so it rounds the
+        # same way as the int / int division in slice_layout
+        slices = np.floor(sizes * length / int(sizes.sum())).astype(np.int32)
+        starts = np.cumsum(slices) - slices
+
+        child_rects = np.empty((len(children), 4), dtype=np.int32)
+        child_rects[:] = rect
+        if width > height:
+            child_rects[:, 0] += starts
+            child_rects[:, 2] = slices
+        else:
+            child_rects[:, 1] += starts
+            child_rects[:, 3] = slices
+        np.frombuffer(self.rects, dtype=np.int32).reshape(-1, 4)[indices] = \
+            child_rects
+        np.frombuffer(self.flags, dtype=np.uint8)[indices] |= HAS_RECT
+
+        internal = np.frombuffer(self.first_child,
+                                 dtype=np.int32)[indices] != NO_NODE
+        for child, child_rect in zip(indices[internal].tolist(),
+                                     child_rects[internal].tolist()):
+            stack.append((child, tuple(child_rect)))
+        return True
+
+    def get_rectangles(self, index: int) -> list[
+            tuple[tuple[int, int, int, int], tuple[int, int, int]]]:
+        """Return the (rectangle, colour) pairs for the leaves of the
+        displayed-tree rooted at <index>, in the same order as
+        TMTree.get_rectangles.
+
+        As for TMTree.get_rectangles, the list for a root is computed once and
+        then reused until the store changes, so callers must not mutate it.
+        """
+        if self.parent[index] != NO_NODE:
+            return self._build_draw_list(index)
+        rectangles = self._draw_lists.get(index)
+        if rectangles is None:
+            rectangles = self._build_draw_list(index)
+            self._draw_lists[index] = rectangles
+        return rectangles
+
+    def _build_draw_list(self, index: int) -> list[
+            tuple[tuple[int, int, int, int], tuple[int, int, int]]]:
+        """Return a new list of the (rectangle, colour) pairs for the leaves
+        of the displayed-tree rooted at <index>.
+        """
+        rectangles = []
+        stack = [index]
+        while stack:
+            node = stack.pop()
+            if not self.flags[node] & HAS_RECT:
+                continue
+            if self.flags[node] & EXPANDED:
+                stack.extend(reversed(list(self.children(node))))
+            else:
+                rectangles.append((self.get_rect(node),
+                                   tuple(self.colours[3 * node:3 * node + 3])))
+        return rectangles
+
+    def get_tree_at_position(self, index: int,
+                             pos: tuple[int, int]) -> Optional[int]:
+        """Return the index of the node that TMTree.get_tree_at_position would
+        return for the node at <index> and position <pos>, or None.
+        """
+        if not self._contains(index, pos):
+            return None
+        if not self.flags[index] & EXPANDED:
+            return index
+        stack = list(reversed(list(self.children(index))))
+        while stack:
+            node = stack.pop()
+            if self._contains(node, pos):
+                if not self.flags[node] & EXPANDED:
+                    return node
+                stack.extend(reversed(list(self.children(node))))
+        return index
+
+    def _contains(self, index: int, pos: tuple[int, int]) -> bool:
+        """Return whether the rectangle of the node at <index>, including its
+        edges, contains <pos>.
+        """
+        x, y, width, height = self.rects[4 * index:4 * index + 4]
+        return x <= pos[0] <= x + width and y <= pos[1] <= y + height
+
+    def set_expanded(self, index: int, expanded: bool,
+                     descendants: bool = False) -> None:
+        """Set whether the node at <index> is expanded. If <descendants> is
+        True, do the same to every descendant of the node that has children.
+
+        Leaves are never marked as expanded.
+        """
+        self._draw_lists.clear()
+        stack = [index]
+        while stack:
+            node = stack.pop()
+            if expanded and self.first_child[node] == NO_NODE:
+                self.flags[node] &= ~EXPANDED
+            elif expanded:
+                self.flags[node] |= EXPANDED
+            else:
+                self.flags[node] &= ~EXPANDED
+            if descendants:
+                stack.extend(self.children(node))
+
+    def get_root(self, index: int) -> int:
+        """Return the index of the root of the tree containing <index>.
+        """
+        while self.parent[index] != NO_NODE:
+            index = self.parent[index]
+        return index
+
+    def move(self, index: int, destination: int) -> None:
+        """Move the node at <index> to be the last child of <destination>,
+        updating sizes, expanded state and rectangles as TMTree.move does.
+        """
+        parent = self.parent[index]
+        size = self.data_size[index]
+        self.set_expanded(parent, self.first_child[parent]
+                          != self.last_child[parent])
+        while self.parent[parent] != NO_NODE:
+            self.data_size[parent] -= size
+            parent = self.parent[parent]
+        self._unlink(index)
+        self._link_last(destination, index)
+        self.flags[destination] |= EXPANDED
+        node = destination
+        while self.parent[node] != NO_NODE:
+            self.data_size[node] += size
+            node = self.parent[node]
+        self._relayout_root(node)
+
+    def change_size(self, index: int, factor: float) -> None:
+        """Change the data size of the node at <index> by <factor> of its
+        current size, as TMTree.change_size does.
+        """
+        self._draw_lists.clear()
+        if factor >= 0:
+            change = math.ceil(self.data_size[index] * factor)
+        else:
+            change = math.floor(self.data_size[index] * factor)
+        children_size = sum(self.data_size[child]
+                            for child in self.children(index))
+        self.data_size[index] = max(self.data_size[index] + change,
+                                    children_size, 1)
+        node = index
+        while self.parent[node] != NO_NODE:
+            node = self.parent[node]
+            self.data_size[node] += change
+        self._relayout_root(node)
+
+    def _relayout_root(self, root: int) -> None:
+        """Reapply the treemap algorithm to <root> in its current rectangle.
+        """
+        rect = self.get_rect(root)
+        if rect is not None:
+            self.update_rectangles(root, rect)
+
+    def path_string(self, index: int) -> str:
+        """Return the string that get_path_string would return for the
+        equivalent TMTree of the node at <index>.
+        """
+        kind = self.kinds[index]
+        name = self.names[index]
+        if kind == KIND_FILE:
+            parts = [f"{name} (file)"]
+        elif kind == KIND_DIRECTORY:
+            parts = [f"{name} (directory)"]
+        else:
+            parts = [f"{name}({self.data_size[index]}) "
+                     f"{self.get_rect(index)}"]
+        node = self.parent[index]
+        while node != NO_NODE:
+            if self.kinds[node] in (KIND_FILE, KIND_DIRECTORY):
+                parts.append(f"{self.names[node]}{os.path.sep}")
+            else:
+                parts.append(f"{self.names[node]} | ")
+            node = self.parent[node]
+        return ''.join(reversed(parts))
+
+    def to_string(self, index: int) -> str:
+        """Return the string that str() would return for the equivalent
+        TMTree (or DirectoryTree) of the node at <index>.
+        """
+        return '\n'.join(self._str_lines(index))
+
+    def write_tree(self, index: int, file: TextIO,
+                   max_depth: Optional[int] = None) -> None:
+        """Write what write_tree would write for the equivalent TMTree (or
+        DirectoryTree) of the node at <index> to <file>, one line at a time.
+        If <max_depth> is given, only the nodes at most <max_depth> levels
+        below <index> are written.
+        """
+        file.writelines(line + '\n'
+                        for line in self._str_lines(index, max_depth))
+
+    def _str_lines(self, index: int,
+                   max_depth: Optional[int] = None) -> Iterator[str]:
+        """Yield the lines of to_string(<index>), to at most <max_depth>
+        levels below <index> (or all of them if <max_depth> is None).
+        """
+        directory_format = self.kinds[index] == KIND_DIRECTORY
+        stack = [(index, 0)]
+        while stack:
+            node, depth = stack.pop()
+            name = self.names[node]
+            has_children = self.first_child[node] != NO_NODE
+            if directory_format and depth == 0:
+                name += '/'
+            elif directory_format and has_children and \
+                    self.kinds[node] == KIND_DIRECTORY:
+                name += os.path.sep
+            elif not directory_format and has_children:
+                name += ' | '
+            yield (f"{depth * '    '}{name}({self.data_size[node]}) "
+                   f"{self.get_rect(node)}")
+            if max_depth is None or depth < max_depth:
+                stack.extend((child, depth + 1) for child in
+                             reversed(list(self.children(node))))
+
+
+class CompactNode(TMTree):
+    """A TMTree that is a view of one node of a CompactTree.
+
+    All attributes are read from, and written to, the arrays of the
+    CompactTree, and the public TMTree methods work directly on those arrays,
+    so using a view never creates views for the rest of the tree.
+
+    The behaviour of FileTree, DirectoryTree and ChessTree nodes (their path
+    strings, and which moves and size changes they support) depends on the
+    kind of the node in the store.
+
+    === Private Attributes ===
+    _store:
+        The CompactTree this is a view of.
+    _index:
+        The index of this node in _store.
+    """
+    __slots__ = ('_store', '_index')
+
+    _store: CompactTree
+    _index: int
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, store: CompactTree, index: int) -> None:
+        """Initialize a view of the node at <index> in <store>.
+
+        Use CompactTree.node rather than calling this directly, so that each
+        node has only one view.
+        """
+        self._store = store
+        self._index = index
+
+    @property
+    def rect(self) -> Optional[tuple[int, int, int, int]]:
+        """The pygame rectangle of this node, or None."""
+        return self._store.get_rect(self._index)
+
+    @rect.setter
+    def rect(self, rect: Optional[tuple[int, int, int, int]]) -> None:
+        store, index = self._store, self._index
+        store._draw_lists.clear()
+        if rect is None:
+            store.flags[index] &= ~HAS_RECT
+        else:
+            store.rects[4 * index:4 * index + 4] = array('i', rect)
+            store.flags[index] |= HAS_RECT
+
+    @property
+    def data_size(self) -> int:
+        """The size of the data represented by this tree."""
+        return self._store.data_size[self._index]
+
+    @data_size.setter
+    def data_size(self, data_size: int) -> None:
+        self._store.data_size[self._index] = data_size
+
+    @property
+    def _name(self) -> str:
+        """The root value of this tree."""
+        return self._store.names[self._index]
+
+    @property
+    def _colour(self) -> tuple[int, int, int]:
+        """The RGB colour value of the root of this tree."""
+        index = self._index
+        return tuple(self._store.colours[3 * index:3 * index + 3])
+
+    @property
+    def _expanded(self) -> bool:
+        """Whether this tree is considered expanded for visualization."""
+        return bool(self._store.flags[self._index] & EXPANDED)
+
+    @_expanded.setter
+    def _expanded(self, expanded: bool) -> None:
+        self._store._draw_lists.clear()
+        if expanded:
+            self._store.flags[self._index] |= EXPANDED
+        else:
+            self._store.flags[self._index] &= ~EXPANDED
+
+    @property
+    def _parent_tree(self) -> Optional[CompactNode]:
+        """The view of the parent of this tree, or None."""
+        parent = self._store.parent[self._index]
+        return None if parent == NO_NODE else self._store.node(parent)
+
+    @property
+    def _subtrees(self) -> list[CompactNode]:
+        """The views of the subtrees of this tree (a new list each time)."""
+        return [self._store.node(child)
+                for child in self._store.children(self._index)]
+
+    def is_displayed_tree_leaf(self) -> bool:
+        return self._store.is_displayed_leaf(self._index)
+
+    def get_path_string(self) -> str:
+        return self._store.path_string(self._index)
+
+    def __str__(self) -> str:
+        return self._store.to_string(self._index)
+
+    def write_tree(self, file: TextIO, max_depth: Optional[int] = None) -> None:
+        self._store.write_tree(self._index, file, max_depth)
+
+    def update_rectangles(self, rect: tuple[int, int, int, int]) -> None:
+        self._store.update_rectangles(self._index, rect)
+
+    def set_layout_strategy(self, strategy: LayoutStrategy) -> None:
+        self._store.layout_strategy = strategy
+        self._store._relayout_root(self._store.get_root(self._index))
+
+    def get_rectangles(self) -> list[tuple[tuple[int, int, int, int],
+                                           tuple[int, int, int]]]:
+        return self._store.get_rectangles(self._index)
+
+    def get_tree_at_position(self, pos: tuple[int, int]) -> Optional[TMTree]:
+        index = self._store.get_tree_at_position(self._index, pos)
+        return None if index is None else self._store.node(index)
+
+    def expand(self) -> TMTree:
+        store = self._store
+        first = store.first_child[self._index]
+        if first == NO_NODE:
+            return self
+        store.set_expanded(self._index, True)
+        return store.node(first)
+
+    def expand_all(self) -> TMTree:
+        store = self._store
+        store.set_expanded(self._index, True, descendants=True)
+        last = self._index
+        while store.last_child[last] != NO_NODE:
+            last = store.last_child[last]
+        return store.node(last)
+
+    def collapse(self) -> TMTree:
+        store = self._store
+        parent = store.parent[self._index]
+        if parent == NO_NODE:
+            return self
+        store.set_expanded(parent, False, descendants=True)
+        return store.node(parent)
+
+    def collapse_all(self) -> TMTree:
+        store = self._store
+        root = store.get_root(self._index)
+        store.set_expanded(root, False, descendants=True)
+        return store.node(root)
+
+    def move(self, destination: TMTree) -> None:
+        store = self._store
+        if not isinstance(destination, CompactNode) or \
+                destination._store is not store:
+            raise OperationNotSupportedError
+        if store.kinds[self._index] in (KIND_FILE, KIND_DIRECTORY) and \
+                store.kinds[destination._index] == KIND_FILE:
+            raise OperationNotSupportedError
+        store.move(self._index, destination._index)
+
+    def change_size(self, factor: float) -> None:
+        if self._store.kinds[self._index] == KIND_DIRECTORY:
+            raise OperationNotSupportedError
+        self._store.change_size(self._index, factor)
+
+
+class CompactChessNode(CompactNode):
+    """A CompactNode for a node that came from a ChessTree.
+    """
+    __slots__ = ()
+
+    def get_suffix(self) -> str:
+        store, index = self._store, self._index
+        if store.first_child[index] == NO_NODE:
+            return ' (end)'
+        if store.flags[index] & WHITE_TO_PLAY:
+            return ' (white to play)'
+        return ' (black to play)'
+
+    def open_page(self) -> None:
+        """
+        Open a web browser to a lichess url corresponding
+        to the board state of this tree.
+        """
+        store = self._store
+        moves = []
+        node = self._index
+        while store.parent[node] != NO_NODE:
+            moves.append(store.names[node])
+            node = store.parent[node]
+        moves.reverse()
+        print(f'Opening game after moves: {"-".join(moves)}')
+        webbrowser.open(url_from_moves(moves))
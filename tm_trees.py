@@ -23,10 +23,18 @@ visualiser. You will both add to the TMTree class, and complete implementations
 of several subclasses to represent specific types of data.
 """
 from __future__ import annotations
+import csv
 import os
-import math  # You can remove this math import if you don't end up using it.
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+import math
+import re
 from random import randint
-from typing import Optional
+from sys import intern
+import time
+from typing import Callable, ClassVar, Iterable, Iterator, Optional, TextIO, \
+    TypeVar
 import webbrowser
 import json
 
@@ -38,6 +46,33 @@ class OperationNotSupportedError(Exception):
     """
 
 
+# the type of node built by build_from_path
+_T = TypeVar('_T')
+
+# the number of characters iter_games reads from a file at a time
+GAMES_CHUNK_SIZE = 1 << 16
+# the number of games in each shard built by ChessTree.from_games_parallel
+GAMES_PER_SHARD = 10_000
+_WHITESPACE = re.compile(r'\s*')
+
+# the name of the leaf that stands for the moves pruned from a chess tree
+PRUNED_MOVES = '...'
+
+# the number of nodes of each chess tree whose FEN is kept by position_fen
+FEN_CACHE_SIZE = 4096
+
+# the version of the file written by ScanCache.save
+SCAN_CACHE_VERSION = 1
+# ScanCache does not keep the listing of a directory modified less than this
+# many nanoseconds before it was listed, since a change made later within the
+# resolution of the file system's timestamps would not change its mtime
+RACY_MTIME_NS = 2_000_000_000
+
+# a function that gives the rectangles of children with the given data sizes
+# inside a pygame rectangle, such as slice_layout or squarified_layout
+LayoutStrategy = Callable[[tuple[int, int, int, int], list[int]],
+                          list[tuple[int, int, int, int]]]
+
 # used in a DirectoryTree doctest example
 DIRECTORYTREE_EXAMPLE_RESULT = """./(47) None
     documents/(24) None
@@ -89,10 +124,8 @@ def path_to_nested_tuple(path: str) -> tuple[str, int | list]:
     your computer. Please make sure to run the self-tests on MarkUs once they
     are made available to ensure your code is passing the self-tests
     corresponding to this doctest example.
-    Reminder: your solution MUST use the provided ordered_listdir helper
-              function to ensure consistent ordering and contents of the
-              returned list of file and directory names when traversing the
-              file system.
+    The scan itself is done by scan_path, which orders and filters the names
+    in each directory exactly as the ordered_listdir helper function does.
 
     Precondition:
     <path> is a valid path to a FILE or a DIRECTORY.
@@ -104,18 +137,281 @@ def path_to_nested_tuple(path: str) -> tuple[str, int | list]:
     >>> rslt[1]
     [('images', [('Cats.pdf', 17)]), ('reading.md', 7)]
     """
-    directory = ordered_listdir(path)
-    subitems = []
-    for filename in directory:
-        subitem = os.path.join(path, filename)
-        if os.path.isdir(subitem):
-            subitems.append(path_to_nested_tuple(subitem))
+    return scan_path(path)
+
+
+def scan_path(path: str, max_workers: Optional[int] = None,
+              cache: Optional[ScanCache] = None) -> tuple[str, int | list]:
+    """
+    Return the same nested tuple as path_to_nested_tuple for <path>, scanning
+    the directories with os.scandir on a pool of <max_workers> threads.
+
+    This is build_from_path with nested tuples as the nodes it builds; see
+    build_from_path for how the scan is done.
+
+    Precondition:
+    <path> is a valid path to a FILE or a DIRECTORY.
+
+    >>> path = os.path.join("example-directory", "workshop", "prep")
+    >>> scan_path(path) == path_to_nested_tuple(path)
+    True
+    >>> scan_path(path, 1)
+    ('prep', [('images', [('Cats.pdf', 17)]), ('reading.md', 7)])
+    """
+    return build_from_path(path, lambda name, size: (name, size),
+                           lambda name, contents: (name, contents),
+                           max_workers, cache)
+
+
+def path_to_dir_tree(path: str, max_workers: Optional[int] = None,
+                     cache: Optional[ScanCache] = None) -> DirectoryTree:
+    """
+    Return the DirectoryTree for the directory at <path>, built in a single
+    pass over the file system with no nested tuple in between.
+
+    The result is the same as
+    dir_tree_from_nested_tuple(path_to_nested_tuple(path)).
+
+    Precondition:
+    <path> is a valid path to a DIRECTORY.
+
+    >>> path = os.path.join("example-directory", "workshop", "prep")
+    >>> tree = path_to_dir_tree(path)
+    >>> tree.data_size
+    26
+    >>> str(tree) == str(dir_tree_from_nested_tuple(path_to_nested_tuple(path)))
+    True
+    """
+    return build_from_path(path, lambda name, size: FileTree(name, [], size),
+                           DirectoryTree, max_workers, cache)
+
+
+def build_from_path(path: str, make_file: Callable[[str, int], _T],
+                    make_directory: Callable[[str, list[_T]], _T],
+                    max_workers: Optional[int] = None,
+                    cache: Optional[ScanCache] = None) -> _T:
+    """
+    Return the node for the file or directory at <path>, built bottom-up in a
+    single pass over the file system.
+
+    Files are built with make_file(name, size), where size is 1 + the size of
+    the file in bytes. Directories are built with
+    make_directory(name, children), once all of their children have been
+    built. Children are in ordered_listdir order.
+
+    Each directory is listed exactly once with os.scandir, and the DirEntry
+    objects are used to tell files from directories and to find file sizes,
+    so no extra os.path.isdir or os.path.getsize calls are made. Directories
+    are walked with an explicit stack rather than recursion, so deep paths
+    cannot raise a RecursionError.
+
+    As soon as a directory is listed, its subdirectories are submitted to a
+    pool of <max_workers> threads to be listed in the background. If
+    <max_workers> is None, the ThreadPoolExecutor default is used; if it is 1,
+    everything runs on the calling thread.
+
+    If <cache> is not None, directories are listed through it, so only the
+    directories that changed since it last saw them are listed again.
+
+    Precondition:
+    <path> is a valid path to a FILE or a DIRECTORY.
+    """
+    name = os.path.basename(path)
+    if not os.path.isdir(path):
+        return make_file(name, 1 + os.path.getsize(path))
+
+    list_directory = _list_directory if cache is None \
+        else cache.list_directory
+    executor = None if max_workers == 1 else ThreadPoolExecutor(max_workers)
+    try:
+        stack = [_open_directory(path, name, list_directory(path), executor,
+                                 list_directory)]
+        while True:
+            dir_path, dir_name, listing, children, prefetched = stack[-1]
+            entry = next(listing, None)
+            if entry is None:
+                stack.pop()
+                node = make_directory(dir_name, children)
+                if not stack:
+                    return node
+                stack[-1][3].append(node)
+            elif entry[1] is None:
+                sub_path = os.path.join(dir_path, entry[0])
+                if executor is None:
+                    sub_listing = list_directory(sub_path)
+                else:
+                    sub_listing = prefetched.pop(entry[0]).result()
+                stack.append(_open_directory(sub_path, entry[0], sub_listing,
+                                             executor, list_directory))
+            else:
+                children.append(make_file(entry[0], entry[1]))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _open_directory(path: str, name: str,
+                    listing: list[tuple[str, Optional[int]]],
+                    executor: Optional[ThreadPoolExecutor],
+                    list_directory: Callable[
+                        [str], list[tuple[str, Optional[int]]]]) -> tuple:
+    """
+    Return the stack frame used by build_from_path for the directory at
+    <path> called <name>, whose contents are <listing>.
+
+    If <executor> is not None, list_directory is submitted to it for every
+    subdirectory, and the futures are stored in the frame by subdirectory
+    name.
+    """
+    prefetched = {}
+    if executor is not None:
+        for entry_name, size in listing:
+            if size is None:
+                prefetched[entry_name] = executor.submit(
+                    list_directory, os.path.join(path, entry_name))
+    return path, name, iter(listing), [], prefetched
+
+
+def _list_directory(path: str) -> list[tuple[str, Optional[int]]]:
+    """
+    Return the (name, size) pairs for the files and directories in <path>,
+    in ordered_listdir order. The size of a directory is None, and the size of
+    a file is 1 + its size in bytes.
+
+    Precondition:
+    <path> is a valid path to a directory
+    """
+    listing = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                listing.append((entry.name, None))
+            else:
+                listing.append((entry.name, 1 + entry.stat().st_size))
+    listing.sort(key=lambda item: item[0])
+    return listing
+
+
+class ScanCache:
+    """
+    The listings of the directories seen by build_from_path, kept between
+    runs in a JSON file, so that rescanning a large tree does not list again
+    the directories that have not changed.
+
+    A listing, with the sizes of its files, is reused while the directory
+    has the same inode and mtime as when it was listed, since creating,
+    deleting or renaming an entry changes the mtime of its directory. So a
+    rescan makes one os.stat call for each directory, and lists none of the
+    unchanged ones or stats the files in them.
+
+    Editing a file in place does not change the mtime of its directory, so
+    the new size of a file edited in place is missed until its directory
+    changes some other way. Set rescan to True to list every directory again.
+
+    === Public Attributes ===
+    path:
+        The file the cache is loaded from and saved to, or None if it is
+        only kept in memory.
+    rescan:
+        If True, no listing is reused, and every directory is listed again
+        and its listing stored.
+
+    === Private Attributes ===
+    _directories:
+        The mtime in nanoseconds, inode and listing of each directory, by
+        absolute path.
+    _visited:
+        The absolute paths of the directories listed through this cache since
+        it was loaded or last saved.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     cache = ScanCache(os.path.join(directory, 'scan.json'))
+    ...     path = os.path.join("example-directory", "workshop", "prep")
+    ...     first = scan_path(path, 1, cache)
+    ...     cache.save()
+    ...     first == scan_path(path, 1, ScanCache(cache.path))
+    True
+    """
+    path: Optional[str]
+    rescan: bool
+    _directories: dict[str, tuple[int, int, list[tuple[str, Optional[int]]]]]
+    _visited: set[str]
+
+    def __init__(self, path: Optional[str] = None,
+                 rescan: bool = False) -> None:
+        """Initialize a cache saved to <path>, loading the listings saved
+        there before, if it holds a cache of this version.
+        """
+        self.path = path
+        self.rescan = rescan
+        self._directories = {}
+        self._visited = set()
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding='utf-8') as file:
+                saved = json.load(file)
+        except ValueError:
+            return
+        if saved.get('version') != SCAN_CACHE_VERSION:
+            return
+        for directory, (mtime, inode, listing) in \
+                saved['directories'].items():
+            self._directories[directory] = (
+                mtime, inode, [(name, size) for name, size in listing])
+
+    def __len__(self) -> int:
+        """Return the number of directories whose listing is cached.
+        """
+        return len(self._directories)
+
+    def list_directory(self, path: str) -> list[tuple[str, Optional[int]]]:
+        """
+        Return the same listing as _list_directory(path), or the cached
+        listing if the directory at <path> has not changed since it was made
+        and self.rescan is False. The sizes of the files in a cached listing
+        are those they had when it was made.
+
+        Precondition:
+        <path> is a valid path to a directory
+        """
+        key = os.path.abspath(path)
+        self._visited.add(key)
+        info = os.stat(path)
+        cached = self._directories.get(key)
+        if cached is not None and not self.rescan \
+                and cached[0] == info.st_mtime_ns \
+                and cached[1] == info.st_ino:
+            return cached[2]
+        listed_at = time.time_ns()
+        listing = _list_directory(path)
+        if info.st_mtime_ns < listed_at - RACY_MTIME_NS:
+            self._directories[key] = (info.st_mtime_ns, info.st_ino, listing)
         else:
-            subitems.append(tuple([os.path.basename(subitem), 1
-                            + os.path.getsize(subitem)]))
-    tuple_ = [os.path.basename(path), subitems]
-    tuple_ = tuple(tuple_)
-    return tuple_
+            self._directories.pop(key, None)
+        return listing
+
+    def save(self) -> None:
+        """Write the listings of the directories visited since this cache was
+        loaded or last saved to the file at self.path, replacing it only once
+        it has been written in full. The other listings, such as those of
+        deleted directories, are dropped.
+
+        Precondition:
+        self.path is not None
+        """
+        self._directories = {directory: entry for directory, entry
+                             in self._directories.items()
+                             if directory in self._visited}
+        self._visited = set()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'version': SCAN_CACHE_VERSION,
+                       'directories': self._directories}, file)
+        os.replace(temp_path, self.path)
 
 
 def ordered_listdir(path: str) -> list[str]:
@@ -143,20 +439,27 @@ def dir_tree_from_nested_tuple(obj: tuple[str, int | list]) -> DirectoryTree:
     its root. See the path_to_nested_tuple function for details of the format.
 
     See the DirectoryTree's doctest examples for sample usage.
-    """
-    directory_tree: DirectoryTree
 
-    if isinstance(obj[1], list):
-        subtrees = []
-        for directory in obj[1]:
-            subtrees.append(dir_tree_from_nested_tuple(directory))
-
-        directory_tree = DirectoryTree(obj[0], subtrees)
-
-    else:
-        directory_tree = FileTree(obj[0], [], obj[1])
-
-    return directory_tree
+    The nested tuple is walked with an explicit stack rather than recursion,
+    so deeply nested input cannot raise a RecursionError.
+    """
+    if not isinstance(obj[1], list):
+        return FileTree(obj[0], [], obj[1])
+
+    stack = [(obj[0], iter(obj[1]), [])]
+    while True:
+        name, items, subtrees = stack[-1]
+        item = next(items, None)
+        if item is None:
+            stack.pop()
+            directory_tree = DirectoryTree(name, subtrees)
+            if not stack:
+                return directory_tree
+            stack[-1][2].append(directory_tree)
+        elif isinstance(item[1], list):
+            stack.append((item[0], iter(item[1]), []))
+        else:
+            subtrees.append(FileTree(item[0], [], item[1]))
 
 
 # provided, do not modify this helper function
@@ -179,8 +482,187 @@ def url_from_moves(moves: list[str]) -> str:
     return url
 
 
-def moves_to_nested_dict(moves: list[list[str]]) -> dict[tuple[str,
-                                                               int], dict]:
+def url_from_fen(fen: str) -> str:
+    """
+    Return the lichess url for the board position given by <fen>, which is
+    the url that url_from_moves gives for the moves that reach it.
+
+    >>> url_from_fen('8/8/8/8/8/8/8/K1k5 w - - 0 1')
+    'https://lichess.org/analysis/8/8/8/8/8/8/8/K1k5_w_-_-_0_1'
+    """
+    return 'https://lichess.org/analysis/' + fen.replace(' ', '_')
+
+
+def position_fen(tree: TMTree) -> str:
+    """
+    Return the FEN of the board position after the moves on the path from
+    the root of the chess tree that <tree> is in to <tree>. <tree> may be a
+    ChessTree or one of its leaves.
+
+    If the root is a ChessTree, it keeps the FENs of the last FEN_CACHE_SIZE
+    of its nodes used, so the position of a node is found from the nearest
+    ancestor in the cache, with one move played for each node below it.
+    Asking for the nodes of a tree in preorder takes one move per node,
+    however deep they are.
+
+    Precondition:
+    the names of the nodes below the root are uci formatted moves
+
+    >>> ct = ChessTree({('e2e4', 0): {('e7e5', 1): {}}})
+    >>> position_fen(ct._subtrees[0]._subtrees[0])
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2'
+    """
+    import chess
+    path = [tree]
+    while path[-1]._parent_tree is not None:
+        path.append(path[-1]._parent_tree)
+    root = path.pop()
+    if isinstance(root, ChessTree):
+        state = root._get_tree_state()
+        if state.fen_cache is None:
+            state.fen_cache = OrderedDict()
+        cache = state.fen_cache
+    else:
+        cache = OrderedDict()
+    fen = chess.STARTING_FEN
+    for i, ancestor in enumerate(path):
+        if ancestor in cache:
+            fen = cache[ancestor]
+            cache.move_to_end(ancestor)
+            del path[i:]
+            break
+    if path:
+        board = chess.Board(fen)
+        for ancestor in reversed(path):
+            board.push(chess.Move.from_uci(ancestor._name))
+            fen = board.fen()
+            cache[ancestor] = fen
+        while len(cache) > FEN_CACHE_SIZE:
+            cache.popitem(last=False)
+    return fen
+
+
+def slice_layout(rect: tuple[int, int, int, int],
+                 sizes: list[int]) -> list[tuple[int, int, int, int]]:
+    """
+    Return the rectangles that the treemap algorithm gives to children with
+    data sizes <sizes> inside the pygame rectangle <rect>.
+
+    The rectangle is sliced along its longer side (vertically if it is
+    square), and each child gets a slice proportional to its size, rounded
+    down.
+
+    Precondition:
+    <sizes> is non-empty and every size is > 0
+
+    >>> slice_layout((0, 0, 100, 200), [5, 15])
+    [(0, 0, 100, 50), (0, 50, 100, 150)]
+    >>> slice_layout((10, 0, 200, 100), [1, 2])
+    [(10, 0, 66, 100), (76, 0, 133, 100)]
+    """
+    x, y, width, height = rect
+    count = sum(sizes)
+    rects = []
+    if width > height:
+        for size in sizes:
+            slice_width = math.floor(width * size / count)
+            rects.append((x, y, slice_width, height))
+            x += slice_width
+    else:
+        for size in sizes:
+            slice_height = math.floor(height * size / count)
+            rects.append((x, y, width, slice_height))
+            y += slice_height
+    return rects
+
+
+def squarified_layout(rect: tuple[int, int, int, int],
+                      sizes: list[int]) -> list[tuple[int, int, int, int]]:
+    """
+    Return the rectangles that the squarified treemap algorithm gives to
+    children with data sizes <sizes> inside the pygame rectangle <rect>, in
+    the same order as <sizes>.
+
+    The children are placed from largest to smallest, in rows along the
+    shorter side of the space that is left. A child is added to the current
+    row as long as that does not make the worst aspect ratio in the row
+    worse. The edges are rounded to whole pixels only at the end, so the
+    rectangles cover <rect> with no gaps. This takes O(n log n) time for n
+    children, for the sort.
+
+    Precondition:
+    <sizes> is non-empty and every size is > 0
+
+    >>> squarified_layout((0, 0, 100, 100), [1, 1, 1, 1])
+    [(0, 0, 50, 50), (0, 50, 50, 50), (50, 0, 50, 50), (50, 50, 50, 50)]
+    >>> squarified_layout((0, 0, 60, 40), [1, 5])
+    [(50, 0, 10, 40), (0, 0, 50, 40)]
+    """
+    x, y, width, height = rect
+    if len(sizes) == 1 or width <= 0 or height <= 0:
+        return slice_layout(rect, sizes)
+    order = sorted(range(len(sizes)), key=sizes.__getitem__, reverse=True)
+    scale = width * height / sum(sizes)
+    areas = [sizes[i] * scale for i in order]
+    edges = [None] * len(sizes)
+
+    # the space that is left, as floats
+    left, top, right, bottom = float(x), float(y), float(x + width), \
+        float(y + height)
+    start = 0
+    while start < len(order):
+        side = min(right - left, bottom - top)
+        side_squared = side * side
+        largest = areas[start]
+        row_area = 0.0
+        worst = math.inf
+        end = start
+        while end < len(order):
+            area = areas[end]
+            new_area = row_area + area
+            new_worst = max(side_squared * largest / (new_area * new_area),
+                            new_area * new_area / (side_squared * area))
+            if new_worst > worst:
+                break
+            row_area, worst = new_area, new_worst
+            end += 1
+
+        last_row = end == len(order)
+        if right - left >= bottom - top:
+            # the row is a column at the left of the space that is left
+            row_right = right if last_row else left + row_area / side
+            row_width = row_right - left
+            position = top
+            for k in range(start, end - 1):
+                child_bottom = position + areas[k] / row_width
+                edges[order[k]] = (left, position, row_right, child_bottom)
+                position = child_bottom
+            edges[order[end - 1]] = (left, position, row_right, bottom)
+            left = row_right
+        else:
+            # the row is a strip at the top of the space that is left
+            row_bottom = bottom if last_row else top + row_area / side
+            row_height = row_bottom - top
+            position = left
+            for k in range(start, end - 1):
+                child_right = position + areas[k] / row_height
+                edges[order[k]] = (position, top, child_right, row_bottom)
+                position = child_right
+            edges[order[end - 1]] = (position, top, right, row_bottom)
+            top = row_bottom
+        start = end
+
+    rects = []
+    for child_left, child_top, child_right, child_bottom in edges:
+        rect_left, rect_top = round(child_left), round(child_top)
+        rects.append((rect_left, rect_top, round(child_right) - rect_left,
+                      round(child_bottom) - rect_top))
+    return rects
+
+
+def moves_to_nested_dict(moves: list[list[str]],
+                         max_depth: Optional[int] = None,
+                         min_games: int = 1) -> dict[tuple[str, int], dict]:
     """
     Convert <games> into a nested dictionary representing the sequence of moves
     made in the games.
@@ -196,6 +678,17 @@ def moves_to_nested_dict(moves: list[list[str]]) -> dict[tuple[str,
     this structure. An empty dictionary is stored as the value for a move that
     will correspond to a leaf
 
+    Each game is inserted once into a trie (see _build_move_trie), which is
+    then converted to the nested dictionary without recursion, so this takes
+    time linear in the total number of moves.
+
+    If <max_depth> is given, the moves after the first <max_depth> moves of
+    each game are pruned, and moves that fewer than <min_games> games played
+    are pruned too. The moves pruned after each sequence of moves are
+    replaced by a single (PRUNED_MOVES, n) key with an empty dictionary,
+    where n is the number of games that played any of them. See
+    _prune_move_trie.
+
     Note: to keep the docstring short, we use single letters in place
           of real chess moves, as it has no impact on the logic of how this
           code needs to be implemented, since it should work for arbitary
@@ -216,31 +709,638 @@ def moves_to_nested_dict(moves: list[list[str]]) -> dict[tuple[str,
     ...    ["a", "b", "c"], ["a", "b"], ["d", "e", "a"], ["d", "e"]])
     >>> d
     {('a', 0): {('b', 1): {('c', 1): {}}}, ('d', 0): {('e', 1): {('a', 1): {}}}}
+    >>> d = moves_to_nested_dict([["a", "b", "c"], ["a", "b"],
+    ...                           ["d", "e", "a"], ["d", "e"]],
+    ...                          max_depth=2, min_games=2)
+    >>> d[('a', 0)]
+    {('b', 1): {('...', 1): {}}}
+    >>> d[('d', 0)]
+    {('e', 1): {('...', 1): {}}}
     """
-    if not moves:
-        return {}
-    else:
-        temp_dict = {}
-        dict_of_moves = {}
-        for lst in moves:
-            if not lst:
-                continue
-            if lst[0] not in temp_dict:
-                temp_dict[lst[0]] = []
-            if len(lst) == 1:
-                temp_dict[lst[0]].append([])
-            else:
-                temp_dict[lst[0]].append(lst[1:])
-        for key, value in temp_dict.items():
-            count = 0
-            for lst in value:
-                if not lst:
-                    count += 1
-            dict_of_moves[tuple([key, count])] = value
-        for key, value in dict_of_moves.items():
-            dict_of_moves[key] = moves_to_nested_dict(value)
+    nested_dict = {}
+    trie = _build_move_trie(moves)
+    _prune_move_trie(trie, max_depth, min_games)
+    stack = [(trie, nested_dict)]
+    while stack:
+        trie, nested = stack.pop()
+        for move, (count, children) in trie.items():
+            nested[(move, count)] = {}
+            if children:
+                stack.append((children, nested[(move, count)]))
+    return nested_dict
+
+
+def _build_move_trie(games: Iterable[list[str]]) -> dict[str, list]:
+    """
+    Return a trie of the moves in <games>, built by inserting each game once.
+
+    The trie maps each first move to a list [count, children], where count is
+    the number of games that ended immediately after that move and children
+    is a trie of the same form for the moves that followed it. The moves in
+    each trie are in the order in which they first occur in <games>.
+
+    The moves are interned when they are added to the trie, so every tree
+    built from it shares one string for each distinct move, rather than
+    keeping the copy from whichever game first played the move there.
+
+    >>> _build_move_trie([['a', 'b'], ['a'], [], ['c']])
+    {'a': [1, {'b': [1, {}]}], 'c': [1, {}]}
+    """
+    trie = {}
+    for game in games:
+        children = trie
+        node = None
+        for move in game:
+            node = children.get(move)
+            if node is None:
+                node = [0, {}]
+                children[intern(move)] = node
+            children = node[1]
+        if node is not None:
+            node[0] += 1
+    return trie
+
+
+def _prune_move_trie(trie: dict[str, list], max_depth: Optional[int],
+                     min_games: int) -> None:
+    """
+    Prune the moves of <trie>, a trie built by _build_move_trie, that are
+    after the first <max_depth> moves of a game (unless <max_depth> is None)
+    or that fewer than <min_games> games played. In each trie, the moves
+    pruned from it are replaced by one PRUNED_MOVES move with no children,
+    last, which counts every game that played one of them.
+
+    So the number of games that play each sequence of moves that is kept,
+    and so every data_size in a tree built from <trie>, stays the same.
+
+    >>> trie = _build_move_trie([['a', 'b', 'c'], ['a', 'd'], ['e']])
+    >>> _prune_move_trie(trie, 1, 2)
+    >>> trie
+    {'a': [0, {'...': [2, {}]}], '...': [1, {}]}
+    """
+    if max_depth is None and min_games <= 1:
+        return
+    # the number of games that played each move, found for the moves in
+    # reverse preorder, so after the moves that follow them
+    preorder = []
+    stack = list(trie.values())
+    while stack:
+        node = stack.pop()
+        preorder.append(node)
+        stack.extend(node[1].values())
+    games_played = {}
+    for node in reversed(preorder):
+        games_played[id(node)] = node[0] + sum(
+            games_played[id(child)] for child in node[1].values())
+
+    # each entry is (a trie, the ply of its moves)
+    stack = [(trie, 1)]
+    while stack:
+        children, ply = stack.pop()
+        pruned = 0
+        for move, node in list(children.items()):
+            played = games_played[id(node)]
+            if played < min_games or (max_depth is not None
+                                      and ply > max_depth):
+                pruned += played
+                del children[move]
+            elif node[1]:
+                stack.append((node[1], ply + 1))
+        if pruned:
+            children[PRUNED_MOVES] = [pruned, {}]
+
+
+def _consume_trie_entries(trie: dict[str, list]) -> \
+        Iterator[tuple[str, int, dict]]:
+    """
+    Yield the (move, count, children) entries of a trie built by
+    _build_move_trie, in order, and then empty <trie>, so that its nodes can
+    be freed while the rest of a tree is built from it.
+    """
+    for move, (count, children) in trie.items():
+        yield move, count, children
+    trie.clear()
+
+
+def _build_flat_move_trie(games: list[list[str]]) -> list:
+    """
+    Return the trie _build_move_trie(<games>) flattened into a list: the
+    number of first moves, followed by move, count, number of children for
+    every node in preorder.
+
+    This is the form in which the workers of ChessTree.from_games_parallel
+    send back their tries. A flat list pickles faster than nested
+    dictionaries, and unlike them, it cannot hit the recursion limit of
+    pickle for long games.
+
+    >>> _build_flat_move_trie([['a', 'b'], ['a'], [], ['c']])
+    [2, 'a', 1, 1, 'b', 1, 0, 'c', 1, 0]
+    """
+    trie = _build_move_trie(games)
+    flat = [len(trie)]
+    stack = [iter(trie.items())]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+        else:
+            move, (count, children) = entry
+            flat.extend((move, count, len(children)))
+            if children:
+                stack.append(iter(children.items()))
+    return flat
+
+
+def _merge_flat_move_trie(trie: dict[str, list], flat: list) -> None:
+    """
+    Merge the flattened trie <flat>, made by _build_flat_move_trie, into
+    <trie>, a trie of the form built by _build_move_trie. Counts of moves in
+    both are summed, and moves new to <trie> go after the ones it has.
+
+    >>> trie = _build_move_trie([['a', 'b']])
+    >>> _merge_flat_move_trie(trie, [2, 'c', 1, 0, 'a', 2, 1, 'b', 1, 0])
+    >>> trie
+    {'a': [2, {'b': [2, {}]}], 'c': [1, {}]}
+    """
+    values = iter(flat)
+    # the trie that the next entry goes in, and the number of entries left
+    # for it; the stack holds the same for the tries above it
+    children, left = trie, next(values)
+    stack = []
+    for move, count, num_children in zip(values, values, values):
+        while left == 0:
+            children, left = stack.pop()
+        left -= 1
+        node = children.get(move)
+        if node is None:
+            node = [count, {}]
+            children[intern(move)] = node
+        else:
+            node[0] += count
+        if num_children:
+            stack.append((children, left))
+            children, left = node[1], num_children
+
+
+def _nested_dict_entries(move_dict: dict[tuple[str, int], dict]) -> \
+        Iterable[tuple[str, int, dict]]:
+    """
+    Return the (move, count, children) entries of a nested dictionary made by
+    moves_to_nested_dict, in order.
+    """
+    return ((move, count, children)
+            for (move, count), children in move_dict.items())
+
+
+def _build_chess_subtrees(moves: dict,
+                          entries: Callable[[dict], Iterable[tuple[str, int,
+                                                                   dict]]],
+                          white_to_play: bool) -> list[TMTree]:
+    """
+    Return the subtrees of a ChessTree for the moves in <moves>, which is
+    either a move trie or a nested dictionary, with <entries> giving the
+    (move, count, children) entries of each level of it in order.
+
+    <white_to_play> is whether white plays next after each move in <moves>.
+    A move with no children is a TMTree leaf, and any other move is a
+    ChessTree. The trees are built bottom-up with an explicit stack, so that
+    long games do not reach the recursion limit, and each data_size is
+    computed once when its tree is built.
+    """
+    subtrees = []
+    # each frame is (remaining entries, subtrees built so far, white to play
+    # after these moves, the move and count of the tree being built)
+    stack = [(iter(entries(moves)), subtrees, white_to_play, None)]
+    while stack:
+        remaining, built, white, parent = stack[-1]
+        for move, count, children in remaining:
+            if children:
+                stack.append((iter(entries(children)), [], not white,
+                              (move, count)))
+                break
+            built.append(TMTree(move, [], count))
+        else:
+            stack.pop()
+            if parent is not None:
+                # the parent's move is in the frame below, with the other
+                # player to play after it
+                stack[-1][1].append(ChessTree._from_subtrees(
+                    parent[0], built, not white, parent[1]))
+    return subtrees
+
+
+class _Position:
+    """
+    A chess position in a transposition-aware chess tree, which is shared by
+    every order of moves that reaches it at the same ply.
+
+    === Attributes ===
+    games_ended: the number of games that ended in this position
+    moves: the moves played from this position, in the order in which they
+        were first played, each mapped to the position it leads to
+    data_size: games_ended plus the data_size of the position each move in
+        <moves> leads to, as in a ChessTree
+    """
+    __slots__ = ('games_ended', 'moves', 'data_size')
+
+    games_ended: int
+    moves: dict[str, _Position]
+    data_size: int
+
+    def __init__(self) -> None:
+        """Initialize a new position that no game has reached yet.
+        """
+        self.games_ended = 0
+        self.moves = {}
+        self.data_size = 0
+
 
-        return dict_of_moves
+def _build_position_graph(games: Iterable[list[str]]) -> _Position:
+    """
+    Return the starting position of the graph of the positions reached in
+    <games>, with each game's moves inserted once.
+
+    Positions are told apart by their ply and Zobrist hash, so the orders of
+    moves that transpose into the same position lead to the same _Position,
+    and the graph has no cycles. A game is only played on a board from the
+    first move that is new for its position, since the moves before it lead
+    to known positions.
+
+    Precondition:
+    every move in <games> is a legal uci formatted move
+
+    >>> start = _build_position_graph([['g1f3', 'g8f6', 'b1c3'],
+    ...                                ['b1c3', 'g8f6', 'g1f3']])
+    >>> list(start.moves)
+    ['g1f3', 'b1c3']
+    >>> a = start.moves['g1f3'].moves['g8f6'].moves['b1c3']
+    >>> a is start.moves['b1c3'].moves['g8f6'].moves['g1f3'], a.games_ended
+    (True, 2)
+    >>> start.data_size  # each game is counted after both orders of moves
+    4
+    """
+    import chess
+    import chess.polyglot
+    start = _Position()
+    positions = {}
+    # the positions at each ply, so that sizes can be found from the end
+    plies = [[start]]
+    for game in games:
+        board = chess.Board()
+        played = 0
+        position = start
+        for ply, move in enumerate(game, 1):
+            following = position.moves.get(move)
+            if following is None:
+                while played < ply:
+                    board.push(chess.Move.from_uci(game[played]))
+                    played += 1
+                key = (ply, chess.polyglot.zobrist_hash(board))
+                following = positions.get(key)
+                if following is None:
+                    following = _Position()
+                    positions[key] = following
+                    if ply == len(plies):
+                        plies.append([])
+                    plies[ply].append(following)
+                position.moves[intern(move)] = following
+            position = following
+        if game:
+            position.games_ended += 1
+
+    for ply in reversed(plies):
+        for position in ply:
+            position.data_size = position.games_ended + sum(
+                following.data_size for following in position.moves.values())
+    return start
+
+
+def iter_games(path: str) -> Iterator[list[str]]:
+    """
+    Yield the games in the file at <path> one at a time, without loading the
+    whole file.
+
+    The file either holds one JSON array of games, like the wgm_*.json files,
+    or is in JSON lines format, with one game (a JSON array of moves) on
+    each line. Blank lines are skipped. The format is told apart by the
+    first character after the opening '[': another '[' starts the first game
+    of an array of games. A ']' instead either closes an empty array of
+    games, if nothing but whitespace follows it, or ends an empty first game
+    in JSON lines format.
+
+    Each game is parsed as soon as it has been read, so only one game and
+    at most GAMES_CHUNK_SIZE characters of the file are held at a time.
+
+    Raise ValueError if the file does not start with '[', or if an array of
+    games is malformed, has a trailing comma or is followed by anything but
+    whitespace.
+    """
+    with open(path) as file:
+        buffer = file.read(GAMES_CHUNK_SIZE)
+        # read until the first two non-whitespace characters are known
+        while len(buffer.strip()) < 2:
+            chunk = file.read(GAMES_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+        start = _WHITESPACE.match(buffer).end()
+        if not buffer.startswith('[', start):
+            raise ValueError(f"{path} does not hold a JSON list of games")
+
+        second = _WHITESPACE.match(buffer, start + 1).end()
+        if buffer.startswith('[', second):
+            yield from _iter_json_array(file, buffer, start + 1)
+        elif buffer.startswith(']', second) \
+                and _at_end(file, buffer, second + 1):
+            return
+        else:
+            file.seek(0)
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _iter_json_array(file: TextIO, buffer: str,
+                     pos: int) -> Iterator[list[str]]:
+    """
+    Yield the values of the JSON array that continues from index <pos> of
+    <buffer>, just after its opening '[', and then from <file>, reading
+    GAMES_CHUNK_SIZE characters at a time.
+    """
+    decoder = json.JSONDecoder()
+    after_value = False
+    after_comma = False
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            buffer, pos = file.read(GAMES_CHUNK_SIZE), 0
+            if not buffer:
+                raise ValueError("the JSON array of games is not closed")
+        elif buffer[pos] == ']':
+            if after_comma:
+                raise ValueError("trailing ',' after the last game")
+            if not _at_end(file, buffer, pos + 1):
+                raise ValueError("unexpected data after the JSON array of "
+                                 "games")
+            return
+        elif after_value:
+            if buffer[pos] != ',':
+                raise ValueError(f"expected ',' between games, found "
+                                 f"{buffer[pos]!r}")
+            pos += 1
+            after_value = False
+            after_comma = True
+        else:
+            while True:
+                try:
+                    game, pos = decoder.raw_decode(buffer, pos)
+                    break
+                except json.JSONDecodeError:
+                    # the game may run past the end of the buffer
+                    chunk = file.read(GAMES_CHUNK_SIZE)
+                    if not chunk:
+                        raise
+                    buffer, pos = buffer[pos:] + chunk, 0
+            yield game
+            after_value = True
+            after_comma = False
+
+
+def _at_end(file: TextIO, buffer: str, pos: int) -> bool:
+    """
+    Return whether there is only whitespace from index <pos> of <buffer> to
+    the end of <file>, reading the rest of <file> GAMES_CHUNK_SIZE characters
+    at a time until something else is found.
+    """
+    while _WHITESPACE.match(buffer, pos).end() == len(buffer):
+        buffer, pos = file.read(GAMES_CHUNK_SIZE), 0
+        if not buffer:
+            return True
+    return False
+
+
+def _rect_contains(rect: tuple[int, int, int, int],
+                   pos: tuple[int, int]) -> bool:
+    """
+    Return whether the pygame rectangle <rect>, including its edges, contains
+    the position <pos>.
+
+    >>> _rect_contains((0, 0, 10, 20), (10, 20))
+    True
+    >>> _rect_contains((0, 0, 10, 20), (11, 0))
+    False
+    """
+    return rect[0] <= pos[0] <= rect[0] + rect[2] and \
+        rect[1] <= pos[1] <= rect[1] + rect[3]
+
+
+class _GridIndex:
+    """A uniform grid over a rectangular area, listing which of a sequence of
+    trees have a rect that overlaps each cell.
+
+    Used to find the displayed leaf of a tree at a position without looking
+    at every displayed leaf. When the displayed leaves inside one subtree
+    change, only the cells that they overlap are updated (see replace).
+
+    === Private Attributes ===
+    _area:
+        The pygame rectangle covered by the grid.
+    _columns, _rows:
+        The number of cells across and down the grid.
+    _cell_width, _cell_height:
+        The size of each cell.
+    _cells:
+        For each cell, in row-major order, the trees whose rect (including
+        its edges) overlaps the cell.
+    _count:
+        The number of indexed trees.
+
+    >>> trees = [TMTree('a', [], 1), TMTree('b', [], 1)]
+    >>> root = TMTree('root', trees)
+    >>> trees[0].rect = (0, 0, 50, 100)
+    >>> trees[1].rect = (50, 0, 50, 100)
+    >>> index = _GridIndex((0, 0, 100, 100), trees)
+    >>> index.find((50, 10)) is trees[0]
+    True
+    >>> index.find((51, 10)) is trees[1]
+    True
+    >>> index.find((101, 10)) is None
+    True
+    """
+    __slots__ = ('_area', '_columns', '_rows', '_cell_width', '_cell_height',
+                 '_cells', '_count')
+
+    _area: tuple[int, int, int, int]
+    _columns: int
+    _rows: int
+    _cell_width: int
+    _cell_height: int
+    _cells: list[list[TMTree]]
+    _count: int
+
+    def __init__(self, area: tuple[int, int, int, int],
+                 trees: list[TMTree]) -> None:
+        """Initialize a grid over <area> indexing the rects of <trees>, with
+        about four trees per cell.
+
+        Precondition:
+        every tree in <trees> has a rect
+        """
+        self._area = area
+        self._count = len(trees)
+        side = math.isqrt(len(trees) // 4) + 1
+        self._columns = max(1, min(side, area[2]))
+        self._rows = max(1, min(side, area[3]))
+        self._cell_width = max(1, math.ceil(area[2] / self._columns))
+        self._cell_height = max(1, math.ceil(area[3] / self._rows))
+        self._cells = [[] for _ in range(self._columns * self._rows)]
+        for cell, trees_in_cell in self._bucket(trees).items():
+            self._cells[cell] = trees_in_cell
+
+    def _bucket(self, trees: list[TMTree]) -> dict[int, list[TMTree]]:
+        """Return the trees of <trees> that overlap each cell, in their
+        original order, keyed by the cell's position in _cells.
+        """
+        buckets = {}
+        # _cell_of is inlined here, as this loop runs once per displayed leaf
+        left, top = self._area[0], self._area[1]
+        cell_width, cell_height = self._cell_width, self._cell_height
+        columns = self._columns
+        max_column, max_row = columns - 1, self._rows - 1
+        for tree in trees:
+            x, y, width, height = tree._rect
+            first_column = max((x - left) // cell_width, 0)
+            last_column = min((x + width - left) // cell_width, max_column)
+            first_row = max((y - top) // cell_height, 0)
+            last_row = min((y + height - top) // cell_height, max_row)
+            for row in range(first_row * columns, last_row * columns + 1,
+                             columns):
+                for cell in range(row + first_column, row + last_column + 1):
+                    if cell in buckets:
+                        buckets[cell].append(tree)
+                    else:
+                        buckets[cell] = [tree]
+        return buckets
+
+    def _cell_of(self, x: int, y: int) -> tuple[int, int]:
+        """Return the column and row of the cell containing (<x>, <y>),
+        clamped to the grid.
+        """
+        column = (x - self._area[0]) // self._cell_width
+        row = (y - self._area[1]) // self._cell_height
+        return (min(max(column, 0), self._columns - 1),
+                min(max(row, 0), self._rows - 1))
+
+    def replace(self, old: list[TMTree], new: list[TMTree]) -> bool:
+        """Replace the indexed trees <old> with <new>, updating only the cells
+        that they overlap. Return True on success, or False if the grid would
+        hold too many trees per cell, in which case it is left unchanged and
+        should be rebuilt.
+
+        Precondition:
+        every tree in <new> has a rect
+
+        >>> trees = [TMTree('a', [], 1), TMTree('b', [], 1)]
+        >>> trees[0].rect = (0, 0, 50, 100)
+        >>> trees[1].rect = (50, 0, 50, 100)
+        >>> index = _GridIndex((0, 0, 100, 100), trees)
+        >>> halves = [TMTree('c', [], 1), TMTree('d', [], 1)]
+        >>> halves[0].rect = (50, 0, 50, 50)
+        >>> halves[1].rect = (50, 50, 50, 50)
+        >>> index.replace([trees[1]], halves)
+        True
+        >>> index.find((60, 70)) is halves[1]
+        True
+        """
+        count = self._count - len(old) + len(new)
+        if count > 16 * len(self._cells):
+            return False
+        self._count = count
+        old_ids = {id(tree) for tree in old}
+        for cell in self._bucket(old):
+            self._cells[cell] = [tree for tree in self._cells[cell]
+                                 if id(tree) not in old_ids]
+        for cell, trees in self._bucket(new).items():
+            self._cells[cell].extend(trees)
+        return True
+
+    def find(self, pos: tuple[int, int]) -> Optional[TMTree]:
+        """Return the indexed tree whose rect contains <pos> that comes first
+        in the natural order, or None if there is no such tree.
+        """
+        if not _rect_contains(self._area, pos):
+            return None
+        column, row = self._cell_of(pos[0], pos[1])
+        found = None
+        for tree in self._cells[row * self._columns + column]:
+            if _rect_contains(tree._rect, pos) and (
+                    found is None or _comes_before(tree, found)):
+                found = tree
+        return found
+
+
+def _comes_before(first: TMTree, second: TMTree) -> bool:
+    """Return True iff <first> comes before <second> when traversing the tree
+    they are both part of in the natural order.
+
+    Precondition:
+    neither of <first> and <second> is an ancestor of the other
+
+    >>> trees = [TMTree('a', [], 1), TMTree('b', [], 1)]
+    >>> root = TMTree('root', [trees[0], TMTree('c', [trees[1]], 1)])
+    >>> _comes_before(trees[0], trees[1])
+    True
+    >>> _comes_before(trees[1], trees[0])
+    False
+    """
+    first_path = [first]
+    while first_path[-1]._parent_tree is not None:
+        first_path.append(first_path[-1]._parent_tree)
+    second_path = [second]
+    while second_path[-1]._parent_tree is not None:
+        second_path.append(second_path[-1]._parent_tree)
+    while first_path[-1] is second_path[-1]:
+        parent = first_path.pop()
+        second_path.pop()
+    for subtree in parent._subtrees:
+        if subtree is first_path[-1]:
+            return True
+        if subtree is second_path[-1]:
+            return False
+    return False
+
+
+class _TreeState:
+    """The state kept for a whole tree by its root, so that the other trees
+    in it do not each need room for it.
+
+    === Attributes ===
+    draw_list: the cached result of get_rectangles for the root, or None if
+        it has not been computed since the tree last changed
+    hit_index: the index used by get_tree_at_position to find displayed
+        leaves, or None if it has not been built since the tree last changed
+    layout_strategy: the function used to lay out the subtrees of every tree
+        in the tree
+    fen_cache: for a ChessTree, the FENs of the nodes of the tree most
+        recently asked for by position_fen, least recently used first, or
+        None if none have been
+    """
+    __slots__ = ('draw_list', 'hit_index', 'layout_strategy', 'fen_cache')
+
+    draw_list: Optional[list[tuple[tuple[int, int, int, int],
+                                   tuple[int, int, int]]]]
+    hit_index: Optional[_GridIndex]
+    layout_strategy: LayoutStrategy
+    fen_cache: Optional[OrderedDict[TMTree, str]]
+
+    def __init__(self) -> None:
+        """Initialize the state of a tree that has not been drawn yet and
+        uses slice_layout.
+        """
+        self.draw_list = None
+        self.hit_index = None
+        self.layout_strategy = slice_layout
+        self.fen_cache = None
 
 
 ########
@@ -255,8 +1355,6 @@ class TMTree:
     it should be subclassed to fit the needs of the
     specific data being visualized.
 
-    You may NOT add any attributes, public or private, to this class.
-
     You can freely add private methods as needed.
 
     === Public Attributes ===
@@ -264,7 +1362,8 @@ class TMTree:
         The pygame rectangle representing this node in the treemap
         visualization. A pygame rectangle is of the form:
         (x, y, width, height) where (x, y) is the upper, left corner of
-        the rectangle.
+        the rectangle. The rects of trees inside a collapsed tree are only
+        computed when they are first read or revealed.
     data_size:
         The size of the data represented by this tree.
 
@@ -280,6 +1379,24 @@ class TMTree:
         this tree as a subtree, or None if this tree is the root.
     _expanded:
         Whether this tree is considered expanded for visualization.
+    _tree_state:
+        The state of the whole tree that this tree is the root of, or None
+        if this tree is not a root or nothing has needed it yet.
+    _rect:
+        The value of rect, which may be out of date if an ancestor of this
+        tree is dirty.
+    _dirty:
+        True if the rects of this tree's descendants may be out of date,
+        because they have never been laid out, because this tree was
+        collapsed when it was last laid out, or because a data size or
+        subtree list below this tree has changed since then.
+    _path_prefix:
+        The path segments of this tree's ancestors, joined, which is the
+        start of get_path_string, or None if it has not been found since
+        this tree was last given a parent. A root's is ''.
+    _rect_epoch:
+        The value of TMTree._layout_epoch when _rect was last found to be up
+        to date, or -1 if it never has been.
 
     Note: this class does not support a representation for an empty tree,
     as we are only interested in visualizing non-empty trees.
@@ -301,16 +1418,45 @@ class TMTree:
       in _subtrees
     - if _subtrees is empty, then _expanded is False
 
+    - if _tree_state is not None, then _parent_tree is None
+    - if _tree_state.draw_list is not None, then it is what get_rectangles
+      would compute for the current tree
+    - if _tree_state.hit_index is not None, then it holds the current
+      displayed leaves of the tree and their rects
+    - if _dirty is False, then the rect of every subtree is what the treemap
+      algorithm gives it inside this tree's rect
+    - if a data size or subtree list below this tree has changed since it
+      was last laid out, then _dirty is True for this tree and every
+      ancestor of it
+    - if _path_prefix is not None, then it is '' if _parent_tree is None,
+      and otherwise it is _parent_tree._path_prefix (which is not None)
+      followed by _parent_tree._path_segment()
+    - if _rect_epoch == TMTree._layout_epoch, then _rect is up to date
+
     See method docstrings for sample usage.
     """
-
-    rect: Optional[tuple[int, int, int, int]]
+    # Instances have no __dict__, and state of the whole tree is only kept
+    # by its root (in _tree_state), so that large trees stay small in memory.
+    __slots__ = ('_rect', 'data_size', '_colour', '_name', '_subtrees',
+                 '_parent_tree', '_expanded', '_tree_state', '_dirty',
+                 '_path_prefix', '_rect_epoch')
+
+    # Increased whenever a tree is marked dirty, since the rects of the trees
+    # below it may then be out of date. A tree whose _rect_epoch is still
+    # equal to this needs no walk up to its root to read its rect.
+    _layout_epoch: ClassVar[int] = 0
+
+    _rect: Optional[tuple[int, int, int, int]]
     data_size: int
     _colour: tuple[int, int, int]
     _name: str
     _subtrees: list[TMTree]
     _parent_tree: Optional[TMTree]
     _expanded: bool
+    _tree_state: Optional[_TreeState]
+    _dirty: bool
+    _path_prefix: Optional[str]
+    _rect_epoch: int
 
     def __init__(self, name: str, subtrees: list[TMTree],
                  data_size: int = 1) -> None:
@@ -353,6 +1499,9 @@ class TMTree:
         for subtree in self._subtrees:
             subtree._parent_tree = self
             subtree_size += subtree.data_size
+            subtree._tree_state = None
+            if subtree._path_prefix is not None:
+                subtree._clear_path_prefixes()
         self.data_size = data_size + subtree_size
 
         if self._subtrees:
@@ -360,8 +1509,80 @@ class TMTree:
         else:
             self._expanded = False
 
-        self.rect = None
+        self._rect = None
         self._parent_tree = None
+        self._tree_state = None
+        self._dirty = True
+        TMTree._layout_epoch += 1
+        self._path_prefix = None
+        self._rect_epoch = -1
+
+    @property
+    def rect(self) -> Optional[tuple[int, int, int, int]]:
+        """
+        The rect of this tree, which is laid out first if this tree is inside
+        a collapsed tree whose descendants have not been laid out yet.
+
+        Once the rect of a tree is known to be up to date, so are those of
+        its ancestors, and they are read without walking up to the root again
+        until some tree is marked dirty.
+
+        >>> s1 = TMTree('C1', [], 5)
+        >>> s2 = TMTree('C2', [s1], 15)
+        >>> t3 = TMTree('C', [s2], 1)
+        >>> s2._expanded = False
+        >>> t3.update_rectangles((0, 0, 100, 200))
+        >>> s1._rect is None
+        True
+        >>> s1.rect
+        (0, 0, 100, 200)
+        """
+        epoch = TMTree._layout_epoch
+        if self._rect_epoch == epoch:
+            return self._rect
+        # the ancestors of a tree whose rect is up to date are all clean, so
+        # the walk can stop at the first one
+        path = [self]
+        top = None
+        tree = self._parent_tree
+        while tree is not None:
+            if tree._dirty:
+                top = tree
+            if tree._rect_epoch == epoch:
+                break
+            path.append(tree)
+            tree = tree._parent_tree
+        if top is not None and top._rect is not None:
+            self._parent_tree._lay_out_path(top)
+        epoch = TMTree._layout_epoch
+        for tree in path:
+            tree._rect_epoch = epoch
+        return self._rect
+
+    @rect.setter
+    def rect(self, rect: Optional[tuple[int, int, int, int]]) -> None:
+        self._rect = rect
+
+    def _lay_out_path(self, top: TMTree) -> None:
+        """
+        Lay out the subtrees of every tree on the path from <top> down to
+        this tree, leaving the other trees below that path dirty.
+
+        Preconditions:
+        top is self or an ancestor of self, and the rect of top is correct
+        """
+        path = [self]
+        while path[-1] is not top:
+            path.append(path[-1]._parent_tree)
+        layout = self._get_layout_strategy()
+        for tree in reversed(path):
+            sizes = [subtree.data_size for subtree in tree._subtrees]
+            for subtree, subtree_rect in zip(tree._subtrees,
+                                             layout(tree._rect, sizes)):
+                subtree._rect = subtree_rect
+                subtree._dirty = bool(subtree._subtrees)
+            tree._dirty = False
+        TMTree._layout_epoch += 1
 
     def is_displayed_tree_leaf(self) -> bool:
         """
@@ -397,19 +1618,64 @@ class TMTree:
         >>> d1.get_path_string()
         'C | C2 | C1(5) None'
         """
-        return self._get_path_string_helper()
+        return self._get_path_prefix() + self._path_tail()
 
-    def _get_path_string_helper(self, string: str = "") -> str:
+    def _get_path_prefix(self) -> str:
         """
-        Helper method for get_path_string that returns a mutation of <string>
+        Return the path segments of this tree's ancestors, joined.
+
+        The prefix of every tree on the way up to the nearest ancestor whose
+        prefix is already known is stored, so the first call takes time
+        linear in the depth of this tree, and later calls for it or anything
+        above it take constant time.
         """
-        if string == "":
-            string += f"{self._name}({self.data_size}) {self.rect}"
-        else:
-            string = f"{self._name}{self.get_separator()}" + string
-        if self._parent_tree is not None:
-            string = self._parent_tree._get_path_string_helper(string)
-        return string
+        if self._path_prefix is not None:
+            return self._path_prefix
+        path = []
+        tree = self
+        while tree._path_prefix is None and tree._parent_tree is not None:
+            path.append(tree)
+            tree = tree._parent_tree
+        if tree._path_prefix is None:  # the root
+            tree._path_prefix = ''
+        prefix = tree._path_prefix
+        for tree in reversed(path):
+            prefix += tree._parent_tree._path_segment()
+            tree._path_prefix = prefix
+        return prefix
+
+    def _clear_path_prefixes(self) -> None:
+        """
+        Forget the path prefix of this tree and every tree below it, for when
+        this tree is given a new parent.
+
+        A tree's prefix is only stored once its parent's is, so the trees
+        below one without a stored prefix are skipped.
+        """
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            tree._path_prefix = None
+            stack.extend(subtree for subtree in tree._subtrees
+                         if subtree._path_prefix is not None)
+
+    def _path_segment(self) -> str:
+        """
+        Return what this tree adds to the path string of each tree below it.
+
+        >>> TMTree('root', [])._path_segment()
+        'root | '
+        """
+        return f"{self._name}{self.get_separator()}"
+
+    def _path_tail(self) -> str:
+        """
+        Return what this tree adds to the end of its own path string.
+
+        >>> TMTree('root', [])._path_tail()
+        'root(1) None'
+        """
+        return f"{self._name}({self.data_size}) {self.rect}"
 
     # Note: you may encounter an "R0201 (no self use error)" pyTA error related
     # to this method (and PyCharm might show a warning as well), but it should
@@ -452,23 +1718,62 @@ class TMTree:
             C2 | (6) None
                 C1(5) None
         """
-        return self._str_helper().rstrip()  # rstrip removes the trailing '\n'
+        return '\n'.join(self._str_lines())
+
+    def write_tree(self, file: TextIO, max_depth: Optional[int] = None) -> None:
+        """
+        Write the string representation of the tree rooted at <self> (see
+        __str__) to <file> one line at a time, ending each line with a
+        newline. If <max_depth> is given, only the trees at most <max_depth>
+        levels below this tree are written.
 
-    def _str_helper(self, indent: int = 0) -> str:
+        >>> import io
+        >>> d1 = TMTree('C1', [], 5)
+        >>> d3 = TMTree('C', [TMTree('C2', [d1], 1)], 1)
+        >>> out = io.StringIO()
+        >>> d3.write_tree(out, 1)
+        >>> out.getvalue()
+        'C | (7) None\\n    C2 | (6) None\\n'
         """
-        Recursive helper for __str__
-        <indent> specifies the indentation level.
+        file.writelines(line + '\n' for line in self._str_lines(max_depth))
 
-        Refer to __str__ for sample usage.
+    def _str_lines(self, max_depth: Optional[int] = None) -> Iterator[str]:
+        """
+        Yield the lines of the string representation of the tree rooted at
+        <self>, to at most <max_depth> levels below it (or all of them if
+        <max_depth> is None).
+
+        The trees are walked in preorder with an explicit stack, so this
+        takes time linear in the size of the output, and deep trees cannot
+        reach the recursion limit. The subtrees of each tree are laid out
+        when it is reached if their rects are out of date, so that no rect
+        is found by walking up to the root.
+        """
+        if self.rect is not None and self._dirty:
+            self._lay_out_path(self)
+        stack = [(self, 0)]
+        while stack:
+            tree, depth = stack.pop()
+            yield self._str_line(tree, depth)
+            if tree._subtrees and (max_depth is None or depth < max_depth):
+                if tree._dirty and tree._rect is not None:
+                    tree._lay_out_path(tree)
+                stack.extend((subtree, depth + 1)
+                             for subtree in reversed(tree._subtrees))
+
+    def _str_line(self, tree: TMTree, depth: int) -> str:
+        """
+        Return the line for <tree>, which is <depth> levels below this tree,
+        in the string representation of this tree.
+
+        Precondition:
+        the rect of <tree> is up to date
         """
         tab = "    "  # four spaces
-        rslt = f"{indent * tab}{self._name}"
-        if self._subtrees:
-            rslt += self.get_separator()
-        rslt += f"({self.data_size}) {self.rect}\n"
-        for subtree in self._subtrees:
-            rslt += subtree._str_helper(indent + 1)
-        return rslt
+        line = f"{depth * tab}{tree._name}"
+        if tree._subtrees:
+            line += tree.get_separator()
+        return f"{line}({tree.data_size}) {tree._rect}"
 
     def update_rectangles(self, rect: tuple[int, int, int, int]) -> None:
         """
@@ -479,6 +1784,14 @@ class TMTree:
               as get_rectangles will take care of only returning the rectangles
               that correspond to leaves in the displayed-tree.
 
+        The subtrees of each tree are placed by the layout strategy of the
+        tree (see set_layout_strategy). Only the displayed-tree is laid out
+        here. The subtrees of a collapsed
+        tree are laid out when expand or expand_all reveals them, or when
+        their rect is read.
+
+        This discards the cached result of get_rectangles for the whole tree.
+
         >>> t1 = TMTree('B', [], 5)
         >>> t2 = TMTree('A', [t1], 1)
         >>> t2.update_rectangles((0, 0, 100, 200))
@@ -497,29 +1810,120 @@ class TMTree:
         >>> t3.rect
         (0, 0, 100, 200)
         """
-        self.rect = rect
-        subtrees = self._subtrees
-        if subtrees:
-            count = 0
-            for subtree in subtrees:
-                count += subtree.data_size
-            coord1 = rect[0]
-            coord2 = rect[1]
-            sizex = rect[2]
-            sizey = rect[3]
-            if sizex > sizey:
-                for subtree in subtrees:
-                    subtree.update_rectangles(tuple([coord1, coord2, math.floor(
-                        sizex * subtree.data_size / count), sizey]))
-                    coord1 += math.floor(sizex * subtree.data_size / count)
+        self._invalidate_display()
+        self._layout(rect, False)
+
+    def _layout(self, rect: tuple[int, int, int, int],
+                incremental: bool) -> None:
+        """
+        Apply the treemap algorithm to this tree and its expanded descendants
+        to fill <rect>. A collapsed tree gets its own rect, but its subtrees
+        are not laid out, and it is left dirty until it is expanded.
+
+        If <incremental> is True, skip every subtree that is clean and whose
+        rect does not change, since the rects below it are already correct.
+        """
+        layout = self._get_layout_strategy()
+        stack = [(self, rect)]
+        while stack:
+            tree, tree_rect = stack.pop()
+            if incremental and not tree._dirty and tree._rect == tree_rect:
+                continue
+            tree._rect = tree_rect
+            subtrees = tree._subtrees
+            if tree._expanded:
+                tree._dirty = False
+                sizes = [subtree.data_size for subtree in subtrees]
+                stack.extend(zip(subtrees, layout(tree_rect, sizes)))
+            elif subtrees:
+                tree._dirty = True
+                TMTree._layout_epoch += 1
             else:
-                for subtree in subtrees:
-                    subtree.update_rectangles(tuple([coord1, coord2, sizex,
-                                                    math.floor(sizey
-                                                               * subtree.
-                                                               data_size
-                                                               / count)]))
-                    coord2 += math.floor(sizey * subtree.data_size / count)
+                tree._dirty = False
+
+    def _lay_out_if_dirty(self) -> None:
+        """
+        Lay out the displayed subtrees of this tree if it was collapsed when
+        it was last laid out.
+
+        Precondition:
+        self is part of the displayed-tree
+        """
+        if self._dirty and self._rect is not None:
+            self._layout(self._rect, False)
+
+    def set_layout_strategy(self, strategy: LayoutStrategy) -> None:
+        """
+        Use <strategy> to lay out the tree that self is part of from now on,
+        and lay it out again if it has been laid out before.
+
+        The default strategy is slice_layout.
+
+        >>> s1 = TMTree('C1', [], 1)
+        >>> s2 = TMTree('C2', [], 3)
+        >>> t3 = TMTree('C', [s1, s2], 0)
+        >>> t3.update_rectangles((0, 0, 40, 30))
+        >>> s2.rect
+        (10, 0, 30, 30)
+        >>> s1.set_layout_strategy(squarified_layout)
+        >>> s2.rect
+        (0, 0, 30, 30)
+        """
+        root = self._get_root()
+        root._get_tree_state().layout_strategy = strategy
+        if root._rect is not None:
+            root.update_rectangles(root._rect)
+
+    def _get_layout_strategy(self) -> LayoutStrategy:
+        """
+        Return the layout strategy of the tree that self is part of.
+        """
+        state = self._get_root()._tree_state
+        return slice_layout if state is None else state.layout_strategy
+
+    def _get_root(self) -> TMTree:
+        """
+        Return the root of the tree that self is part of.
+        """
+        root = self
+        while root._parent_tree is not None:
+            root = root._parent_tree
+        return root
+
+    def _get_tree_state(self) -> _TreeState:
+        """
+        Return the state of the tree that self is the root of, creating it
+        if nothing has needed it yet.
+
+        Precondition:
+        self is the root of its tree
+        """
+        if self._tree_state is None:
+            self._tree_state = _TreeState()
+        return self._tree_state
+
+    def _mark_dirty(self) -> None:
+        """
+        Mark this tree and all of its ancestors as dirty, because the data
+        size of this tree or the list of its subtrees has changed.
+        """
+        TMTree._layout_epoch += 1
+        tree = self
+        while tree is not None:
+            tree._dirty = True
+            tree = tree._parent_tree
+
+    def _relayout(self) -> None:
+        """
+        Reapply the treemap algorithm to this tree in its current rect, only
+        recomputing the dirty subtrees and the subtrees whose rect changes.
+
+        Precondition:
+        self is the root of its tree
+        """
+        if self._rect is not None:
+            self._invalidate_display()
+            self._layout(self._rect, True)
 
     def get_rectangles(self) -> list[tuple[tuple[int, int, int, int],
                                            tuple[int, int, int]]]:
@@ -528,6 +1932,10 @@ class TMTree:
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
 
+        For the root of a tree, the list is computed once and then reused
+        until the tree changes (see _invalidate_display), so callers must not
+        mutate it.
+
         >>> t1 = TMTree('B', [], 5)
         >>> t2 = TMTree('A', [t1], 1)
         >>> t2.update_rectangles((0, 0, 100, 200))
@@ -543,16 +1951,83 @@ class TMTree:
         >>> rectangles[1][0]
         (0, 50, 100, 150)
         """
-        leaf_lst = []
-        if self.rect is not None:
-            if not self._expanded:
-                t = (self.rect, self._colour)
-                leaf_lst.append(t)
+        if self._parent_tree is not None:
+            return self._build_draw_list()
+        state = self._get_tree_state()
+        if state.draw_list is None:
+            state.draw_list = self._build_draw_list()
+        return state.draw_list
+
+    def _build_draw_list(self) -> list[tuple[tuple[int, int, int, int],
+                                             tuple[int, int, int]]]:
+        """
+        Return a new list with the result of get_rectangles for this tree,
+        computed in a single pass over the displayed-tree.
+        """
+        return [(leaf._rect, leaf._colour)
+                for leaf in self._displayed_leaves()]
+
+    def _displayed_leaves(self) -> list[TMTree]:
+        """
+        Return the leaves of the displayed-tree rooted at this tree that have
+        a rect, in the natural order, using a single pass over the
+        displayed-tree.
+        """
+        leaves = []
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._rect is None:
+                continue
+            if tree._expanded:
+                tree._lay_out_if_dirty()
+                stack.extend(reversed(tree._subtrees))
             else:
-                for subtree in self._subtrees:
-                    if subtree.get_rectangles():
-                        leaf_lst.extend(subtree.get_rectangles())
-        return leaf_lst
+                leaves.append(tree)
+        return leaves
+
+    def _invalidate_display(self) -> None:
+        """
+        Discard the cached result of get_rectangles and the hit testing index
+        for the tree that self is a part of. Call this whenever a rect or
+        _expanded attribute in the tree changes.
+        """
+        state = self._get_root()._tree_state
+        if state is not None:
+            state.draw_list = None
+            state.hit_index = None
+
+    def _indexed_leaves(self) -> Optional[list[TMTree]]:
+        """
+        Return the leaves of the displayed-tree rooted at this tree if the
+        tree that self is part of has a hit testing index, or None if it does
+        not. Pass the result to _update_display once they have changed.
+        """
+        state = self._get_root()._tree_state
+        if state is None or state.hit_index is None:
+            return None
+        return self._displayed_leaves()
+
+    def _update_display(self, old_leaves: Optional[list[TMTree]]) -> None:
+        """
+        Discard the cached result of get_rectangles for the tree that self is
+        a part of, and update its hit testing index for the leaves of the
+        displayed-tree rooted at this tree having changed from <old_leaves>,
+        which _indexed_leaves returned before the change. Only the grid cells
+        that these leaves overlap are updated.
+
+        Precondition:
+        no rect outside this tree has changed since _indexed_leaves was called
+        """
+        state = self._get_root()._tree_state
+        if state is None:
+            return
+        state.draw_list = None
+        if state.hit_index is not None and (
+                old_leaves is None
+                or not state.hit_index.replace(old_leaves,
+                                               self._displayed_leaves())):
+            state.hit_index = None
 
     def get_tree_at_position(self, pos: tuple[int, int]) -> Optional[TMTree]:
         """
@@ -564,6 +2039,11 @@ class TMTree:
         tree represented by the rectangle that is first encountered when
         traversing the TMTree in the natural order.
 
+        For the root of a tree, this uses a grid index over the rectangles of
+        the leaves of the displayed-tree, which is built on the first call
+        and reused until the tree changes (see _invalidate_display), so each
+        lookup only checks the few leaves that overlap one grid cell.
+
         Preconditions:
         update_rectangles has previously been called on the root of the tree
         that self is part of.
@@ -588,19 +2068,28 @@ class TMTree:
         >>> t3.get_tree_at_position((100, 100)) is s2
         True
         """
-        if pos[0] < self.rect[0] or pos[1] < self.rect[1] \
-                or pos[0] > self.rect[0] + self.rect[2] \
-                or pos[1] > self.rect[1] + self.rect[3]:
+        if not _rect_contains(self.rect, pos):
             return None
-        else:
-            if self._subtrees:
-                for subtree in self._subtrees:
-                    position = subtree.get_tree_at_position(pos)
-                    if position is not None \
-                            and position.is_displayed_tree_leaf():
-                        return position
-
+        if self._parent_tree is None:
+            state = self._get_tree_state()
+            if state.hit_index is None:
+                state.hit_index = _GridIndex(self.rect,
+                                             self._displayed_leaves())
+            leaf = state.hit_index.find(pos)
+            return self if leaf is None else leaf
+
+        if not self._expanded:
             return self
+        self._lay_out_if_dirty()
+        stack = list(reversed(self._subtrees))
+        while stack:
+            tree = stack.pop()
+            if tree._rect is not None and _rect_contains(tree._rect, pos):
+                if not tree._expanded:
+                    return tree
+                tree._lay_out_if_dirty()
+                stack.extend(reversed(tree._subtrees))
+        return self
 
     def expand(self) -> TMTree:
         """
@@ -609,6 +2098,9 @@ class TMTree:
         But if this tree has no subtrees, do nothing (since a leaf can't
         be expanded), and return self.
 
+        If this tree was collapsed when it was last laid out, its subtrees
+        are laid out now.
+
         Precondition:
         self is part of the displayed-tree
 
@@ -627,7 +2119,12 @@ class TMTree:
         True
         """
         if self._subtrees:
-            self._expanded = True
+            if not self._expanded:
+                old_leaves = self._indexed_leaves()
+                self._expanded = True
+                if self.rect is not None:
+                    self._lay_out_if_dirty()
+                self._update_display(old_leaves)
             return self._subtrees[0]
         else:
             return self
@@ -642,6 +2139,9 @@ class TMTree:
 
         If self has no subtrees, return self.
 
+        The subtrees of self are laid out again, since any of them may have
+        been collapsed when they were last laid out.
+
         Precondition:
         self is a part of the displayed-tree
 
@@ -664,12 +2164,25 @@ class TMTree:
         >>> d2.is_displayed_tree_leaf()
         False
         """
-        self.expand()
+        old_leaves = self._indexed_leaves()
+        last = self._expand_all()
+        if self.rect is not None:
+            self._layout(self._rect, False)
+        self._update_display(old_leaves)
+        return last
+
+    def _expand_all(self) -> TMTree:
+        """
+        Helper for expand_all that does everything except discarding the
+        cached rectangles.
+        """
+        if self._subtrees:
+            self._expanded = True
         last = self
 
         if self._subtrees:
             for subtree in self._subtrees:
-                last = subtree.expand_all()
+                last = subtree._expand_all()
 
         last._expanded = False
         return last
@@ -702,16 +2215,27 @@ class TMTree:
         True
         """
         if self._parent_tree is not None:
-            self._parent_tree._expanded = False
-            for subtree in self._parent_tree._subtrees:
-                if subtree._subtrees:
-                    for subtree1 in subtree._subtrees:
-                        subtree1.collapse()
-
+            old_leaves = self._parent_tree._indexed_leaves()
+            self._collapse()
+            self._parent_tree._update_display(old_leaves)
             return self._parent_tree
 
         return self
 
+    def _collapse(self) -> None:
+        """
+        Helper for collapse that does everything except discarding the
+        cached rectangles.
+
+        Precondition:
+        self is not the root of its tree
+        """
+        self._parent_tree._expanded = False
+        for subtree in self._parent_tree._subtrees:
+            if subtree._subtrees:
+                for subtree1 in subtree._subtrees:
+                    subtree1._collapse()
+
     def collapse_all(self) -> TMTree:
         """
         Collapse the entire displayed-tree to a single node (the root).
@@ -756,7 +2280,8 @@ class TMTree:
         2. Reapply the treemap algorithm to the root of the tree that self is
         a part of to update the rect attributes to reflect the new tree
         structure. Use the root's current rect attribute as the
-        starting rectangle for the treemap algorithm.
+        starting rectangle for the treemap algorithm. Only the subtrees that
+        were marked dirty, or whose rect changes, are laid out again.
 
         3. Expand self's new parent so that self remains a leaf in the
         displayed-tree (self's new parent will no longer be a leaf in the
@@ -801,6 +2326,7 @@ class TMTree:
         True
         """
         displaced_tree = self
+        self._parent_tree._mark_dirty()
         if len(self._parent_tree._subtrees) > 1:
             self._parent_tree._expanded = True
         else:
@@ -810,18 +2336,29 @@ class TMTree:
         while parent_tree._parent_tree is not None:
             parent_tree.data_size -= displaced_tree.data_size
             parent_tree = parent_tree._parent_tree
+        parent_tree._forget_moved(displaced_tree)
 
         self._parent_tree._subtrees.remove(self)
         destination._subtrees.append(displaced_tree)
         displaced_tree._parent_tree = destination
+        displaced_tree._clear_path_prefixes()
         destination._expanded = True
+        destination._mark_dirty()
 
         parent_tree = destination
         while parent_tree._parent_tree is not None:
             parent_tree.data_size += displaced_tree.data_size
             parent_tree = parent_tree._parent_tree
 
-        parent_tree.update_rectangles(parent_tree.rect)
+        parent_tree._relayout()
+
+    def _forget_moved(self, moved: TMTree) -> None:
+        """
+        Forget anything this root has cached about <moved> and the trees
+        below it, for when <moved> is about to be given a new parent.
+
+        A TMTree caches nothing by root, so this does nothing.
+        """
 
     def change_size(self, factor: float) -> None:
         """
@@ -854,7 +2391,8 @@ class TMTree:
         2. Reapply the treemap algorithm to the root of the tree that self is
         a part of to update the rect attributes to reflect the updated
         data_size attributes. Use the root's current rect attribute as the
-        starting rectangle for the treemap algorithm.
+        starting rectangle for the treemap algorithm. Only the subtrees that
+        were marked dirty, or whose rect changes, are laid out again.
 
         Precondition:
         <factor> != 0
@@ -888,13 +2426,14 @@ class TMTree:
             self.data_size = data_size_sum
         if self.data_size < 1:
             self.data_size = 1
+        self._mark_dirty()
 
         parent_tree = self
         while parent_tree._parent_tree is not None:
             parent_tree = parent_tree._parent_tree
             parent_tree.data_size += change
 
-        parent_tree.update_rectangles(parent_tree.rect)
+        parent_tree._relayout()
 
 
 ######################
@@ -923,6 +2462,8 @@ class FileTree(TMTree):
          dir_tree_from_nested_tuple, so please make sure to implement
          that function correctly.
     """
+    __slots__ = ()
+
     # Hint: you should only have to write a fairly small amount of code here.
     def move(self, destination: TMTree) -> None:
         if isinstance(destination, FileTree):
@@ -930,17 +2471,17 @@ class FileTree(TMTree):
         else:
             TMTree.move(self, destination)
 
-    def _get_path_string_helper(self, string: str = "") -> str:
+    def _path_segment(self) -> str:
         """
-        Helper method for get_path_string that returns a mutation of <string>
+        Return what this tree adds to the path string of each tree below it.
         """
-        if string == "":
-            string += f"{self._name} (file)"
-        else:
-            string = f"{self._name}{os.path.sep}" + string
-        if self._parent_tree is not None:
-            string = self._parent_tree._get_path_string_helper(string)
-        return string
+        return f"{self._name}{os.path.sep}"
+
+    def _path_tail(self) -> str:
+        """
+        Return what this tree adds to the end of its own path string.
+        """
+        return f"{self._name} (file)"
 
 
 class DirectoryTree(TMTree):
@@ -1023,21 +2564,23 @@ class DirectoryTree(TMTree):
     >>> path_string == './empty_dir/data.xlsx (file)'.replace("/", os.path.sep)
     True
     """
+    __slots__ = ()
+
     # Hint: you should only have to write a fairly small amount of code here.
-    def __str__(self, string: str = "", indent: int = 1) -> str:
+    def _str_line(self, tree: TMTree, depth: int) -> str:
+        """
+        Return the line for <tree>, which is <depth> levels below this tree,
+        in the string representation of this tree. Directories with
+        contents below this one end in a path separator.
+        """
+        if depth == 0:
+            return f"{tree._name}/({tree.data_size}) {tree._rect}"
         tab = "    "
-        if string == "":
-            string = f"{self._name}/({self.data_size}) {self.rect}"
-        for subtree in self._subtrees:
-            slash = ''
-            if isinstance(subtree, DirectoryTree) and subtree._subtrees:
-                slash = os.path.sep
-            string += f"\n{indent * tab}{subtree._name}{slash}" \
-                      f"({subtree.data_size}) {subtree.rect}"
-            if subtree._subtrees:
-                string = DirectoryTree.__str__(subtree, string,
-                                               indent + 1)
-        return string
+        slash = ''
+        if isinstance(tree, DirectoryTree) and tree._subtrees:
+            slash = os.path.sep
+        return f"{depth * tab}{tree._name}{slash}({tree.data_size}) " \
+               f"{tree._rect}"
 
     def change_size(self, factor: float) -> None:
         raise OperationNotSupportedError
@@ -1048,17 +2591,17 @@ class DirectoryTree(TMTree):
         else:
             TMTree.move(self, destination)
 
-    def _get_path_string_helper(self, string: str = "") -> str:
+    def _path_segment(self) -> str:
         """
-        Helper method for get_path_string that returns a mutation of <string>
+        Return what this tree adds to the path string of each tree below it.
         """
-        if string == "":
-            string += f"{self._name} (directory)"
-        else:
-            string = f"{self._name}{os.path.sep}" + string
-        if self._parent_tree is not None:
-            string = self._parent_tree._get_path_string_helper(string)
-        return string
+        return f"{self._name}{os.path.sep}"
+
+    def _path_tail(self) -> str:
+        """
+        Return what this tree adds to the end of its own path string.
+        """
+        return f"{self._name} (directory)"
 
 
 class ChessTree(TMTree):
@@ -1067,6 +2610,11 @@ class ChessTree(TMTree):
     """
     # === Private Attributes ===
     # _white_to_play: True iff it is white's turn to make the next move.
+    #
+    # === Representation Invariants ===
+    # every node in _tree_state.fen_cache is in this tree and maps to the
+    #   FEN of its current position.
+    __slots__ = ('_white_to_play',)
 
     _white_to_play: bool
 
@@ -1108,15 +2656,124 @@ class ChessTree(TMTree):
                 e7e5(1) None
         """
         self._white_to_play = white_to_play
-        subtrees = []
-        for key, value in move_dict.items():
-            if value == {}:
-                subtrees.append(TMTree(key[0], [], key[1]))
-            else:
-                child_tree = ChessTree(value, key[0], not white_to_play, key[1])
-                subtrees.append(child_tree)
+        subtrees = _build_chess_subtrees(move_dict, _nested_dict_entries,
+                                         not white_to_play)
         TMTree.__init__(self, last_move, subtrees, num_games_ended)
 
+    @classmethod
+    def from_games(cls, games: Iterable[list[str]],
+                   transpositions: bool = False,
+                   max_depth: Optional[int] = None,
+                   min_games: int = 1) -> ChessTree:
+        """
+        Return the ChessTree for <games>, which is the same as
+        ChessTree(moves_to_nested_dict(list(<games>))).
+
+        Each game is inserted once into a move trie, and the tree is built
+        from the trie without recursion, freeing the trie as it goes. So no
+        nested dictionary is made, and the games can be read one at a time
+        from any iterable.
+
+        If <max_depth> or <min_games> is given, moves are pruned as for
+        moves_to_nested_dict, and the moves pruned after each ChessTree are
+        replaced by one PRUNED_MOVES leaf of the same total size.
+
+        If <transpositions> is True, the games are instead merged by position
+        into a graph, and a ChessPositionView of its starting position is
+        returned. See ChessPositionView. Moves cannot be pruned from it.
+
+        Raise ValueError if <transpositions> is True and <max_depth> or
+        <min_games> is given.
+
+        >>> ct = ChessTree.from_games(iter([['e2e4', 'e7e5'], ['e2e4']]))
+        >>> print(ct)
+        - | (2) None
+            e2e4 | (2) None
+                e7e5(1) None
+        """
+        if transpositions:
+            if max_depth is not None or min_games > 1:
+                raise ValueError("moves cannot be pruned from a "
+                                 "transposition-aware chess tree")
+            return ChessPositionView(_build_position_graph(games))
+        trie = _build_move_trie(games)
+        _prune_move_trie(trie, max_depth, min_games)
+        subtrees = _build_chess_subtrees(trie, _consume_trie_entries, False)
+        return cls._from_subtrees('-', subtrees, True, 0)
+
+    @classmethod
+    def from_games_parallel(cls, games: Iterable[list[str]],
+                            max_workers: Optional[int] = None,
+                            shard_size: int = GAMES_PER_SHARD,
+                            max_depth: Optional[int] = None,
+                            min_games: int = 1) -> ChessTree:
+        """
+        Return the ChessTree for <games>, the same as from_games(<games>),
+        building parts of it on a pool of <max_workers> processes.
+
+        <games> is split into shards of <shard_size> games, and each process
+        builds the move trie of a shard. The tries are merged in shard order,
+        summing the number of games that end after each move, so moves stay
+        in the order in which they first occur. The tree, and so the sizes of
+        its subtrees, is then built once from the merged trie. At most two
+        shards per process are in flight at a time, so <games> can be read
+        one at a time from any iterable.
+
+        If <max_workers> is None, the ProcessPoolExecutor default is used; if
+        it is 1, this is the same as from_games(<games>). <max_depth> and
+        <min_games> are as for from_games, and are applied to the merged trie.
+        """
+        if max_workers == 1:
+            return cls.from_games(games, max_depth=max_depth,
+                                  min_games=min_games)
+
+        trie = {}
+        games = iter(games)
+        with ProcessPoolExecutor(max_workers) as executor:
+            max_pending = 2 * (max_workers or os.cpu_count() or 1)
+            pending = deque()
+            shard = list(islice(games, shard_size))
+            while shard:
+                pending.append(executor.submit(_build_flat_move_trie, shard))
+                if len(pending) >= max_pending:
+                    _merge_flat_move_trie(trie, pending.popleft().result())
+                shard = list(islice(games, shard_size))
+            while pending:
+                _merge_flat_move_trie(trie, pending.popleft().result())
+
+        _prune_move_trie(trie, max_depth, min_games)
+        subtrees = _build_chess_subtrees(trie, _consume_trie_entries, False)
+        return cls._from_subtrees('-', subtrees, True, 0)
+
+    @classmethod
+    def from_json_file(cls, path: str, transpositions: bool = False,
+                       max_depth: Optional[int] = None,
+                       min_games: int = 1) -> ChessTree:
+        """
+        Return the ChessTree for the games in the JSON file at <path>, which
+        holds either a list of games in the format used by
+        moves_to_nested_dict, or one game per line (JSON lines).
+        <transpositions>, <max_depth> and <min_games> are as for from_games.
+
+        The games are read one at a time with iter_games, so the whole file
+        is never held in memory.
+        """
+        return cls.from_games(iter_games(path), transpositions, max_depth,
+                              min_games)
+
+    @classmethod
+    def _from_subtrees(cls, last_move: str, subtrees: list[TMTree],
+                       white_to_play: bool,
+                       num_games_ended: int) -> ChessTree:
+        """
+        Return a new ChessTree with the given <subtrees>, which are already
+        built. The other parameters are as for __init__.
+        """
+        tree = cls.__new__(cls)
+        tree._white_to_play = white_to_play
+        TMTree.__init__(tree, last_move, subtrees, num_games_ended)
+        return tree
+
     def get_suffix(self) -> str:
         """
         Return ' (white to play)' if white is next to move,
@@ -1140,6 +2797,113 @@ class ChessTree(TMTree):
         else:
             return ' (black to play)'
 
+    def get_fen(self) -> str:
+        """
+        Return the FEN of the board position after the moves that lead to
+        this ChessTree. See position_fen.
+
+        >>> ct = ChessTree({('e2e4', 0): {('e7e5', 1): {}}})
+        >>> ct.get_fen()
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+        >>> ct._subtrees[0].get_fen()
+        'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+        """
+        return position_fen(self)
+
+    def _forget_moved(self, moved: TMTree) -> None:
+        """
+        Forget the FENs of <moved> and the trees below it, for when <moved>
+        is about to be given a new parent.
+
+        Only the nodes in the cache are checked, so this takes time in the
+        size of the cache, not of <moved>.
+        """
+        if self._tree_state is None or not self._tree_state.fen_cache:
+            return
+        cache = self._tree_state.fen_cache
+        inside = {moved}
+        outside = {self}
+        for cached in list(cache):
+            path = []
+            node = cached
+            while node not in inside and node not in outside:
+                path.append(node)
+                node = node._parent_tree
+            if node in inside:
+                inside.update(path)
+                del cache[cached]
+            else:
+                outside.update(path)
+
+    def export_positions(self, file: TextIO,
+                         file_format: str = 'csv') -> int:
+        """
+        Write a record for this ChessTree and every tree below it, in
+        preorder, to <file>, and return the number of records written.
+
+        Each record has the moves from the root to the tree, the FEN of the
+        position after them, its lichess url and the tree's data_size. With
+        the 'csv' <file_format>, the moves are separated by spaces, below a
+        header row. With 'jsonl', each record is a JSON object on its own
+        line, with the moves as a list.
+
+        The tree is walked once with an explicit stack, playing each move on
+        a single board when going down and taking it back when going up.
+        PRUNED_MOVES leaves are not positions, so they are skipped.
+
+        Raise ValueError if <file_format> is not 'csv' or 'jsonl'.
+
+        >>> import io
+        >>> ct = ChessTree({('e2e4', 0): {('e7e5', 1): {}}})
+        >>> out = io.StringIO()
+        >>> ct._subtrees[0].export_positions(out, 'jsonl')
+        2
+        >>> print(out.getvalue().splitlines()[1][:50])
+        {"moves": ["e2e4", "e7e5"], "fen": "rnbqkbnr/pppp1
+        """
+        import chess
+        if file_format == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(['moves', 'fen', 'url', 'data_size'])
+
+            def write(tree: TMTree) -> None:
+                fen = board.fen()
+                writer.writerow([' '.join(moves), fen, url_from_fen(fen),
+                                 tree.data_size])
+        elif file_format == 'jsonl':
+            def write(tree: TMTree) -> None:
+                fen = board.fen()
+                file.write(json.dumps({'moves': moves, 'fen': fen,
+                                       'url': url_from_fen(fen),
+                                       'data_size': tree.data_size}) + '\n')
+        else:
+            raise ValueError(f"unknown file format {file_format!r}")
+
+        moves = []
+        tree = self
+        while tree._parent_tree is not None:
+            moves.append(tree._name)
+            tree = tree._parent_tree
+        moves.reverse()
+        board = chess.Board(self.get_fen())
+        write(self)
+        count = 1
+        stack = [iter(self._subtrees)]
+        while stack:
+            tree = next(stack[-1], None)
+            if tree is None:
+                stack.pop()
+                if stack:  # go back up from a tree whose move was played
+                    board.pop()
+                    moves.pop()
+            elif tree._name != PRUNED_MOVES:
+                board.push(chess.Move.from_uci(tree._name))
+                moves.append(tree._name)
+                write(tree)
+                count += 1
+                stack.append(iter(tree._subtrees))
+        return count
+
     def open_page(self) -> None:
         """
         Provided code.
@@ -1153,15 +2917,88 @@ class ChessTree(TMTree):
         # >>> ct = ChessTree({('e2e4', 1): {}})
         # >>> ct.open_page()  # will open an analysis board with no moves made
         """
-        path = self.get_path_string()
-        path = path.split(self.get_separator())[1:]  # drop the leading '- | '
-        if not path:  # no moves made!
-            moves = []
-        else:
-            path[-1] = path[-1].split(" ")[0]  # truncate the suffix
-            moves = path  # renaming for clarity of interpretation
+        moves = []
+        tree = self
+        while tree._parent_tree is not None:  # the root has no move
+            moves.append(tree._name)
+            tree = tree._parent_tree
+        moves.reverse()
         print(f'Opening game after moves: {"-".join(moves)}')
-        webbrowser.open(url_from_moves(moves))
+        webbrowser.open(url_from_fen(self.get_fen()))
+
+
+class ChessPositionView(ChessTree):
+    """
+    A ChessTree that shows a position in a transposition-aware chess tree.
+
+    Positions that are reached by different orders of moves are stored once,
+    with one subtree of moves after them, and every path to a position gets
+    its own view of it. A view's subtrees are only made when they are first
+    used, as views for the moves after its position that lead to further
+    moves, and TMTree leaves for the others, like in a ChessTree. So only the
+    part of the tree that is displayed or walked is ever made.
+
+    A view's data_size is the data_size of its position, which counts the
+    games through the position by every order of moves. So a game that
+    transposes is counted under each path to the positions after it, and the
+    root's data_size can be more than the number of games.
+
+    Only the root view starts expanded, since expanding every view would
+    make the whole tree.
+
+    === Private Attributes ===
+    _position: the position after the moves that lead to this view
+    """
+    __slots__ = ('_position',)
+
+    _position: _Position
+
+    def __init__(self, position: _Position, last_move: str = '-',
+                 white_to_play: bool = True) -> None:
+        """
+        Initialize a view of <position>, reached by the moves that end with
+        <last_move>. <last_move> and <white_to_play> are as for ChessTree.
+
+        The view is expanded if it is the starting position, which has a
+        <last_move> of '-'.
+
+        >>> view = ChessPositionView(_build_position_graph([['e2e4', 'e7e5'],
+        ...                                                 ['d2d4']]))
+        >>> print(view)
+        - | (2) None
+            e2e4 | (1) None
+                e7e5(1) None
+            d2d4(1) None
+        """
+        self._position = position
+        self._white_to_play = white_to_play
+        TMTree.__init__(self, last_move, [], position.data_size)
+        TMTree._subtrees.__set__(self, None)
+        self._expanded = last_move == '-' and bool(position.moves)
+
+    @property
+    def _subtrees(self) -> list[TMTree]:
+        """
+        The subtrees of this view, which are made the first time they are
+        used.
+        """
+        subtrees = TMTree._subtrees.__get__(self)
+        if subtrees is None:
+            subtrees = []
+            for move, position in self._position.moves.items():
+                if position.moves:
+                    subtree = ChessPositionView(position, move,
+                                                not self._white_to_play)
+                else:
+                    subtree = TMTree(move, [], position.games_ended)
+                subtree._parent_tree = self
+                subtrees.append(subtree)
+            TMTree._subtrees.__set__(self, subtrees)
+        return subtrees
+
+    @_subtrees.setter
+    def _subtrees(self, subtrees: list[TMTree]) -> None:
+        TMTree._subtrees.__set__(self, subtrees)
 
 
 if __name__ == '__main__':
@@ -1172,12 +3009,14 @@ if __name__ == '__main__':
         python_ta.check_all(config={
             'allowed-import-modules': [
                 'python_ta', 'typing', 'math', 'random', 'os', '__future__',
-                'webbrowser', 'json', 'chess'
+                'webbrowser', 'json', 'chess', 'concurrent.futures', 're',
+                'collections', 'itertools', 'sys', 'csv', 'time'
             ],
             'disable': ['C0302',  # disable max module length
                         'C0415'  # disable import-outside-toplevel for chess
                         ],
-            'allowed-io': ['ChessTree.open_page']
+            'allowed-io': ['ChessTree.open_page', 'ScanCache.__init__',
+                           'ScanCache.save']
         })
 
     # this should run after you finish Task 1
@@ -1196,8 +3035,7 @@ if __name__ == '__main__':
 
     print('=' * 80)
     # this should run after you finish Task 1
-    nested_tuple = path_to_nested_tuple("example-directory")
-    tree = dir_tree_from_nested_tuple(nested_tuple)
+    tree = path_to_dir_tree("example-directory")
     # after you finish task 2, the rectangles should be updated properly
     # and no longer be all None
     tree.update_rectangles((0, 0, 100, 200))
@@ -1206,10 +3044,7 @@ if __name__ == '__main__':
     print('=' * 80)
 
     # this should run after you finish Task 6
-    with open('wgm_10.json', 'r') as game_file:
-        GAME_LIST = json.load(game_file)
-    games = moves_to_nested_dict(GAME_LIST)
-    tree = ChessTree(games)
+    tree = ChessTree.from_json_file('wgm_10.json')
     # this tree will be quite large, so rather than printing the whole thing,
     # we can expand_all and print the path of the "last" tree as a simple check.
     print(tree.expand_all().get_path_string())
@@ -24,15 +24,16 @@ concrete subclass, of course), rendering it to the user using pygame,
 and detecting user events like mouse clicks and key presses and responding
 to them.
 """
-import json
 import os
+from collections import OrderedDict
 from typing import Optional
 import pygame
 
-from tm_trees import TMTree, path_to_nested_tuple
-from tm_trees import ChessTree, dir_tree_from_nested_tuple, \
-    moves_to_nested_dict, get_worksheet_tree
+from tm_trees import TMTree, ScanCache, path_to_dir_tree
+from tm_trees import ChessTree, get_worksheet_tree
 from tm_trees import OperationNotSupportedError
+from tm_trees import slice_layout, squarified_layout
+from tm_compact import CompactTree
 
 # Screen dimensions and coordinates
 # You may adjust these values as you'd like.
@@ -59,6 +60,17 @@ ANTI_ALIAS = True
 # the factor used when changing the size of a node
 DELTA = 0.01
 
+# the layouts that the l key switches between; the first one is used at the
+# start. squarified_layout gives rectangles that are closer to squares.
+LAYOUT_STRATEGIES = [slice_layout, squarified_layout]
+
+# the most batches of events that event_loop handles in a second
+MAX_FPS = 60
+# the number of recently shown texts whose rendered rows are kept
+TEXT_CACHE_SIZE = 64
+# the events after which the tree under the mouse may have changed
+_TREE_EVENTS = (pygame.WINDOWRESIZED, pygame.MOUSEBUTTONUP, pygame.KEYUP)
+
 # mapping of pygame key constants to the actions they correspond to.
 KEY_MAP = {pygame.K_m: 'm = move',
            pygame.K_UP: 'UP = increase size',
@@ -66,7 +78,8 @@ KEY_MAP = {pygame.K_m: 'm = move',
            pygame.K_e: 'e = expand',
            pygame.K_a: 'a = expand all',
            pygame.K_c: 'c = collapse',
-           pygame.K_x: 'x = collapse all'}
+           pygame.K_x: 'x = collapse all',
+           pygame.K_l: 'l = switch layout'}
 
 
 def get_screen_rect(screen: pygame.Surface,
@@ -103,6 +116,7 @@ def run_visualisation(tree: TMTree, name: str) -> None:
     pygame.display.set_caption(name)
 
     # Render the initial display of the treemap.
+    tree.set_layout_strategy(LAYOUT_STRATEGIES[0])
     tree.update_rectangles(get_screen_rect(screen, FONT_ROWS))
     render_display(screen, tree, None, None)
 
@@ -125,61 +139,275 @@ def render_display(screen: pygame.Surface, tree: Optional[TMTree],
     The <selected_node>, if not None, is highlighted in the visualization.
 
     The <hover_node>, if not None, is also highlighted in the visualization.
-    """
-    # First, clear the screen
-    pygame.draw.rect(screen, BLACK,
-                     get_screen_rect(screen, FONT_ROWS, True))
 
-    # Note: this should work after you have completed Task 2
-    try:
-        font_rows = _render_text(screen, _get_display_text(selected_node))
-        tree.update_rectangles(get_screen_rect(screen, font_rows))
-
-        subscreen = screen.subsurface(get_screen_rect(screen, font_rows))
+    This always redraws the whole screen. Use a TreemapRenderer to redraw
+    only the parts of the screen that change from one call to the next.
+    """
+    return TreemapRenderer(screen, tree).render(selected_node, hover_node)
 
-        # get the rectangles and draw them to the screen
-        for rect, colour in tree.get_rectangles():
-            pygame.draw.rect(subscreen, colour, rect)
 
+class TreemapRenderer:
+    """
+    A renderer that keeps the treemap of a tree drawn on an off-screen
+    surface between calls to render.
+
+    The displayed leaves are only drawn again when the result of
+    get_rectangles for the tree changes (it is the same list object until
+    the tree changes), or when the treemap area changes. Otherwise render
+    copies the areas of the previous highlights back from the off-screen
+    surface, draws the new highlights and text, and updates only those parts
+    of the display, so moving the mouse over a large treemap costs very
+    little.
+
+    === Private Attributes ===
+    _screen:
+        The screen to draw on.
+    _tree:
+        The tree whose treemap is drawn.
+    _treemap:
+        The off-screen surface with the displayed leaves drawn on it, or None
+        if nothing has been drawn yet.
+    _draw_list:
+        The result of get_rectangles that _treemap was drawn from.
+    _area:
+        The pygame rectangle of the screen that _treemap covers.
+    _text:
+        The text shown at the bottom of the screen.
+    _font_rows:
+        The number of rows used to show _text.
+    _highlights:
+        The areas of the screen covered by the highlights drawn by the last
+        call to render.
+    """
+    _screen: pygame.Surface
+    _tree: TMTree
+    _treemap: Optional[pygame.Surface]
+    _draw_list: Optional[list]
+    _area: tuple[int, int, int, int]
+    _text: str
+    _font_rows: int
+    _highlights: list[pygame.Rect]
+
+    def __init__(self, screen: pygame.Surface, tree: TMTree) -> None:
+        """Initialize a renderer for <tree> on <screen>, which has not drawn
+        anything yet.
+        """
+        self._screen = screen
+        self._tree = tree
+        self._treemap = None
+        self._draw_list = None
+        self._area = get_screen_rect(screen, FONT_ROWS)
+        self._text = ''
+        self._font_rows = FONT_ROWS
+        self._highlights = []
+
+    def render(self, selected_node: Optional[TMTree] = None,
+               hover_node: Optional[TMTree] = None) -> int:
+        """
+        Show the treemap with <selected_node> and <hover_node> highlighted
+        and the text for <selected_node>, like render_display, and return the
+        number of rows used to display the text.
+        """
+        try:
+            text = _get_display_text(selected_node)
+            if self._is_current():
+                dirty = list(self._highlights)
+                if text != self._text:
+                    dirty.append(self._render_text_bar(text))
+                if self._is_current():
+                    self._restore(dirty)
+                    dirty.extend(self._draw_highlights(selected_node,
+                                                       hover_node))
+                    pygame.display.update(dirty)
+                    return self._font_rows
+            self._render_all(text, selected_node, hover_node)
+        except Exception as e:
+            print("Possibly an error in Task 2 code. "
+                  "See detailed error message.")
+            raise e
+        return self._font_rows
+
+    def _is_current(self) -> bool:
+        """
+        Return whether _treemap still shows the displayed leaves of the tree
+        in the current treemap area.
+        """
+        return self._treemap is not None \
+            and self._area == get_screen_rect(self._screen, self._font_rows) \
+            and self._tree.rect == self._area \
+            and self._tree.get_rectangles() is self._draw_list
+
+    def _render_all(self, text: str, selected_node: Optional[TMTree],
+                    hover_node: Optional[TMTree]) -> None:
+        """
+        Draw the whole screen again, and the displayed leaves onto a new
+        off-screen surface.
+        """
+        screen = self._screen
+        # First, clear the screen
+        pygame.draw.rect(screen, BLACK,
+                         get_screen_rect(screen, FONT_ROWS, True))
+        self._text = text
+        self._font_rows = _render_text(screen, text)
+        self._area = get_screen_rect(screen, self._font_rows)
+        # only lay the tree out again if the treemap area has changed, so that
+        # the rectangles cached by get_rectangles can be reused
+        if self._tree.rect != self._area:
+            self._tree.update_rectangles(self._area)
+
+        self._draw_list = self._tree.get_rectangles()
+        self._treemap = pygame.Surface(self._area[2:])
+        for rect, colour in self._draw_list:
+            pygame.draw.rect(self._treemap, colour, rect)
+        screen.blit(self._treemap, self._area[:2])
+        self._draw_highlights(selected_node, hover_node)
+
+        # This must be called *after* all other pygame functions have run
+        # in order to update the screen.
+        pygame.display.flip()
+
+    def _render_text_bar(self, text: str) -> pygame.Rect:
+        """
+        Show <text> at the bottom of the screen instead of the current text,
+        and return the area of the screen that changed.
+
+        If <text> needs a different number of rows, the treemap area changes,
+        so _is_current becomes False.
+        """
+        width, height = self._screen.get_size()
+        top = self._area[1] + self._area[3]
+        bar = pygame.Rect(0, top, width, height - top)
+        self._screen.fill(BLACK, bar)
+        self._text = text
+        self._font_rows = _render_text(self._screen, text)
+        return bar
+
+    def _restore(self, areas: list[pygame.Rect]) -> None:
+        """
+        Copy the parts of <areas> that are in the treemap area back from the
+        off-screen surface, which removes any highlights drawn there.
+        """
+        treemap_area = pygame.Rect(self._area)
+        for area in areas:
+            area = area.clip(treemap_area)
+            if area.width and area.height:
+                self._screen.blit(self._treemap, area,
+                                  area.move(-treemap_area.x, -treemap_area.y))
+
+    def _draw_highlights(self, selected_node: Optional[TMTree],
+                         hover_node: Optional[TMTree]) -> list[pygame.Rect]:
+        """
+        Draw the outlines of <selected_node> and <hover_node>, inside the
+        treemap area, and return the areas of the screen that they cover.
+        """
+        x, y = self._area[:2]
+        self._screen.set_clip(self._area)
+        self._highlights = []
         # add the selected and hover rectangles if necessary
-        if selected_node is not None:
-            pygame.draw.rect(subscreen, WHITE, selected_node.rect,
-                             SELECTED_HIGHLIGHT)
-        if hover_node is not None:
-            pygame.draw.rect(subscreen, WHITE, hover_node.rect,
-                             HOVER_HIGHLIGHT)
+        for node, width in [(selected_node, SELECTED_HIGHLIGHT),
+                            (hover_node, HOVER_HIGHLIGHT)]:
+            if node is not None:
+                rect = pygame.Rect(node.rect).move(x, y)
+                self._highlights.append(
+                    pygame.draw.rect(self._screen, WHITE, rect, width))
+        self._screen.set_clip(None)
+        return self._highlights
 
-    except Exception as e:
-        print("Possibly an error in Task 2 code. See detailed error message.")
-        raise e
 
-    # This must be called *after* all other pygame functions have run
-    # in order to update the screen.
-    pygame.display.flip()
-    return font_rows
+class FontManager:
+    """
+    Loads each font once, and keeps the rows of text rendered with them for
+    the most recently shown texts.
+
+    Fonts cannot be used once pygame has quit, so everything is dropped when
+    it does.
+
+    === Private Attributes ===
+    _fonts:
+        The fonts loaded so far, by family and size.
+    _lines:
+        The surfaces of the rows of each recently rendered text, by text,
+        family, size and width to wrap to, least recently used first.
+    _max_texts:
+        The most texts whose rows are kept in _lines.
+    """
+    _fonts: dict[tuple[str, int], pygame.font.Font]
+    _lines: OrderedDict[tuple[str, str, int, int], list[pygame.Surface]]
+    _max_texts: int
+
+    def __init__(self, max_texts: int = TEXT_CACHE_SIZE) -> None:
+        """Initialize a manager with nothing loaded that keeps the rows of
+        at most <max_texts> texts.
+        """
+        self._fonts = {}
+        self._lines = OrderedDict()
+        self._max_texts = max_texts
+
+    def get_font(self, family: str, size: int) -> pygame.font.Font:
+        """Return the system font <family> at <size>, loading it the first
+        time it is asked for.
+        """
+        font = self._fonts.get((family, size))
+        if font is None:
+            if not self._fonts:
+                pygame.register_quit(self.clear)
+            font = pygame.font.SysFont(family, size)
+            self._fonts[(family, size)] = font
+        return font
+
+    def render_lines(self, text: str, family: str, size: int,
+                     width: int) -> list[pygame.Surface]:
+        """Return the rows of <text> rendered in white with the font <family>
+        at <size>, wrapped to fit in <width> pixels.
+
+        The text is measured once, and split into rows of equal numbers of
+        characters, enough of them for each to fit.
+        """
+        key = (text, family, size, width)
+        lines = self._lines.get(key)
+        if lines is not None:
+            self._lines.move_to_end(key)
+            return lines
+
+        font = self.get_font(family, size)
+        text_width, _ = font.size(text)  # _ since we ignore the text_height
+        height = int(1 + text_width / width)
+        n_char = int(1 + len(text) / height)
+        lines = [font.render(text[h * n_char:(h + 1) * n_char], ANTI_ALIAS,
+                             WHITE)
+                 for h in range(height)]
+        self._lines[key] = lines
+        if len(self._lines) > self._max_texts:
+            self._lines.popitem(last=False)
+        return lines
+
+    def clear(self) -> None:
+        """Drop every font and rendered text.
+        """
+        self._fonts.clear()
+        self._lines.clear()
+
+
+# the fonts used by _render_text
+FONTS = FontManager()
 
 
 def _render_text(screen: pygame.Surface, text: str) -> int:
     """
     Render <text> at the bottom of the <screen>.
     Return the number of rows needed to display the <text>.
-    """
-
-    # The font we want to use
-    font = pygame.font.SysFont(FONT_FAMILY, FONT_HEIGHT - 2 * FONT_OFFSET)
 
-    # fix this...
-    text_width, _ = font.size(text)  # _ since we ignore the text_height
-    height = int(1 + text_width / screen.get_width())
-    n_char = int(1 + len(text) / height)
+    The rows of the text are rendered by FONTS, so showing a text again only
+    copies them to the screen.
+    """
+    lines = FONTS.render_lines(text, FONT_FAMILY,
+                               FONT_HEIGHT - 2 * FONT_OFFSET,
+                               screen.get_width())
 
-    font_rows = height
-    for h in range(height):
+    font_rows = len(lines)
+    for h, text_surface in enumerate(lines):
         offset = (font_rows - h) * (FONT_HEIGHT + FONT_OFFSET/2)
         text_pos = (0, screen.get_height() - offset)
-        text_surface = font.render(text[h * n_char:(h + 1) * n_char],
-                                   ANTI_ALIAS,
-                                   WHITE)
         screen.blit(text_surface, text_pos)
     return font_rows
 
@@ -192,6 +420,12 @@ def event_loop(screen: pygame.Surface, tree: TMTree, font_rows: int) -> None:
     of the visualisation or the <tree> itself, updating the
     display if necessary.
 
+    The loop sleeps until an event arrives, and then handles every event
+    that is already queued as one batch, at most MAX_FPS batches a second.
+    Mouse motion is coalesced: the node under the mouse is only looked up
+    again once the mouse has moved (or the tree may have changed under it),
+    and before an event that uses it is handled.
+
     <font_rows> tells us how many rows of the display to use to show the
     text for the currently selected node.
 
@@ -199,53 +433,109 @@ def event_loop(screen: pygame.Surface, tree: TMTree, font_rows: int) -> None:
     """
     selected_node = None
     hover_node = None
+    layout_index = 0
+    renderer = TreemapRenderer(screen, tree)
+    clock = pygame.time.Clock()
+    mouse_pos = pygame.mouse.get_pos()
+    hover_stale = True
 
     while True:
-        # Wait for an event
-        event = pygame.event.poll()
-        if event.type == pygame.QUIT:
-            return
-
-        # handle resize event...
-        if event.type == pygame.WINDOWRESIZED:
-            print(f"window resized: {get_screen_rect(screen, font_rows)}")
-            # this should work once you have completed Task 2
-            tree.update_rectangles(get_screen_rect(screen, font_rows))
-
-        # get the hover position and the corresponding node
-        old_hover_node = hover_node
-        hover_node = tree.get_tree_at_position(pygame.mouse.get_pos())
-
-        if hover_node != old_hover_node:
-            # Update display
-            if hover_node:
-                print(f"hover node changed to {hover_node.get_path_string()}")
-            font_rows = render_display(screen, tree, selected_node, hover_node)
-
-        if event.type == pygame.MOUSEBUTTONUP:
-            selected_node = _handle_click(event.button, event.pos,
-                                          tree, selected_node)
-            # Update display
-            font_rows = render_display(screen, tree, selected_node, hover_node)
-
-        elif event.type == pygame.KEYUP and selected_node is not None:
-            if event.key in KEY_MAP:
-                print(f"[{KEY_MAP.get(event.key)}]")
-                sn = selected_node
-                selected_node = execute_task_4_expand_collapse_actions(event,
-                                                                       sn)
-                execute_task_4_other_actions(event, hover_node, selected_node)
-
-                execute_task_6_open_action(event, selected_node)
-            else:
-                print(f"Unrecognized key pressed, recognized keys are:")
-                for value in KEY_MAP.values():
-                    print(value)
-
-            # Update display
-            font_rows = render_display(screen, tree, selected_node, hover_node)
-        elif event.type == pygame.KEYUP and selected_node is None:
-            print(f"key pressed, but no node selected!")
+        # Wait for an event, then take the rest of the batch
+        events = [pygame.event.wait()]
+        events.extend(pygame.event.get())
+        for event in events:
+            if event.type == pygame.QUIT:
+                return
+            if event.type == pygame.MOUSEMOTION:
+                mouse_pos = event.pos
+                hover_stale = True
+                continue
+            if hover_stale:
+                hover_node, font_rows = _update_hover(
+                    renderer, tree, mouse_pos, selected_node, hover_node,
+                    font_rows)
+                hover_stale = False
+            selected_node, layout_index, font_rows = _handle_event(
+                event, tree, screen, renderer, selected_node, hover_node,
+                layout_index, font_rows)
+            if event.type in _TREE_EVENTS:
+                # the node under the mouse may have changed
+                hover_stale = True
+
+        if hover_stale:
+            hover_node, font_rows = _update_hover(
+                renderer, tree, mouse_pos, selected_node, hover_node,
+                font_rows)
+            hover_stale = False
+        clock.tick(MAX_FPS)
+
+
+def _update_hover(renderer: TreemapRenderer, tree: TMTree,
+                  mouse_pos: tuple[int, int], selected_node: Optional[TMTree],
+                  hover_node: Optional[TMTree],
+                  font_rows: int) -> tuple[Optional[TMTree], int]:
+    """
+    Return the node of <tree> at <mouse_pos> and the number of rows used to
+    show the text of <selected_node>, rendering the display again with
+    <renderer> if the node at <mouse_pos> is not <hover_node>.
+    """
+    old_hover_node = hover_node
+    hover_node = tree.get_tree_at_position(mouse_pos)
+
+    if hover_node != old_hover_node:
+        # Update display
+        if hover_node:
+            print(f"hover node changed to {hover_node.get_path_string()}")
+        font_rows = renderer.render(selected_node, hover_node)
+    return hover_node, font_rows
+
+
+def _handle_event(event: pygame.event.Event, tree: TMTree,
+                  screen: pygame.Surface, renderer: TreemapRenderer,
+                  selected_node: Optional[TMTree],
+                  hover_node: Optional[TMTree], layout_index: int,
+                  font_rows: int) -> tuple[Optional[TMTree], int, int]:
+    """
+    Handle <event>, other than quitting and mouse motion, and return the
+    new selected node, index into LAYOUT_STRATEGIES and number of rows used
+    to show the text of the selected node.
+    """
+    # handle resize event...
+    if event.type == pygame.WINDOWRESIZED:
+        print(f"window resized: {get_screen_rect(screen, font_rows)}")
+        # this should work once you have completed Task 2
+        tree.update_rectangles(get_screen_rect(screen, font_rows))
+
+    if event.type == pygame.MOUSEBUTTONUP:
+        selected_node = _handle_click(event.button, event.pos,
+                                      tree, selected_node)
+        # Update display
+        font_rows = renderer.render(selected_node, hover_node)
+
+    elif event.type == pygame.KEYUP and event.key == pygame.K_l:
+        print(f"[{KEY_MAP.get(event.key)}]")
+        layout_index = (layout_index + 1) % len(LAYOUT_STRATEGIES)
+        tree.set_layout_strategy(LAYOUT_STRATEGIES[layout_index])
+        font_rows = renderer.render(selected_node, hover_node)
+
+    elif event.type == pygame.KEYUP and selected_node is not None:
+        if event.key in KEY_MAP:
+            print(f"[{KEY_MAP.get(event.key)}]")
+            sn = selected_node
+            selected_node = execute_task_4_expand_collapse_actions(event, sn)
+            execute_task_4_other_actions(event, hover_node, selected_node)
+
+            execute_task_6_open_action(event, selected_node)
+        else:
+            print(f"Unrecognized key pressed, recognized keys are:")
+            for value in KEY_MAP.values():
+                print(value)
+
+        # Update display
+        font_rows = renderer.render(selected_node, hover_node)
+    elif event.type == pygame.KEYUP and selected_node is None:
+        print(f"key pressed, but no node selected!")
+    return selected_node, layout_index, font_rows
 
 
 def execute_task_6_open_action(event: pygame.event.Event,
@@ -356,9 +646,21 @@ def _get_display_text(leaf: Optional[TMTree]) -> str:
     return f'{leaf.get_path_string()} ({leaf.data_size})'
 
 
-def run_treemap_file_system(path: str) -> None:
+def run_treemap_file_system(path: str,
+                            cache_path: Optional[str] = None,
+                            snapshot_path: Optional[str] = None,
+                            rescan: bool = False) -> None:
     """Run a treemap visualisation for the given path's file structure.
 
+    If <cache_path> is not None, the scan reuses the directory listings saved
+    in the ScanCache file at <cache_path> by the previous run, and saves them
+    there for the next one. Files edited in place since then keep their old
+    sizes, unless <rescan> is True, in which case every directory is listed
+    again.
+
+    If <snapshot_path> is not None, the scanned tree is also saved there as a
+    snapshot, which run_treemap_snapshot can open later without scanning.
+
     Precondition: <path> is a valid path to a directory.
 
     If the provided <path> violates this precondition, this code will raise
@@ -367,23 +669,43 @@ def run_treemap_file_system(path: str) -> None:
     if not os.path.isdir(path):
         raise ValueError(f"{path} is not a path to a valid directory!")
 
-    file_tree_tuple = path_to_nested_tuple(path)
-    file_tree = dir_tree_from_nested_tuple(file_tree_tuple)
+    if cache_path is None:
+        file_tree = path_to_dir_tree(path)
+    else:
+        cache = ScanCache(cache_path, rescan)
+        file_tree = path_to_dir_tree(path, cache=cache)
+        cache.save()
+    if snapshot_path is not None:
+        CompactTree.from_tmtree(file_tree).save_snapshot(snapshot_path)
     run_visualisation(file_tree, "file system visualizer")
 
 
+def run_treemap_snapshot(path: str) -> None:
+    """Run a treemap visualisation for the tree saved at <path> by
+    CompactTree.save_snapshot, without rescanning or reparsing its source.
+
+    Precondition: <path> is a snapshot file written by
+    CompactTree.save_snapshot.
+    """
+    store = CompactTree.load_snapshot(path)
+    run_visualisation(store.node(store.root), "snapshot visualizer")
+
+
 # the names of the three chess data sets
 CHESS_DATA_SETS = [f"wgm_{num_games}.json" for num_games in [10, 200, 999]]
 
 
-def run_treemap_chess() -> None:
+def run_treemap_chess(snapshot_path: Optional[str] = None) -> None:
     """Run a treemap visualization for chess games.
+
+    If <snapshot_path> is not None, the tree is also saved there as a
+    snapshot, which run_treemap_snapshot can open later without parsing the
+    games again.
     """
     # you can choose which data set to load or make your own!
-    with open(CHESS_DATA_SETS[0]) as file:
-        chess_moves = json.load(file)
-    chess_dict = moves_to_nested_dict(chess_moves)
-    chess_tree = ChessTree(chess_dict)
+    chess_tree = ChessTree.from_json_file(CHESS_DATA_SETS[0])
+    if snapshot_path is not None:
+        CompactTree.from_tmtree(chess_tree).save_snapshot(snapshot_path)
     run_visualisation(chess_tree, "chess tree visualizer")
 
 
@@ -405,10 +727,15 @@ if __name__ == '__main__':
     # To check your work, you can try running the visualizer.
     # Reminder, you are encouraged to modify this while trying out your code.
 
-    RUN_OPTIONS = ['TMTree', 'DirectoryTree', 'ChessTree']
+    RUN_OPTIONS = ['TMTree', 'DirectoryTree', 'ChessTree', 'Snapshot']
     which = RUN_OPTIONS[2]
     # change the line above to choose which type of tree to visualize.
 
+    # the DirectoryTree and ChessTree options save their tree to this file,
+    # and the Snapshot option reopens it without scanning or parsing again.
+    # Set it to None to not save snapshots.
+    SNAPSHOT_PATH = os.path.join(".", "treemap.tmsnap")
+
     if which == RUN_OPTIONS[0]:
         # To check your work for TMTree, try running this.
         print("running generic treemap visualizer!")
@@ -418,10 +745,14 @@ if __name__ == '__main__':
         # Feel free to try different paths.
         PATH = os.path.join(".", "example-directory")
         print(f"running file system treemap visualizer on path: {PATH}")
-        run_treemap_file_system(PATH)
+        run_treemap_file_system(PATH, snapshot_path=SNAPSHOT_PATH)
     elif which == RUN_OPTIONS[2]:
         # To check your work for Task 6, try running this.
         print("running chess treemap visualizer!")
-        run_treemap_chess()
+        run_treemap_chess(SNAPSHOT_PATH)
+    elif which == RUN_OPTIONS[3]:
+        # Open the tree saved by an earlier run with SNAPSHOT_PATH set.
+        print(f"running snapshot treemap visualizer on: {SNAPSHOT_PATH}")
+        run_treemap_snapshot(SNAPSHOT_PATH)
     else:
         print("invalid option chosen!")